@@ -1,5 +1,29 @@
-from ChemScraper.pubchem import *
-from ChemScraper.schema import Compound
 from ChemScraper.settings import *
 from ChemScraper.utils import *
-from ChemScraper.vscraper import *
+from ChemScraper.utils.lazy import lazy_exports
+from ChemScraper import catalog as _catalog, pubchem as _pubchem, vscraper as _vscraper
+
+"""
+the public api, names from `pubchem`, `vscraper`, `catalog`, `campaign`, `pipeline`, `network` and `schema` are
+imported on first use so `import ChemScraper` does not load rdkit, selenium or pandas, settings and utils are imported
+eagerly
+"""
+
+_exports = {
+    "Campaign": "ChemScraper.campaign",
+    "Pipeline": "ChemScraper.pipeline",
+    "Stage": "ChemScraper.pipeline",
+    "StageError": "ChemScraper.pipeline",
+    "compound_vendor_pipeline": "ChemScraper.pipeline",
+    "annotate_network": "ChemScraper.network",
+    "annotate_network_file": "ChemScraper.network",
+    "Compound": "ChemScraper.schema",
+    **{name: "ChemScraper.pubchem" for name in _pubchem.__all__},
+    **{name: "ChemScraper.vscraper" for name in _vscraper.__all__},
+    **{name: "ChemScraper.catalog" for name in _catalog.__all__},
+}
+
+# `from ChemScraper import *` still gives the whole api, loading everything
+__all__ = [name for name in globals() if not name.startswith("_") and name != "lazy_exports"] + list(_exports)
+
+__getattr__, __dir__ = lazy_exports(__name__, _exports)
@@ -0,0 +1,5 @@
+import sys
+
+from ChemScraper.cli import main
+
+sys.exit(main())
@@ -0,0 +1,244 @@
+import json
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Iterable, Iterator, Union
+
+from loguru import logger
+from monty.json import MontyEncoder
+from tqdm import tqdm
+
+from ChemScraper.utils import FilePath, RateLimiter, metrics_registry
+
+"""
+resumable scraping campaigns
+
+a campaign is one sqlite file holding
+- a task table, each task is pending -> running -> done, or failed once its retries are used up
+- an append-only result table, written in the same transaction that marks a task done
+
+an interrupted campaign is resumed by running it again, tasks left running by the previous process are reset to pending,
+progress can be queried from another process while the campaign runs
+"""
+
+TaskStates = ('pending', 'running', 'done', 'failed')
+
+
+def _task_key(item) -> str:
+    if isinstance(item, str):
+        return item
+    return json.dumps(item, sort_keys=True, cls=MontyEncoder)
+
+
+class Campaign:
+
+    def __init__(self, path: FilePath):
+        """
+        :param path: sqlite database file, created if missing
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "key TEXT PRIMARY KEY, payload TEXT NOT NULL, state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "not_before REAL NOT NULL DEFAULT 0, error TEXT, updated REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, not_before)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, result TEXT NOT NULL, "
+            "elapsed REAL NOT NULL, finished REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_finished ON results (finished)")
+        self._conn.commit()
+
+    def add(self, items: Iterable[Any], key: Callable[[Any], str] = _task_key) -> int:
+        """
+        add tasks, items already in the campaign are ignored whatever their state
+
+        :param items: task payloads, anything json serializable
+        :param key: function giving the unique key of an item, default to the item itself for strings
+        :return: number of tasks added
+        """
+        now = time.time()
+        rows = {key(item): json.dumps(item, cls=MontyEncoder) for item in items}
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO tasks (key, payload, state, updated) VALUES (?, ?, 'pending', ?)",
+                [(k, payload, now) for k, payload in rows.items()],
+            )
+            self._conn.commit()
+            return self._conn.total_changes - before
+
+    def reset(self, states: Iterable[str] = ('running',)) -> int:
+        """
+        put tasks back to pending with their attempts cleared, e.g. `reset(['failed'])` to give failures another go
+
+        :return: number of tasks reset
+        """
+        states = list(states)
+        if len(states) == 0:
+            return 0
+        with self._lock:
+            n = self._conn.execute(
+                f"UPDATE tasks SET state = 'pending', attempts = 0, not_before = 0, updated = ? "
+                f"WHERE state IN ({','.join('?' * len(states))})", [time.time(), *states]
+            ).rowcount
+            self._conn.commit()
+        return n
+
+    def _claim(self, n: int) -> list[tuple[str, Any]]:
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, payload FROM tasks WHERE state = 'pending' AND not_before <= ? "
+                "ORDER BY rowid LIMIT ?", (now, n)
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE tasks SET state = 'running', updated = ? WHERE key = ?", [(now, k) for k, _ in rows]
+            )
+            self._conn.commit()
+        return [(k, json.loads(payload)) for k, payload in rows]
+
+    def _next_retry(self) -> Union[float, None]:
+        with self._lock:
+            return self._conn.execute("SELECT MIN(not_before) FROM tasks WHERE state = 'pending'").fetchone()[0]
+
+    def _done(self, key: str, text: str, elapsed: float):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO results (key, result, elapsed, finished) VALUES (?, ?, ?, ?)", (key, text, elapsed, now)
+            )
+            self._conn.execute(
+                "UPDATE tasks SET state = 'done', error = NULL, updated = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+
+    def _failed(self, key: str, error: Exception, max_retries: int, backoff: float, max_backoff: float) -> str:
+        now = time.time()
+        with self._lock:
+            attempts = self._conn.execute("SELECT attempts FROM tasks WHERE key = ?", (key,)).fetchone()[0] + 1
+            if attempts > max_retries:
+                state, not_before = 'failed', 0
+                logger.critical(f"task FAILED after {attempts} attempts: {key}")
+            else:
+                delay = min(max_backoff, backoff * 2 ** (attempts - 1)) * (1 + random.random() * 0.2)
+                state, not_before = 'pending', now + delay
+                metrics_registry.inc("chemscraper_retries_total", call="campaign")
+                logger.warning(f"task failed, retry in {delay:.1f} s: {key}")
+            self._conn.execute(
+                "UPDATE tasks SET state = ?, attempts = ?, not_before = ?, error = ?, updated = ? WHERE key = ?",
+                (state, attempts, not_before, f"{error.__class__.__name__}: {error}", now, key),
+            )
+            self._conn.commit()
+        return state
+
+    def run(
+            self, func: Callable[[Any], Any], max_workers: int = 4, max_retries: int = 3, backoff: float = 5,
+            max_backoff: float = 300, limiter: RateLimiter = None, progress: bool = True,
+    ) -> dict[str, int]:
+        """
+        run all pending tasks, returns once no task is pending or running
+
+        :param func: called with the payload of a task, its return value (json serializable) is the result
+        :param max_workers: tasks run at the same time
+        :param max_retries: a task is failed after this many retries, any exception counts as a failure
+        :param backoff: seconds before the first retry, doubled for every further retry
+        :param max_backoff: upper bound of the delay before a retry
+        :param limiter: if given, acquired before each task starts
+        :param progress: show a progress bar
+        :return: task counts by state, see `progress`
+        """
+        resumed = self.reset(['running'])
+        if resumed:
+            logger.info(f"resumed {resumed} tasks left running by a previous run")
+
+        def _task(payload):
+            if limiter is not None:
+                limiter.acquire()
+            ts = time.perf_counter()
+            result = func(payload)
+            elapsed = time.perf_counter() - ts
+            # a result that cannot be stored fails the task like an exception of `func`
+            return json.dumps(result, cls=MontyEncoder), elapsed
+
+        counts = self.progress()
+        pbar = tqdm(total=counts['total'], initial=counts['done'] + counts['failed'], disable=not progress)
+        in_flight = dict()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor, pbar:
+            while True:
+                for key, payload in self._claim(2 * max_workers - len(in_flight)):
+                    in_flight[executor.submit(_task, payload)] = key
+                if not in_flight:
+                    next_retry = self._next_retry()
+                    if next_retry is None:
+                        break
+                    time.sleep(max(0.0, min(next_retry - time.time(), 1.0)))
+                    continue
+                # wake up at least every second to pick up retries that became due
+                finished, _ = wait(in_flight, timeout=1.0, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    key = in_flight.pop(future)
+                    try:
+                        text, elapsed = future.result()
+                    except Exception as e:
+                        if self._failed(key, e, max_retries, backoff, max_backoff) == 'failed':
+                            pbar.update(1)
+                        continue
+                    self._done(key, text, elapsed)
+                    pbar.update(1)
+                    pbar.set_postfix(rate=f"{self.rate():.2f}/s")
+        counts = self.progress()
+        logger.info(f"campaign finished: {counts}")
+        return counts
+
+    def progress(self) -> dict[str, int]:
+        """
+        :return: {"pending": ..., "running": ..., "done": ..., "failed": ..., "total": ...}
+        """
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state"))
+        counts = {state: counts.get(state, 0) for state in TaskStates}
+        counts['total'] = sum(counts.values())
+        return counts
+
+    def rate(self, window: float = 60) -> float:
+        """
+        :return: tasks done per second over the last `window` seconds
+        """
+        with self._lock:
+            n, first = self._conn.execute(
+                "SELECT COUNT(*), MIN(finished) FROM results WHERE finished >= ?", (time.time() - window,)
+            ).fetchone()
+        if n == 0:
+            return 0.0
+        return n / max(time.time() - first, 1.0)
+
+    def failures(self) -> list[tuple[str, int, str]]:
+        """
+        :return: a list of (key, attempts, last error) of failed tasks
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT key, attempts, error FROM tasks WHERE state = 'failed' ORDER BY rowid"
+            ).fetchall()
+
+    def iter_results(self) -> Iterator[tuple[str, Any]]:
+        """
+        :return: a generator of (task key, result) in the order tasks finished,
+            a task reset and run again has one result per run, the last one wins in a dict
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT key, result FROM results ORDER BY id").fetchall()
+        for key, text in rows:
+            yield key, json.loads(text)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
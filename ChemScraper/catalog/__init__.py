@@ -0,0 +1,16 @@
+from ChemScraper.utils.lazy import lazy_exports
+
+"""
+offline lookups and substructure/similarity search in downloaded vendor catalogues
+"""
+
+_exports = {
+    "VendorIndex": "ChemScraper.catalog.index",
+    "build_vendor_index": "ChemScraper.catalog.index",
+    "CatalogSearch": "ChemScraper.catalog.search",
+    "build_fingerprint_index": "ChemScraper.catalog.search",
+}
+
+__all__ = list(_exports)
+
+__getattr__, __dir__ = lazy_exports(__name__, _exports)
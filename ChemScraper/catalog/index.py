@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+import time
+from typing import Iterable, Union
+
+import numpy as np
+from loguru import logger
+
+from ChemScraper.utils import FilePath, createdir, canon_smiles_many, smiles2inchikey_many
+from ChemScraper.utils.columnar import read_table
+
+"""
+an offline index of a vendor catalogue downloaded with `download_vendor_compounds`
+
+the index is a folder of .npy arrays opened with `np.load(mmap_mode='r')`, so loading it is instant and
+only the pages touched by a query are read:
+- `cid.npy`, `mw.npy`: one entry per catalogue row
+- `smiles_hash.npy`, `inchikey_hash.npy`: sorted 64-bit hashes of canonical smiles / inchikeys,
+  with `*_rows.npy` giving the row of each hash
+- `mw_sorted.npy`, `mw_rows.npy`: molecular weights in ascending order and their rows
+
+`meta.json` lists the arrays of the index, the `fp_*` arrays of `ChemScraper.catalog.search` share the folder,
+rows without a cid are dropped from both
+
+exact lookups are binary searches over the sorted hashes, with 64-bit hashes a false match is expected about once
+in 1e19 / n_rows queries
+"""
+
+_IndexMeta = "meta.json"
+
+
+def hash_keys(keys: Iterable[Union[str, None]]) -> np.ndarray:
+    """
+    :return: uint64 blake2b hashes of the keys, 0 for None
+    """
+    return np.fromiter(
+        (0 if k is None else int.from_bytes(hashlib.blake2b(k.encode(), digest_size=8).digest(), "little")
+         for k in keys),
+        dtype=np.uint64,
+    )
+
+
+def _sorted_with_rows(values: np.ndarray, valid: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+    rows = np.arange(len(values), dtype=np.int64)
+    if valid is not None:
+        rows = rows[valid]
+    order = np.argsort(values[rows], kind="stable")
+    return values[rows][order], rows[order]
+
+
+def read_catalog(table_file: FilePath, cid_column: str = 'cid') -> tuple["pd.DataFrame", int]:
+    """
+    read a csv/parquet file of `download_vendor_compounds` without the rows that have no cid
+
+    :return: (table, number of dropped rows)
+    """
+    df = read_table(table_file)
+    missing = df[cid_column].isna()
+    n_missing = int(missing.sum())
+    if n_missing:
+        logger.warning(f"dropping {n_missing} rows without a cid from: {table_file}")
+        df = df[~missing].reset_index(drop=True)
+    return df, n_missing
+
+
+def build_vendor_index(
+        table_file: FilePath, index_dir: FilePath, smiles_column: str = 'isosmiles', cid_column: str = 'cid',
+        mw_column: str = 'mw', inchikey_column: str = 'inchikey', compute_inchikeys: bool = True,
+        processes: int = None,
+) -> "VendorIndex":
+    """
+    build an index from a csv/parquet file of `download_vendor_compounds`
+
+    :param smiles_column: smiles are canonicalized with `canon_smiles_many` (stereo kept)
+    :param inchikey_column: used if the file has it, e.g. downloaded with field_string="cid,mw,isosmiles,inchikey"
+    :param compute_inchikeys: compute inchikeys from smiles when the file has none, otherwise skip inchikey lookups
+    :param processes: process pool size for smiles conversions
+    """
+    ts = time.perf_counter()
+    df, n_missing = read_catalog(table_file, cid_column)
+    logger.info(f"indexing {len(df)} rows from: {table_file}")
+    smis = df[smiles_column].where(df[smiles_column].notna(), None).tolist()
+    canonical, invalid = canon_smiles_many(smis, processes=processes)
+    if inchikey_column in df.columns:
+        inchikeys = df[inchikey_column].where(df[inchikey_column].notna(), None).tolist()
+    elif compute_inchikeys:
+        inchikeys, _ = smiles2inchikey_many(canonical, processes=processes)
+    else:
+        inchikeys = None
+
+    createdir(index_dir)
+    arrays = {
+        "cid": df[cid_column].to_numpy(dtype=np.int64),
+        "mw": df[mw_column].to_numpy(dtype=np.float64),
+    }
+    smiles_hash = hash_keys(canonical)
+    arrays["smiles_hash"], arrays["smiles_rows"] = _sorted_with_rows(smiles_hash, smiles_hash != 0)
+    if inchikeys is not None:
+        inchikey_hash = hash_keys(inchikeys)
+        arrays["inchikey_hash"], arrays["inchikey_rows"] = _sorted_with_rows(inchikey_hash, inchikey_hash != 0)
+    arrays["mw_sorted"], arrays["mw_rows"] = _sorted_with_rows(arrays["mw"], ~np.isnan(arrays["mw"]))
+    # arrays of an earlier build that this one does not write, e.g. inchikeys, fingerprints are kept
+    for fn in os.listdir(index_dir):
+        if fn.endswith(".npy") and not fn.startswith("fp_") and fn[:-len(".npy")] not in arrays:
+            os.remove(os.path.join(index_dir, fn))
+    for name, array in arrays.items():
+        np.save(os.path.join(index_dir, f"{name}.npy"), array)
+    with open(os.path.join(index_dir, _IndexMeta), "w") as f:
+        json.dump({
+            "source": os.path.abspath(table_file),
+            "rows": len(df),
+            "rows_without_cid": n_missing,
+            "invalid_smiles": len(invalid),
+            "has_inchikey": inchikeys is not None,
+            "arrays": list(arrays),
+            "created": time.time(),
+        }, f, indent=2)
+    logger.info(f"vendor index built in {time.perf_counter() - ts:.1f} s: {index_dir}")
+    return VendorIndex(index_dir)
+
+
+def _member(sorted_hashes: np.ndarray, hashes: np.ndarray) -> np.ndarray:
+    pos = np.searchsorted(sorted_hashes, hashes)
+    found = np.zeros(len(hashes), dtype=bool)
+    inside = pos < len(sorted_hashes)
+    found[inside] = sorted_hashes[pos[inside]] == hashes[inside]
+    return found & (hashes != 0)
+
+
+def _lookup(sorted_hashes: np.ndarray, rows: np.ndarray, hashes: np.ndarray) -> list[np.ndarray]:
+    left = np.searchsorted(sorted_hashes, hashes, side="left")
+    right = np.searchsorted(sorted_hashes, hashes, side="right")
+    return [np.asarray(rows[i:j]) if h != 0 else rows[:0] for i, j, h in zip(left, right, hashes)]
+
+
+class VendorIndex:
+
+    def __init__(self, index_dir: FilePath):
+        """
+        open an index written by `build_vendor_index`, arrays are memory mapped
+        """
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, _IndexMeta)) as f:
+            self.meta = json.load(f)
+        self.arrays = {
+            name: np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r") for name in self.meta["arrays"]
+        }
+
+    def __len__(self):
+        return len(self.arrays["cid"])
+
+    def _smiles_hashes(self, smis: Iterable[str], canonicalize: bool) -> np.ndarray:
+        smis = list(smis)
+        if canonicalize:
+            smis, _ = canon_smiles_many(smis)
+        return hash_keys(smis)
+
+    def _inchikey_hashes(self, inchikeys: Iterable[str]) -> np.ndarray:
+        if "inchikey_hash" not in self.arrays:
+            raise ValueError(f"index has no inchikeys: {self.index_dir}")
+        return hash_keys(inchikeys)
+
+    def contains_smiles(self, smis: Iterable[str], canonicalize: bool = True) -> np.ndarray:
+        """
+        :param canonicalize: set to False if the smiles are already canonical (`canon_smiles`), this skips rdkit
+        :return: a bool array, True if a smiles is in the catalogue, invalid smiles are False
+        """
+        return _member(self.arrays["smiles_hash"], self._smiles_hashes(smis, canonicalize))
+
+    def contains_inchikeys(self, inchikeys: Iterable[str]) -> np.ndarray:
+        return _member(self.arrays["inchikey_hash"], self._inchikey_hashes(inchikeys))
+
+    def lookup_smiles(self, smis: Iterable[str], canonicalize: bool = True) -> list[np.ndarray]:
+        """
+        :return: for each smiles, cids of the catalogue rows with the same canonical smiles
+        """
+        matches = _lookup(self.arrays["smiles_hash"], self.arrays["smiles_rows"],
+                          self._smiles_hashes(smis, canonicalize))
+        return [self.arrays["cid"][rows] for rows in matches]
+
+    def lookup_inchikeys(self, inchikeys: Iterable[str]) -> list[np.ndarray]:
+        """
+        :return: for each inchikey, cids of the catalogue rows with this inchikey
+        """
+        matches = _lookup(self.arrays["inchikey_hash"], self.arrays["inchikey_rows"],
+                          self._inchikey_hashes(inchikeys))
+        return [self.arrays["cid"][rows] for rows in matches]
+
+    def mw_range(self, low: float, high: float) -> np.ndarray:
+        """
+        :return: cids with low <= mw <= high, in ascending mw
+        """
+        mw_sorted = self.arrays["mw_sorted"]
+        i, j = np.searchsorted(mw_sorted, low, side="left"), np.searchsorted(mw_sorted, high, side="right")
+        return self.arrays["cid"][self.arrays["mw_rows"][i:j]]
@@ -0,0 +1,364 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Union
+
+import numpy as np
+from loguru import logger
+from numpy.lib.format import open_memmap
+
+from ChemScraper.catalog.index import read_catalog
+from ChemScraper.utils import FilePath, createdir, canon_smiles_many, metrics_registry
+
+"""
+substructure and similarity search over a downloaded vendor catalogue
+
+`build_fingerprint_index` adds fingerprints to a `VendorIndex` folder (or a new folder), rows follow the catalogue:
+- `fp_morgan.npy`: morgan fingerprints packed to bits, one row of `fp_size / 8` bytes per compound,
+  `fp_morgan_count.npy` holds their popcounts
+- `fp_pattern.npy`: packed rdkit pattern fingerprints, a substructure of a molecule sets a subset of its bits
+- `fp_smiles.npy`, `fp_smiles_offsets.npy`: canonical smiles as utf-8 bytes and the offset of each row
+- `cid.npy` if the folder has no index yet
+
+arrays are memory mapped, a query scans them in shards on a thread pool (numpy releases the GIL in the kernels):
+- similarity: tanimoto = popcount(a & b) / (popcount(a) + popcount(b) - popcount(a & b)), top-k of each shard is
+  merged
+- substructure: rows whose pattern fingerprint does not cover the query's are screened out, the remaining candidates
+  are matched with rdkit on a process pool
+"""
+
+_FingerprintMeta = "fp_meta.json"
+
+# rows scanned at a time inside a shard, bounds the temporary arrays of the kernels
+_BlockRows = 1 << 16
+
+# numpy >= 2.0
+_bitwise_count = getattr(np, "bitwise_count", None)
+# popcount of every byte, used when numpy has no `bitwise_count`
+_ByteCounts = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+def popcount_rows(packed: np.ndarray) -> np.ndarray:
+    """
+    :param packed: a 2d uint8 array of packed bits, rows a multiple of 8 bytes long
+    :return: the number of set bits of each row
+    """
+    packed = np.ascontiguousarray(packed)
+    if _bitwise_count is not None:
+        return _bitwise_count(packed.view(np.uint64)).sum(axis=1, dtype=np.int32)
+    return _ByteCounts[packed].sum(axis=1, dtype=np.int32)
+
+
+def _shard_bounds(n: int, shards: int) -> list[tuple[int, int]]:
+    bounds = np.linspace(0, n, max(1, min(shards, n)) + 1, dtype=np.int64)
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+def _map_shards(func: Callable[[int, int], np.ndarray], n: int, shards: int) -> list:
+    bounds = _shard_bounds(n, shards)
+    if len(bounds) <= 1:
+        return [func(a, b) for a, b in bounds]
+    with ThreadPoolExecutor(max_workers=len(bounds)) as executor:
+        return list(executor.map(lambda ab: func(*ab), bounds))
+
+
+def _as_words(packed: np.ndarray) -> np.ndarray:
+    return packed.view(np.uint64)
+
+
+def tanimoto_top_k(
+        fps: np.ndarray, counts: np.ndarray, query: np.ndarray, k: int = 10, threshold: float = 0.0,
+        shards: int = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    the k rows most similar to a query
+
+    :param fps: (n, n_bytes) uint8 packed fingerprints, n_bytes a multiple of 8, can be memory mapped
+    :param counts: popcount of each row of `fps`, see `popcount_rows`
+    :param query: (n_bytes,) packed fingerprint of the query
+    :param threshold: rows below this similarity are dropped
+    :param shards: rows are split into this many shards scanned in parallel, default to the cpu count
+    :return: (rows, similarities) sorted by descending similarity
+    """
+    query = np.ascontiguousarray(query, dtype=np.uint8).reshape(1, -1)
+    query_words = _as_words(query)
+    query_count = int(popcount_rows(query)[0])
+
+    def _shard(start: int, stop: int) -> tuple[np.ndarray, np.ndarray]:
+        rows, sims = [], []
+        for a in range(start, stop, _BlockRows):
+            b = min(a + _BlockRows, stop)
+            common = popcount_rows((_as_words(np.asarray(fps[a:b])) & query_words).view(np.uint8))
+            union = np.asarray(counts[a:b], dtype=np.int32) + query_count - common
+            sim = np.divide(common, union, out=np.zeros(b - a), where=union > 0)
+            keep = np.flatnonzero(sim >= threshold)
+            if len(keep) > k:
+                keep = keep[np.argpartition(-sim[keep], k - 1)[:k]]
+            rows.append(keep + a)
+            sims.append(sim[keep])
+        rows, sims = np.concatenate(rows or [np.zeros(0, np.int64)]), np.concatenate(sims or [np.zeros(0)])
+        if len(rows) > k:
+            best = np.argpartition(-sims, k - 1)[:k]
+            rows, sims = rows[best], sims[best]
+        return rows, sims
+
+    results = _map_shards(_shard, len(fps), shards or os.cpu_count() or 1)
+    rows = np.concatenate([r for r, _ in results] or [np.zeros(0, np.int64)])
+    sims = np.concatenate([s for _, s in results] or [np.zeros(0)])
+    # descending similarity, ties by row
+    order = np.lexsort((rows, -sims))[:k]
+    return rows[order], sims[order]
+
+
+def superset_rows(fps: np.ndarray, query: np.ndarray, shards: int = None) -> np.ndarray:
+    """
+    :param fps: (n, n_bytes) uint8 packed fingerprints, n_bytes a multiple of 8, can be memory mapped
+    :param query: (n_bytes,) packed fingerprint
+    :param shards: see `tanimoto_top_k`
+    :return: ascending rows whose fingerprint has all bits of the query set
+    """
+    query_words = _as_words(np.ascontiguousarray(query, dtype=np.uint8).reshape(1, -1))
+    # only words with bits set in the query are compared
+    words = np.flatnonzero(query_words[0])
+    query_words = query_words[:, words]
+
+    def _shard(start: int, stop: int) -> np.ndarray:
+        rows = []
+        for a in range(start, stop, _BlockRows):
+            b = min(a + _BlockRows, stop)
+            block = _as_words(np.asarray(fps[a:b]))[:, words]
+            rows.append(np.flatnonzero(((block & query_words) == query_words).all(axis=1)) + a)
+        return np.concatenate(rows or [np.zeros(0, np.int64)])
+
+    return np.concatenate(_map_shards(_shard, len(fps), shards or os.cpu_count() or 1) or [np.zeros(0, np.int64)])
+
+
+def _query_mol(query: str, smarts: bool):
+    from rdkit.Chem import MolFromSmarts, MolFromSmiles
+    mol = MolFromSmarts(query) if smarts else MolFromSmiles(query)
+    if mol is None:
+        raise ValueError(f"invalid {'smarts' if smarts else 'smiles'} query: {query}")
+    return mol
+
+
+def _fingerprint_chunk(
+        smis: list[Union[str, None]], radius: int, fp_size: int, pattern_size: int
+) -> tuple[np.ndarray, np.ndarray]:
+    from rdkit import RDLogger
+    from rdkit.Chem import MolFromSmiles, PatternFingerprint
+    from rdkit.Chem.rdFingerprintGenerator import GetMorganGenerator
+    RDLogger.DisableLog("rdApp.*")
+    generator = GetMorganGenerator(radius=radius, fpSize=fp_size)
+    morgan = np.zeros((len(smis), fp_size // 8), dtype=np.uint8)
+    pattern = np.zeros((len(smis), pattern_size // 8), dtype=np.uint8)
+    for i, smi in enumerate(smis):
+        mol = MolFromSmiles(smi) if smi else None
+        if mol is None:
+            # all zero rows never pass a screen and have similarity 0
+            continue
+        morgan[i] = np.packbits(generator.GetFingerprintAsNumPy(mol))
+        bits = np.frombuffer(PatternFingerprint(mol, fpSize=pattern_size).ToBitString().encode(), dtype=np.uint8)
+        pattern[i] = np.packbits(bits - ord("0"))
+    return morgan, pattern
+
+
+def _match_chunk(query: str, smarts: bool, smis: list[str]) -> list[bool]:
+    from rdkit import RDLogger
+    from rdkit.Chem import MolFromSmiles
+    RDLogger.DisableLog("rdApp.*")
+    query_mol = _query_mol(query, smarts)
+    matched = []
+    for smi in smis:
+        mol = MolFromSmiles(smi) if smi else None
+        matched.append(mol is not None and mol.HasSubstructMatch(query_mol))
+    return matched
+
+
+def query_fingerprints(
+        smiles: str = None, smarts: str = None, radius: int = 2, fp_size: int = 2048, pattern_size: int = 2048,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    packed (morgan, pattern) fingerprints of a query, the morgan fingerprint is all zeros for a smarts query
+    """
+    from rdkit.Chem import PatternFingerprint
+    from rdkit.Chem.rdFingerprintGenerator import GetMorganGenerator
+    mol = _query_mol(smarts if smarts is not None else smiles, smarts is not None)
+    morgan = np.zeros(fp_size // 8, dtype=np.uint8)
+    if smarts is None:
+        morgan = np.packbits(GetMorganGenerator(radius=radius, fpSize=fp_size).GetFingerprintAsNumPy(mol))
+    bits = np.frombuffer(PatternFingerprint(mol, fpSize=pattern_size).ToBitString().encode(), dtype=np.uint8)
+    return morgan, np.packbits(bits - ord("0"))
+
+
+def build_fingerprint_index(
+        table_file: FilePath, index_dir: FilePath, smiles_column: str = 'isosmiles', cid_column: str = 'cid',
+        radius: int = 2, fp_size: int = 2048, pattern_size: int = 2048, processes: int = None,
+        chunk_size: int = 20000,
+) -> "CatalogSearch":
+    """
+    fingerprint a csv/parquet file of `download_vendor_compounds`
+
+    :param index_dir: usually the folder of `build_vendor_index` for the same file, rows must match,
+        rows without a cid are dropped as in `build_vendor_index`
+    :param radius: morgan radius, 2 is ECFP4
+    :param fp_size: morgan bits, a multiple of 64
+    :param pattern_size: pattern fingerprint bits, a multiple of 64
+    :param processes: process pool size for fingerprinting, default to the cpu count
+    :param chunk_size: smiles fingerprinted by a worker at a time
+    """
+    assert fp_size % 64 == 0 and pattern_size % 64 == 0, "fingerprint sizes must be multiples of 64"
+    ts = time.perf_counter()
+    df, n_missing = read_catalog(table_file, cid_column)
+    logger.info(f"fingerprinting {len(df)} rows from: {table_file}")
+    smis = df[smiles_column].where(df[smiles_column].notna(), None).tolist()
+    canonical, invalid = canon_smiles_many(smis, processes=processes, chunk_size=chunk_size)
+
+    createdir(index_dir)
+    cid_file = os.path.join(index_dir, "cid.npy")
+    cids = df[cid_column].to_numpy(dtype=np.int64)
+    if os.path.isfile(cid_file):
+        indexed = np.load(cid_file, mmap_mode="r")
+        if len(indexed) != len(cids) or not np.array_equal(indexed, cids):
+            raise ValueError(f"rows of {table_file} do not match the index in: {index_dir}")
+    else:
+        np.save(cid_file, cids)
+
+    morgan = open_memmap(os.path.join(index_dir, "fp_morgan.npy"), mode="w+", dtype=np.uint8,
+                         shape=(len(df), fp_size // 8))
+    pattern = open_memmap(os.path.join(index_dir, "fp_pattern.npy"), mode="w+", dtype=np.uint8,
+                          shape=(len(df), pattern_size // 8))
+    starts = range(0, len(canonical), chunk_size)
+    chunks = [canonical[i:i + chunk_size] for i in starts]
+    processes = processes or os.cpu_count() or 1
+    args = (chunks, [radius] * len(chunks), [fp_size] * len(chunks), [pattern_size] * len(chunks))
+    if processes == 1 or len(chunks) <= 1:
+        results = map(_fingerprint_chunk, *args)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=min(processes, len(chunks)))
+        results = executor.map(_fingerprint_chunk, *args)
+    try:
+        # chunks are written as they arrive, the whole array never sits in memory
+        for start, (morgan_chunk, pattern_chunk) in zip(starts, results):
+            morgan[start:start + len(morgan_chunk)] = morgan_chunk
+            pattern[start:start + len(pattern_chunk)] = pattern_chunk
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    morgan.flush()
+    pattern.flush()
+    np.save(os.path.join(index_dir, "fp_morgan_count.npy"), np.concatenate(
+        [popcount_rows(morgan[i:i + _BlockRows]) for i in range(0, len(df), _BlockRows)] or [np.zeros(0, np.int32)]
+    ).astype(np.uint16))
+    del morgan, pattern
+
+    encoded = [(smi or "").encode() for smi in canonical]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    np.save(os.path.join(index_dir, "fp_smiles.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    np.save(os.path.join(index_dir, "fp_smiles_offsets.npy"), offsets)
+    with open(os.path.join(index_dir, _FingerprintMeta), "w") as f:
+        json.dump({
+            "source": os.path.abspath(table_file),
+            "rows": len(df),
+            "rows_without_cid": n_missing,
+            "invalid_smiles": len(invalid),
+            "radius": radius,
+            "fp_size": fp_size,
+            "pattern_size": pattern_size,
+            "created": time.time(),
+        }, f, indent=2)
+    logger.info(f"fingerprint index built in {time.perf_counter() - ts:.1f} s: {index_dir}")
+    return CatalogSearch(index_dir)
+
+
+class CatalogSearch:
+
+    def __init__(self, index_dir: FilePath, shards: int = None, processes: int = None):
+        """
+        open fingerprints written by `build_fingerprint_index`, arrays are memory mapped
+
+        :param shards: shards scanned in parallel by the numpy kernels, default to the cpu count
+        :param processes: process pool size for rdkit substructure matching, default to the cpu count
+        """
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, _FingerprintMeta)) as f:
+            self.meta = json.load(f)
+        self.shards = shards or os.cpu_count() or 1
+        self.processes = processes or os.cpu_count() or 1
+        self.arrays = {
+            name: np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+            for name in ("cid", "fp_morgan", "fp_morgan_count", "fp_pattern", "fp_smiles", "fp_smiles_offsets")
+        }
+
+    def __len__(self):
+        return len(self.arrays["cid"])
+
+    def smiles(self, rows: np.ndarray) -> list[str]:
+        """
+        :return: canonical smiles of catalogue rows, "" for invalid smiles
+        """
+        data, offsets = self.arrays["fp_smiles"], self.arrays["fp_smiles_offsets"]
+        return [bytes(data[offsets[i]:offsets[i + 1]]).decode() for i in rows]
+
+    def _query_fingerprints(self, smiles: str = None, smarts: str = None) -> tuple[np.ndarray, np.ndarray]:
+        return query_fingerprints(smiles, smarts, self.meta["radius"], self.meta["fp_size"], self.meta["pattern_size"])
+
+    def similar(self, smiles: str, k: int = 10, threshold: float = 0.0) -> list[dict]:
+        """
+        nearest catalogue compounds by tanimoto similarity of morgan fingerprints
+
+        :param threshold: minimum similarity
+        :return: [{"cid": ..., "smiles": ..., "similarity": ...}] at most k, most similar first
+        """
+        with metrics_registry.timer("chemscraper_catalog_search", kind="similarity"):
+            query, _ = self._query_fingerprints(smiles=smiles)
+            rows, sims = tanimoto_top_k(self.arrays["fp_morgan"], self.arrays["fp_morgan_count"], query, k=k,
+                                        threshold=threshold, shards=self.shards)
+        return [
+            {"cid": int(cid), "smiles": smi, "similarity": float(sim)}
+            for cid, smi, sim in zip(self.arrays["cid"][rows], self.smiles(rows), sims)
+        ]
+
+    def screen(self, query: str, smarts: bool = False) -> np.ndarray:
+        """
+        :return: candidate rows of a substructure query, a superset of the rows that match
+        """
+        _, pattern = self._query_fingerprints(**{"smarts" if smarts else "smiles": query})
+        return superset_rows(self.arrays["fp_pattern"], pattern, shards=self.shards)
+
+    def substructure(
+            self, query: str, smarts: bool = False, max_results: int = None, chunk_size: int = 2000
+    ) -> list[dict]:
+        """
+        catalogue compounds containing a substructure
+
+        :param query: smiles, or smarts if `smarts` is True
+        :param max_results: stop after this many matches in row order
+        :param chunk_size: candidates matched by a worker at a time
+        :return: [{"cid": ..., "smiles": ...}] in catalogue order
+        """
+        with metrics_registry.timer("chemscraper_catalog_search", kind="substructure"):
+            candidates = self.screen(query, smarts)
+            logger.debug(f"{len(candidates)}/{len(self)} candidates pass the screen for: {query}")
+            matched = []
+            # rows are matched in batches of one chunk per worker so `max_results` can stop early
+            batch = chunk_size * self.processes
+            executor = ProcessPoolExecutor(max_workers=self.processes) if self.processes > 1 and \
+                len(candidates) > chunk_size else None
+            try:
+                for i in range(0, len(candidates), batch):
+                    rows = candidates[i:i + batch]
+                    smis = self.smiles(rows)
+                    chunks = [smis[j:j + chunk_size] for j in range(0, len(smis), chunk_size)]
+                    args = ([query] * len(chunks), [smarts] * len(chunks), chunks)
+                    flags = (executor.map if executor is not None else map)(_match_chunk, *args)
+                    matched.extend(rows[np.concatenate([np.asarray(f, dtype=bool) for f in flags])])
+                    if max_results is not None and len(matched) >= max_results:
+                        break
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+        rows = np.asarray(matched[:max_results], dtype=np.int64)
+        return [{"cid": int(cid), "smiles": smi} for cid, smi in zip(self.arrays["cid"][rows], self.smiles(rows))]
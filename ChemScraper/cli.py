@@ -0,0 +1,68 @@
+import argparse
+import sys
+
+from loguru import logger
+
+from ChemScraper.settings import VendorSources
+
+"""
+command line interface, installed as `chemscraper` or run with `python -m ChemScraper`
+
+    chemscraper annotate-network examples/network_lv0.json -o network_lv0_annotated.json --cache compound_cache.sqlite
+"""
+
+
+def _annotate_network(args: argparse.Namespace):
+    from ChemScraper.network import annotate_network_file
+    from ChemScraper.pubchem import CompoundCache
+    from ChemScraper.utils import metrics_registry
+
+    cache = CompoundCache(args.cache) if args.cache else None
+    try:
+        annotated = annotate_network_file(
+            args.network, args.output, roles=args.roles, cache=cache, prices=args.prices, vendors=args.vendors,
+            pool_size=args.pool_size, max_workers=args.max_workers, chunk_size=args.chunk_size,
+            checkpoint_prefix=args.checkpoint_prefix,
+        )
+    finally:
+        if cache is not None:
+            cache.close()
+    if args.metrics:
+        with open(args.metrics, "w") as f:
+            f.write(metrics_registry.to_json(indent=2))
+    logger.info(f"annotated network written to: {args.output}, summary: {annotated['annotation']}")
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="chemscraper")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    annotate = commands.add_parser(
+        "annotate-network", help="attach pubchem identities, cas numbers, vendor links and prices to a reaction network"
+    )
+    annotate.add_argument("network", help="network json with a list of reactions, e.g. examples/network_lv0.json")
+    annotate.add_argument("-o", "--output", required=True, help="annotated network json")
+    annotate.add_argument("--roles", nargs="+", default=["reactant", "reagent", "product"],
+                          choices=["reactant", "reagent", "product"], help="species to annotate")
+    annotate.add_argument("--cache", default="compound_cache.sqlite",
+                          help="compound cache for identification, an empty string disables it")
+    annotate.add_argument("--prices", action="store_true", help="scrape vendor prices, needs chrome")
+    annotate.add_argument("--vendors", nargs="+", default=list(VendorSources), help="vendors scraped for prices")
+    annotate.add_argument("--pool-size", type=int, default=2, help="browsers used for scraping")
+    annotate.add_argument("--max-workers", type=int, default=4, help="pug view requests in flight")
+    annotate.add_argument("--chunk-size", type=int, default=None, help="identifiers per pug conversion job")
+    annotate.add_argument("--checkpoint-prefix", default=None,
+                          help="checkpoint cas numbers and vendor links to <prefix>.cas.jsonl / <prefix>.vendors.jsonl")
+    annotate.add_argument("--metrics", default=None, help="write request metrics to this json file")
+    annotate.set_defaults(func=_annotate_network)
+    return parser
+
+
+def main(argv: list[str] = None) -> int:
+    args = get_parser().parse_args(argv)
+    args.func(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,235 @@
+import queue
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, Union
+
+from loguru import logger
+
+from ChemScraper.pubchem import CompoundCache, identify_compounds, get_cas_numbers, get_vendor_links_many
+from ChemScraper.settings import VendorSources, VendorDecimalSeparators
+from ChemScraper.utils import FilePath, json_load, json_dump, dedupe_by_canonical_smiles
+
+"""
+annotate a reaction network with pubchem identities, cas numbers, vendor links and prices
+
+a network is a json dict with a list of "reactions", each with `reactant_smis_and_ratios`,
+`reagent_smis_and_ratios` and `reaction_smiles` (see `examples/network_lv0.json`),
+species are de-duplicated by canonical smiles before any request so each one is looked up once:
+
+    canonical smiles --identify_compounds(cache)--> cid --+--get_cas_numbers--> cas --scrape_many--> cheapest offer
+                                                          +--get_vendor_links_many--> vendor links
+
+cas numbers and vendor links are fetched at the same time, vendor scraping starts with the first cas number
+"""
+
+# species role -> key of a reaction holding {smiles: ratio}
+SpeciesRoleKeys = {
+    "reactant": "reactant_smis_and_ratios",
+    "reagent": "reagent_smis_and_ratios",
+}
+
+# pack size unit -> (base unit, factor)
+_QuantityUnits = {
+    "mg": ("g", 1e-3), "g": ("g", 1), "kg": ("g", 1e3),
+    "ul": ("ml", 1e-3), "µl": ("ml", 1e-3), "ml": ("ml", 1), "l": ("ml", 1e3),
+}
+
+
+def iter_reaction_species(reaction: dict, roles: Iterable[str]) -> Iterator[tuple[str, str]]:
+    """
+    :param roles: "reactant", "reagent" and/or "product", products are read from `reaction_smiles`
+    :return: a generator of (smiles, role)
+    """
+    for role in roles:
+        if role == "product":
+            products = reaction.get("reaction_smiles", "").split(">")[-1]
+            for smi in filter(None, products.split(".")):
+                yield smi, role
+        else:
+            for smi in reaction.get(SpeciesRoleKeys[role], dict()):
+                yield smi, role
+
+
+def extract_species(network: dict, roles: Iterable[str] = ("reactant", "reagent", "product")) -> dict[str, set[str]]:
+    """
+    :return: smiles as written in the network -> roles it plays
+    """
+    species = dict()
+    for reaction in network["reactions"]:
+        for smi, role in iter_reaction_species(reaction, roles):
+            species.setdefault(smi, set()).add(role)
+    return species
+
+
+def parse_offer(price: str, quantity: str, decimal: str = ".") -> dict:
+    """
+    parse a row of a vendor price table, e.g. ("$36.20", "5 G")
+
+    :param decimal: decimal separator of the vendor, "." or ",", see `settings.VendorDecimalSeparators`
+    :return: {"price": float or None, "currency": str, "amount": float or None, "unit": "g"/"ml"/None,
+        "price_per_unit": float or None}
+    """
+    price = "" if price is None else str(price)
+    currency = "USD" if "$" in price else (re.sub(r"[\d.,\s]", "", price) or None)
+    thousands = "," if decimal == "." else "."
+    # e.g. "1,047.70" with a decimal point, "1.047,70" with a decimal comma
+    number = re.search(r"\d[\d{}]*({}\d+)?".format(re.escape(thousands), re.escape(decimal)), price)
+    value = float(number.group().replace(thousands, "").replace(decimal, ".")) if number else None
+    amount, unit = None, None
+    # e.g. "5 G", "2.5L", "4X100ML"
+    quantity = "" if quantity is None else str(quantity).lower().replace(decimal, ".")
+    match = re.search(r"(?:(\d+)\s*x\s*)?(\d+(?:\.\d+)?)\s*(mg|kg|g|µl|ul|ml|l)\b", quantity)
+    if match:
+        unit, factor = _QuantityUnits[match.group(3)]
+        amount = int(match.group(1) or 1) * float(match.group(2)) * factor
+    per_unit = value / amount if value is not None and amount else None
+    return {"price": value, "currency": currency, "amount": amount, "unit": unit, "price_per_unit": per_unit}
+
+
+def cheapest_offer(tables: dict[str, "pd.DataFrame"]) -> Union[dict, None]:
+    """
+    the offer with the lowest price per gram or milliliter across vendor tables
+
+    prices per unit are only compared within one base unit and currency, the one most offers are sold in,
+    offers whose pack size cannot be parsed are only compared by price (within one currency) when no offer
+    has a parsable pack size
+
+    :param tables: vendor -> price table of `scrape_many`, sigma-aldrich ("Price", "Pack Size") or
+        thermo fisher ("price", "quantity") columns
+    :return: {"vendor", "price", "currency", "amount", "unit", "price_per_unit", "quantity", "url"} or None
+    """
+    offers = []
+    for vendor, df in tables.items():
+        columns = {c.lower(): c for c in df.columns}
+        price_column = columns.get("price")
+        quantity_column = columns.get("pack size", columns.get("quantity"))
+        url_column = columns.get("url", columns.get("product_url"))
+        if price_column is None:
+            continue
+        for record in df.to_dict(orient="records"):
+            quantity = record.get(quantity_column)
+            offer = parse_offer(record[price_column], quantity, VendorDecimalSeparators.get(vendor, "."))
+            if offer["price"] is None:
+                continue
+            offer.update(vendor=vendor, quantity=quantity, url=record.get(url_column))
+            offers.append(offer)
+    if not offers:
+        return None
+    per_unit = [o for o in offers if o["price_per_unit"] is not None]
+    if per_unit:
+        offers = per_unit
+    groups = dict()
+    for o in offers:
+        groups.setdefault((o["unit"], o["currency"]), []).append(o)
+    # the first group seen wins a tie
+    group = max(groups.values(), key=len)
+    return min(group, key=lambda o: o["price_per_unit"] if per_unit else o["price"])
+
+
+def annotate_network(
+        network: dict, roles: Iterable[str] = ("reactant", "reagent", "product"), cache: CompoundCache = None,
+        prices: bool = False, vendors: Iterable[str] = VendorSources, pool_size: int = 2, max_workers: int = 4,
+        chunk_size: int = None, checkpoint_prefix: FilePath = None,
+) -> dict:
+    """
+    annotate every species of a network
+
+    :param roles: which species to annotate, see `iter_reaction_species`
+    :param cache: a `CompoundCache` for identification, species identified before are not sent to pubchem
+    :param prices: scrape price tables of `vendors` and attach the cheapest offer, needs chrome
+    :param pool_size: browsers used for scraping
+    :param max_workers: pug view requests in flight for each of cas numbers and vendor links
+    :param chunk_size: see `identify_compounds`
+    :param checkpoint_prefix: if given, cas numbers and vendor links are checkpointed to
+        `<prefix>.cas.jsonl` and `<prefix>.vendors.jsonl`, see `iter_pug_view_many`
+    :return: a copy of the network with "species": {smiles as written: annotation} and "annotation": summary,
+        an annotation has "roles", "canonical_smiles", "cid", "iupac", "inchi", "cas", "vendor_links"
+        and "cheapest" if prices are scraped, fields are None when unknown
+    """
+    ts = time.perf_counter()
+    species = extract_species(network, roles)
+    groups, invalid = dedupe_by_canonical_smiles(species)
+    canonical_of = {smi: canonical for canonical, smis in groups.items() for smi in smis}
+    logger.info(f"network species: {len(species)}, unique: {len(groups)}, invalid smiles: {len(invalid)}")
+
+    compounds = identify_compounds(list(groups), 'smiles', concurrent=True, chunk_size=chunk_size, cache=cache) \
+        if groups else dict()
+    cids = list(dict.fromkeys(c.cid for c in compounds.values()))
+    logger.info(f"identified {len(compounds)}/{len(groups)} species as {len(cids)} cids")
+
+    cas_of, links_of, tables_of, scrape_errors = dict(), dict(), dict(), dict()
+    # new cas numbers go to the scrapers as they arrive, None marks the end
+    new_cas = queue.Queue()
+
+    def _cas_numbers():
+        checkpoint = None if checkpoint_prefix is None else f"{checkpoint_prefix}.cas.jsonl"
+        seen = set()
+        try:
+            for cid, cas in get_cas_numbers(cids, checkpoint=checkpoint, max_workers=max_workers):
+                cas_of[cid] = cas
+                if cas is not None and cas not in seen:
+                    seen.add(cas)
+                    new_cas.put(cas)
+        finally:
+            new_cas.put(None)
+
+    def _vendor_links():
+        checkpoint = None if checkpoint_prefix is None else f"{checkpoint_prefix}.vendors.jsonl"
+        links_of.update(get_vendor_links_many(cids, checkpoint=checkpoint, max_workers=max_workers))
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(_cas_numbers), executor.submit(_vendor_links)]
+        if prices:
+            from ChemScraper.vscraper import scrape_many
+            for cas, vendor, table, error in scrape_many(iter(new_cas.get, None), vendors, size=pool_size):
+                if error is None:
+                    tables_of.setdefault(cas, dict())[vendor] = table
+                else:
+                    scrape_errors.setdefault(cas, dict())[vendor] = f"{error.__class__.__name__}: {error}"
+        for future in futures:
+            future.result()
+
+    annotations = dict()
+    for smi, smi_roles in species.items():
+        canonical = canonical_of.get(smi)
+        compound = compounds.get(canonical)
+        cid = None if compound is None else compound.cid
+        cas = cas_of.get(cid)
+        annotation = {
+            "roles": sorted(smi_roles),
+            "canonical_smiles": canonical,
+            "cid": cid,
+            "iupac": None if compound is None else compound.iupac,
+            "inchi": None if compound is None else compound.inchi,
+            "cas": cas,
+            "vendor_links": links_of.get(cid),
+        }
+        if prices:
+            annotation["cheapest"] = cheapest_offer(tables_of.get(cas, dict()))
+            annotation["scrape_errors"] = scrape_errors.get(cas, dict())
+        annotations[smi] = annotation
+
+    annotated = dict(network)
+    annotated["species"] = annotations
+    annotated["annotation"] = {
+        "species": len(species),
+        "unique_species": len(groups),
+        "invalid_smiles": invalid,
+        "identified": len(compounds),
+        "with_cas": sum(cas is not None for cas in cas_of.values()),
+        "with_vendor_links": sum(bool(links) for links in links_of.values()),
+        "priced": sum(a.get("cheapest") is not None for a in annotations.values()) if prices else None,
+        "seconds": time.perf_counter() - ts,
+    }
+    logger.info(f"network annotated in {annotated['annotation']['seconds']:.1f} s")
+    return annotated
+
+
+def annotate_network_file(network_file: FilePath, output_file: FilePath, **kwargs) -> dict:
+    """
+    `annotate_network` for a json file, the annotated network is written to `output_file`
+    """
+    annotated = annotate_network(json_load(network_file), **kwargs)
+    json_dump(annotated, output_file)
+    return annotated
@@ -0,0 +1,271 @@
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable, Iterator, Union
+
+from loguru import logger
+
+from ChemScraper.pubchem import identify_compound, get_cas_number, CompoundCache
+from ChemScraper.pubchem.limiter import ncbi_limiter
+from ChemScraper.settings import VendorSources
+from ChemScraper.utils import RateLimiter
+from ChemScraper.vscraper.pool import DriverPool, VendorPatableScrapers
+
+"""
+streaming pipelines: stages run concurrently and are connected by bounded queues
+
+each stage has its own workers and optional rate limiter, an item moves to the next stage as soon as it is processed,
+so a fast stage (pubchem identification) keeps feeding a slow one (vendor scraping) instead of the whole batch
+waiting on one step, a full queue blocks the stage before it
+
+a stage is any function of one argument, which makes pipelines testable with stub stages:
+
+    pipeline = Pipeline([Stage("double", lambda x: 2 * x, workers=2), Stage("str", str)])
+    for item, result, error in pipeline.run(range(10)):
+        ...
+"""
+
+# marks the end of a queue
+_Done = object()
+
+
+class StageError(Exception):
+
+    def __init__(self, stage: str, error: Exception):
+        """
+        an item failed in a stage, it skips the stages after
+        """
+        super().__init__(f"{stage}: {error.__class__.__name__}: {error}")
+        self.stage = stage
+        self.error = error
+
+
+class Stage:
+
+    def __init__(
+            self, name: str, func: Callable[[Any], Any], workers: int = 1, limiter: RateLimiter = None,
+            queue_size: int = None, acquired_by_func: bool = False,
+    ):
+        """
+        :param name: stage name used in metrics
+        :param func: called with the output of the previous stage (or the input item for the first stage)
+        :param workers: threads running this stage
+        :param limiter: if given, acquired before each call of `func`
+        :param queue_size: capacity of the input queue of this stage, default to 2 * workers
+        :param acquired_by_func: `func` acquires `limiter` itself (e.g. pubchem functions and `ncbi_limiter`),
+            it is then not acquired again, only the waits inside `func` are counted as limiter wait
+        """
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.limiter = limiter
+        self.acquired_by_func = acquired_by_func
+        self.queue_size = queue_size or 2 * workers
+        self.processed = 0
+        self.errors = 0
+        self.busy = 0.0
+        self.limiter_wait = 0.0
+        self.max_queue_depth = 0
+        self.queue: Union[queue.Queue, None] = None
+        self._lock = threading.Lock()
+
+    def _reset(self):
+        self.processed = 0
+        self.errors = 0
+        self.busy = 0.0
+        self.limiter_wait = 0.0
+        self.max_queue_depth = 0
+        self.queue = queue.Queue(maxsize=self.queue_size)
+
+    def _record(self, elapsed: float, waited: float, error: bool):
+        with self._lock:
+            self.processed += 1
+            self.errors += int(error)
+            self.busy += elapsed
+            self.limiter_wait += waited
+            self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+
+class Pipeline:
+
+    def __init__(self, stages: list[Stage], owned: list = None):
+        """
+        :param stages: stages in order
+        :param owned: objects with a `close` method, e.g. a `DriverPool` created for this pipeline,
+            closed when `run` finishes, such a pipeline runs once
+        """
+        assert len(stages) > 0, "a pipeline needs at least one stage"
+        assert len(set(s.name for s in stages)) == len(stages), "stage names must be unique"
+        assert all(s.limiter is not None for s in stages if s.acquired_by_func), \
+            "acquired_by_func needs a limiter"
+        self.stages = stages
+        self.owned = owned or []
+        self._started = None
+        self._finished = None
+
+    def _worker(self, i: int, remaining: list[int], lock: threading.Lock, output: queue.Queue):
+        stage = self.stages[i]
+        downstream = self.stages[i + 1].queue if i + 1 < len(self.stages) else output
+        while True:
+            entry = stage.queue.get()
+            if entry is _Done:
+                with lock:
+                    remaining[i] -= 1
+                    last = remaining[i] == 0
+                if last:
+                    # all workers of this stage are done, close the next queue
+                    for _ in range(self.stages[i + 1].workers if i + 1 < len(self.stages) else 1):
+                        downstream.put(_Done)
+                return
+            item, value, error = entry
+            if error is None:
+                waited = 0.0
+                if stage.limiter is not None and not stage.acquired_by_func:
+                    waited = stage.limiter.acquire()
+                waited_before = stage.limiter.thread_waited() if stage.acquired_by_func else 0.0
+                ts = time.perf_counter()
+                try:
+                    value = stage.func(value)
+                except Exception as e:
+                    logger.critical(f"stage {stage.name} FAILED for: {item}")
+                    value, error = None, StageError(stage.name, e)
+                elapsed = time.perf_counter() - ts
+                if stage.acquired_by_func:
+                    # waits inside `func` are not busy time
+                    waited = stage.limiter.thread_waited() - waited_before
+                    elapsed -= waited
+                stage._record(elapsed, waited, error is not None)
+            downstream.put((item, value, error))
+
+    def run(self, items: Iterable[Any]) -> Iterator[tuple[Any, Any, Union[StageError, None]]]:
+        """
+        stream items through all stages
+
+        :param items: inputs of the first stage, consumed lazily
+        :return: a generator of (input item, output of the last stage, error) in the order items finish,
+            either output or error is None
+        """
+        for stage in self.stages:
+            stage._reset()
+        output = queue.Queue()
+        remaining = [s.workers for s in self.stages]
+        lock = threading.Lock()
+        threads = [
+            threading.Thread(target=self._worker, args=(i, remaining, lock, output), daemon=True)
+            for i, stage in enumerate(self.stages) for _ in range(stage.workers)
+        ]
+
+        def _feed():
+            first = self.stages[0]
+            try:
+                for item in items:
+                    first.queue.put((item, item, None))
+            finally:
+                for _ in range(first.workers):
+                    first.queue.put(_Done)
+
+        self._started = time.perf_counter()
+        self._finished = None
+        for t in threads:
+            t.start()
+        feeder = threading.Thread(target=_feed, daemon=True)
+        feeder.start()
+        try:
+            while True:
+                entry = output.get()
+                if entry is _Done:
+                    break
+                yield entry
+            self._finished = time.perf_counter()
+            feeder.join()
+            for t in threads:
+                t.join()
+        finally:
+            for resource in self.owned:
+                resource.close()
+            self.owned = []
+
+    def metrics(self) -> dict[str, dict[str, float]]:
+        """
+        per stage metrics, can be called while the pipeline runs
+
+        :return: a dict of stage name -> {
+            "processed": items processed, "errors": items failed, "throughput": items per second of wall time,
+            "busy": seconds spent in the stage function summed over workers, "utilization": busy / (workers * wall time),
+            "limiter_wait": seconds spent waiting for the rate limiter, "queue_depth": items waiting now,
+            "max_queue_depth": most items seen waiting after an item was processed, "queue_size": capacity
+        }
+        """
+        if self._started is None:
+            return dict()
+        elapsed = max((self._finished or time.perf_counter()) - self._started, 1e-9)
+        metrics = dict()
+        for stage in self.stages:
+            with stage._lock:
+                metrics[stage.name] = {
+                    "processed": stage.processed,
+                    "errors": stage.errors,
+                    "throughput": stage.processed / elapsed,
+                    "busy": stage.busy,
+                    "utilization": stage.busy / (stage.workers * elapsed),
+                    "limiter_wait": stage.limiter_wait,
+                    "queue_depth": stage.queue.qsize(),
+                    "max_queue_depth": stage.max_queue_depth,
+                    "queue_size": stage.queue_size,
+                }
+        return metrics
+
+
+def compound_vendor_pipeline(
+        input_type: str = 'smiles', vendors: Iterable[str] = VendorSources, pool: DriverPool = None,
+        cache: CompoundCache = None, identify_workers: int = 2, cas_workers: int = 2, scrape_workers: int = None,
+) -> Pipeline:
+    """
+    identifier -> `Compound` -> cas number -> vendor price tables
+
+    pubchem stages share the NCBI rate limiter of `ChemScraper.pubchem`, its waits show up as their `limiter_wait`,
+    the scraping stage leases browsers from `pool`
+
+    :param input_type: identifier type of the inputs, see `settings.KnownIdentifierTypes`
+    :param vendors: vendor names, see `ChemScraper.vscraper.pool.VendorPatableScrapers`
+    :param pool: a `DriverPool` closed by the caller, if None, one of default size is created and closed
+        when the pipeline finishes its run
+    :param cache: a `CompoundCache` for identification
+    :param scrape_workers: default to the pool size
+    :return: a pipeline whose outputs are
+        {"compound": compound, "cas": cas number, "tables": {vendor: table}, "errors": {vendor: exception}}
+    """
+    vendors = list(vendors)
+    owned = []
+    if pool is None:
+        pool = DriverPool()
+        owned.append(pool)
+
+    def _identify(identifier):
+        compound = identify_compound(identifier, input_type, cache=cache)
+        if compound.cid is None:
+            raise ValueError(f"pubchem returns no cid for: {identifier}")
+        return {"compound": compound}
+
+    def _cas(record):
+        record["cas"] = get_cas_number(record["compound"].cid)
+        if record["cas"] is None:
+            raise ValueError(f"no cas number for cid: {record['compound'].cid}")
+        return record
+
+    def _scrape(record):
+        record["tables"], record["errors"] = dict(), dict()
+        for vendor in vendors:
+            try:
+                with pool.lease(vendor) as driver:
+                    record["tables"][vendor] = VendorPatableScrapers[vendor](driver, record["cas"])
+            except Exception as e:
+                logger.critical(f"FAILED to scrape {vendor} for: {record['cas']}")
+                record["errors"][vendor] = e
+        return record
+
+    return Pipeline([
+        Stage("identify", _identify, workers=identify_workers, limiter=ncbi_limiter, acquired_by_func=True),
+        Stage("cas", _cas, workers=cas_workers, limiter=ncbi_limiter, acquired_by_func=True),
+        Stage("scrape", _scrape, workers=scrape_workers or pool.size),
+    ], owned=owned)
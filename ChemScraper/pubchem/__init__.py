@@ -1,9 +1,32 @@
-from ChemScraper.pubchem.entrez import download_vendor_compounds
-from ChemScraper.pubchem.view import get_vendor_links, get_cas_number
-from ChemScraper.pubchem.gateway import request_convert_identifiers, identify_compounds, identify_compound
+from ChemScraper.utils.lazy import lazy_exports
+
 """
 NCBI requests limits:
 No more than 5 requests per second.
 No more than 400 requests per minute.
 No longer than 300 second running time per minute.
 """
+
+_exports = {
+    "CompoundCache": "ChemScraper.pubchem.cache",
+    "download_vendor_compounds": "ChemScraper.pubchem.entrez",
+    "iter_sdq_pages": "ChemScraper.pubchem.entrez",
+    "sync_vendor_compounds": "ChemScraper.pubchem.entrez",
+    "get_vendor_links": "ChemScraper.pubchem.view",
+    "get_cas_number": "ChemScraper.pubchem.view",
+    "get_vendor_links_many": "ChemScraper.pubchem.view",
+    "get_cas_numbers": "ChemScraper.pubchem.view",
+    "get_all_cas_numbers": "ChemScraper.pubchem.view",
+    "request_convert_identifiers": "ChemScraper.pubchem.gateway",
+    "identify_compounds": "ChemScraper.pubchem.gateway",
+    "identify_compound": "ChemScraper.pubchem.gateway",
+    "request_convert_identifiers_chunked": "ChemScraper.pubchem.gateway",
+    "run_convert_jobs": "ChemScraper.pubchem.gateway",
+    "PugPoller": "ChemScraper.pubchem.gateway",
+    "PugTimeoutError": "ChemScraper.pubchem.gateway",
+    "PugJobError": "ChemScraper.pubchem.gateway",
+}
+
+__all__ = list(_exports)
+
+__getattr__, __dir__ = lazy_exports(__name__, _exports)
@@ -0,0 +1,162 @@
+import csv
+import json
+from typing import Iterable, Union
+
+from loguru import logger
+from monty.json import MontyEncoder
+
+from ChemScraper.schema import Compound
+from ChemScraper.utils import FilePath, SqliteCache, json_load, canon_smiles, canon_smiles_many
+
+"""
+persistent cache of identified compounds, keyed by (canonical identifier, input type)
+"""
+
+
+def canonical_identifier(identifier: Union[str, int], input_type: str) -> str:
+    if input_type == 'smiles':
+        return canon_smiles(identifier) or identifier.strip()
+    elif input_type == 'cid':
+        return str(int(identifier))
+    elif input_type == 'inchi':
+        return identifier.strip()
+    raise ValueError(f"Unknown identifier type: {input_type}")
+
+
+def canonical_identifiers(identifiers: Iterable[Union[str, int]], input_type: str) -> dict[Union[str, int], str]:
+    """
+    :return: a dict of identifier -> `canonical_identifier`, smiles are canonicalized in one batch
+    """
+    identifiers = list(identifiers)
+    if input_type == 'smiles':
+        # fill the memo used by `canonical_identifier`, large batches run on a process pool
+        canon_smiles_many(identifiers)
+    return {i: canonical_identifier(i, input_type) for i in identifiers}
+
+
+def _is_identified(compound: Compound) -> bool:
+    # what `identify_compound(s)` gives, partial records come from warming the cache
+    return compound.cid is not None and compound.inchi is not None and compound.iupac is not None
+
+
+def _merged_identity(old: Compound, new: Compound) -> tuple:
+    """
+    :return: (cid, smiles, inchi, iupac) of a stored compound updated with a new record
+    """
+    if _is_identified(old) and not _is_identified(new):
+        return old.cid, old.smiles, old.inchi, old.iupac
+    fields = ("cid", "smiles", "inchi", "iupac")
+    return tuple(getattr(old, f) if getattr(new, f) is None else getattr(new, f) for f in fields)
+
+
+class CompoundCache:
+
+    def __init__(self, path: FilePath = "compound_cache.sqlite", ttl: float = None, max_entries: int = None):
+        """
+        :param path: sqlite database file
+        :param ttl: seconds before a record expires, None means never
+        :param max_entries: least recently used records are evicted beyond this size
+        """
+        self.store = SqliteCache(path, ttl=ttl, max_entries=max_entries)
+
+    def get_many(self, identifiers: list[Union[str, int]], input_type: str) -> dict[Union[str, int], Compound]:
+        """
+        look up identified compounds, records without cid, inchi or iupac (e.g. warmed from scraped properties
+        or a vendor csv) count as misses
+
+        :return: a dict of input identifier -> compound for cache hits
+        """
+        keys = canonical_identifiers(identifiers, input_type)
+        found = self.store.get_many(input_type, keys.values(), record_stats=False)
+        compounds = dict()
+        for identifier, key in keys.items():
+            c = Compound.from_dict(json.loads(found[key])) if key in found else None
+            if c is None or not _is_identified(c):
+                self.store.misses[input_type] += 1
+                continue
+            self.store.hits[input_type] += 1
+            compounds[identifier] = c
+        return compounds
+
+    def get(self, identifier: Union[str, int], input_type: str) -> Union[Compound, None]:
+        return self.get_many([identifier], input_type).get(identifier)
+
+    def put_many(self, compounds: dict[Union[str, int], Compound], input_type: str):
+        """
+        store compounds, merged with existing records: properties are kept unless overwritten, cid, smiles, inchi
+        and iupac are kept unless the new value is not None, a partial record (e.g. from warming) never replaces
+        the identity of an identified compound
+        """
+        keys = {key: compounds[i] for i, key in canonical_identifiers(compounds, input_type).items()}
+        existing = self.store.get_many(input_type, keys.keys(), record_stats=False)
+        items = dict()
+        for key, c in keys.items():
+            if key in existing:
+                old = Compound.from_dict(json.loads(existing[key]))
+                properties = old.properties
+                properties.update(c.properties)
+                c = Compound(*_merged_identity(old, c), properties)
+            items[key] = json.dumps(c.as_dict(), cls=MontyEncoder)
+        self.store.set_many(input_type, items)
+
+    def put(self, identifier: Union[str, int], input_type: str, compound: Compound):
+        self.put_many({identifier: compound}, input_type)
+
+    def close(self):
+        self.store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """
+        :return: a dict of input type -> {"hits": ..., "misses": ..., "entries": ...}
+        """
+        return self.store.stats()
+
+    def warm_from_scraper_output(self, fn: FilePath):
+        """
+        load a `scraper_output.json` (smiles -> vendor property dict), records are stored without a cid,
+        their properties are merged into the compound once it is identified
+        """
+        data = json_load(fn)
+        compounds = dict()
+        for smi, properties in data.items():
+            inchi = properties.get("InChI")
+            if inchi is not None and not inchi.startswith("InChI="):
+                inchi = "InChI=" + inchi
+            compounds[smi] = Compound(None, smi, inchi, properties=properties)
+        self.put_many(compounds, 'smiles')
+        logger.info(f"cache warmed with {len(compounds)} records from: {fn}")
+
+    def warm_from_vendor_csv(self, fn: FilePath, batch_size: int = 10000):
+        """
+        load a csv from `download_vendor_compounds`, records are stored by both cid and smiles,
+        columns other than cid and isosmiles go to `Compound.properties`
+
+        the records have no inchi or iupac name and a vendor smiles, they count as misses until the compound is
+        identified, their properties are merged into the identified compound
+        """
+        n = 0
+        with open(fn, newline="") as f:
+            reader = csv.DictReader(f)
+            by_cid, by_smiles = dict(), dict()
+            for row in reader:
+                cid = int(row.pop("cid"))
+                smi = row.pop("isosmiles", None)
+                c = Compound(cid, smi, properties=row)
+                by_cid[cid] = c
+                if smi:
+                    by_smiles[smi] = c
+                if len(by_cid) >= batch_size:
+                    self.put_many(by_cid, 'cid')
+                    self.put_many(by_smiles, 'smiles')
+                    n += len(by_cid)
+                    by_cid, by_smiles = dict(), dict()
+            self.put_many(by_cid, 'cid')
+            self.put_many(by_smiles, 'smiles')
+            n += len(by_cid)
+        logger.info(f"cache warmed with {n} records from: {fn}")
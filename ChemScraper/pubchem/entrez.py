@@ -1,16 +1,30 @@
-import requests
+import io
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+from urllib.error import URLError
+
+import pandas as pd
 from loguru import logger
-from ratelimit import limits
 
+from ChemScraper import settings
+from ChemScraper.pubchem.limiter import ncbi_limiter, ncbi_session
 from ChemScraper.settings import *
-from ChemScraper.utils import find_between, download_file, FilePath, get_timestamp
+from ChemScraper.utils import find_between, download_file, FilePath, get_timestamp, strip_extension, createdir, \
+    removefile, chunks, get_extension, metrics_registry
+from ChemScraper.utils.columnar import csv_to_parquet
 
 """
 interact with NCBI entrez/eutils/sdq system 
 """
 
 
-@limits(calls=4, period=1)
+@ncbi_limiter
+@metrics_registry.timed("request_entrez_query")
 def request_entrez_query(
         eutils_method: str = "esearch", db: str = "pccompound",
         term: str = '"has src vendor"[Filter] AND ("Sigma-Aldrich"[SourceName] OR "Thermo Fisher Scientific"[SourceName])',
@@ -31,7 +45,8 @@ def request_entrez_query(
     if usehistory:
         url += "&usehistory=y"
     logger.info(f"request URL: {url}")
-    response = requests.get(url)
+    response = ncbi_session.get(url)
+    metrics_registry.inc("chemscraper_bytes_total", len(response.content), call="request_entrez_query")
     response.raise_for_status()
     data = response.json()
     return data
@@ -40,19 +55,37 @@ def request_entrez_query(
 def _get_esearch_info(esearch_data: dict):
     querykey = esearch_data['esearchresult']['querykey']
     webenv = esearch_data['esearchresult']['webenv']
-    count = esearch_data['esearchresult']['count']
+    count = int(esearch_data['esearchresult']['count'])
     return querykey, webenv, count
 
 
-@limits(calls=4, period=1)
+@ncbi_limiter
+@metrics_registry.timed("request_cachekey_for_esearch")
 def request_cachekey_for_esearch(querykey: int, webenv: str):
     url = 'https://pubchem.ncbi.nlm.nih.gov/list_gateway/list_gateway.cgi?action=entrez_to_cache'
     url += f'&entrez_db=pccompound&entrez_query_key={querykey}&entrez_webenv={webenv}'
-    rep = requests.get(url)
+    rep = ncbi_session.get(url)
+    metrics_registry.inc("chemscraper_bytes_total", len(rep.content), call="request_cachekey_for_esearch")
     rep.raise_for_status()
     return find_between(rep.text, '<Response_cache-key>', '</Response_cache-key>')
 
 
+def _sdq_query_url(cachekey: str, start: int, limit: int, field_string="cid,mw,isosmiles"):
+    url = settings.PubchemSdqUrl + '?'
+    url += 'infmt=json&outfmt=csv'
+    url += '&query={"download":"'
+    url += field_string
+    url += '","collection":"compound",'
+    url += '"where":{"ands":[{"input":{"type":"netcachekey","idtype":"cid",'
+    url += f'"key":"{cachekey}"'
+    # sorted by cid so a page holds the same rows in every run
+    url += '}}]},"order":["cid,asc"],'
+    url += f'"start":{start},'
+    url += f'"limit":{limit},'
+    url += '"downloadfilename":"PubChem_compound"}'
+    return url
+
+
 def sdq_download_csv_with_cachekey(cachekey: str, count: int, saveas: FilePath, field_string="cid,mw,isosmiles"):
     """
     use sdq agent to download pubchem search result identified by a cachekey
@@ -63,36 +96,155 @@ def sdq_download_csv_with_cachekey(cachekey: str, count: int, saveas: FilePath,
     for sdq+lit-search cases, see
     https://vfscalfani.github.io/MATLAB-cheminformatics/live_scripts_html/PubChem_SDQ_LitSearch.html
     """
-    url = 'https://pubchem.ncbi.nlm.nih.gov/sdq/sdqagent.cgi?'
-    url += 'infmt=json&outfmt=csv'
-    url += '&query={"download":"'
-    url += field_string
-    url += '","collection":"compound",'
-    url += '"where":{"ands":[{"input":{"type":"netcachekey","idtype":"cid",'
-    url += f'"key":"{cachekey}"'
-    url += '}}]},"order":["relevancescore,desc"],"start":1,'
-    url += f'"limit":{count},'
-    url += '"downloadfilename":"PubChem_compound"}'
+    url = _sdq_query_url(cachekey, 1, count, field_string)
     logger.info(f"download from URL: {url}")
+    ncbi_limiter.acquire()
     download_file(url, saveas)
 
 
-def download_vendor_compounds(
-        vendors=VendorSources, saveas: FilePath = None, test_url=False,
-        count_limit:int=None, field_string='cid,mw,isosmiles'
-):
+class SdqPageManifest:
+
+    def __init__(self, parts_dir: FilePath, query: dict, cachekey: str = None):
+        """
+        bookkeeping of downloaded pages, written to `manifest.json` in `parts_dir`
+
+        a manifest created for a different query is discarded together with its pages
+
+        :param query: what identifies the download, e.g. vendors, count, page_size and field_string,
+            the cache key is not part of it as every esearch gives a new one
+        :param cachekey: the cache key the pages are downloaded with, saved so a later run can reuse it,
+            see `load_cachekey`
+        """
+        self.parts_dir = parts_dir
+        self.path = os.path.join(parts_dir, "manifest.json")
+        self._lock = threading.Lock()
+        data = self._read(self.path)
+        if data is not None and data["query"] != query:
+            logger.warning(f"manifest in {parts_dir} is for a different query, restarting")
+            for page in data["pages"].values():
+                removefile(os.path.join(parts_dir, page["file"]))
+            data = None
+        if data is None:
+            data = {"query": query, "pages": dict()}
+        if cachekey is not None and cachekey != data.get("cachekey"):
+            data["cachekey"] = cachekey
+            data["cachekey_created"] = time.time()
+        self.data = data
+
+    @staticmethod
+    def _read(path: FilePath):
+        if not os.path.isfile(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    @staticmethod
+    def load_cachekey(parts_dir: FilePath, max_age: float = PubchemCachekeyMaxAge) -> tuple[dict, str]:
+        """
+        :return: (query, cache key) of the manifest in `parts_dir` if its cache key is younger than `max_age`,
+            otherwise (None, None)
+        """
+        data = SdqPageManifest._read(os.path.join(parts_dir, "manifest.json"))
+        if data is None or data.get("cachekey") is None or time.time() - data["cachekey_created"] > max_age:
+            return None, None
+        return data["query"], data["cachekey"]
+
+    def page_file(self, start: int) -> str:
+        return os.path.join(self.parts_dir, f"part_{start:010d}.csv")
+
+    def is_done(self, start: int) -> bool:
+        return str(start) in self.data["pages"] and os.path.isfile(self.page_file(start))
+
+    def mark_done(self, start: int, rows: int):
+        with self._lock:
+            self.data["pages"][str(start)] = {"file": os.path.basename(self.page_file(start)), "rows": rows}
+            self.save()
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def page_files(self) -> list[str]:
+        return [os.path.join(self.parts_dir, self.data["pages"][k]["file"])
+                for k in sorted(self.data["pages"], key=int)]
+
+
+def sdq_download_pages(
+        cachekey: str, count: int, parts_dir: FilePath, page_size: int = 100000, max_workers: int = 4,
+        field_string="cid,mw,isosmiles", max_retries: int = 3, query: dict = None,
+) -> list[str]:
     """
-    main function to download a list of pubchem compounds deposited by chemical vendors
+    download a sdq query in pages of `page_size` rows, several pages at a time, every page is saved to
+    a part file in `parts_dir` and recorded in a manifest, pages already in the manifest are skipped
 
-    :param vendors: a tuple of chemical vendor names
-    :param saveas: csv file to be saved as
-    :param test_url: if True, no download will happen, only urls are printed in log
-    :param count_limit: entry limit for downloading
-    :param field_string: fields to be downloaded, default 'cid,mw,isosmiles'
-    :return:
+    :param query: extra entries identifying the download in the manifest, e.g. {"vendors": [...]}
+    :return: part files in page order
+    """
+    createdir(parts_dir)
+    query = {**(query or dict()), "count": count, "page_size": page_size, "field_string": field_string}
+    manifest = SdqPageManifest(parts_dir, query, cachekey)
+    manifest.save()
+    starts = [start for start in range(1, count + 1, page_size) if not manifest.is_done(start)]
+    logger.info(f"sdq pages to download: {len(starts)}/{len(range(1, count + 1, page_size))}")
+
+    def _download_page(start: int):
+        limit = min(page_size, count - start + 1)
+        url = _sdq_query_url(cachekey, start, limit, field_string)
+        part_file = manifest.page_file(start)
+        tmp = part_file + ".tmp"
+        for attempt in range(max_retries + 1):
+            try:
+                ncbi_limiter.acquire()
+                download_file(url, tmp, progress_bar=False)
+                break
+            except (URLError, ValueError) as e:
+                logger.warning(f"sdq page {start} failed, attempt {attempt + 1}: {e}")
+                if attempt == max_retries:
+                    removefile(tmp)
+                    raise e
+                metrics_registry.inc("chemscraper_retries_total", call="sdq_download_page")
+        with open(tmp, "r") as f:
+            rows = sum(1 for _ in f) - 1
+        os.replace(tmp, part_file)
+        manifest.mark_done(start, rows)
+        logger.info(f"sdq page {start} saved with {rows} rows")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for future in [executor.submit(_download_page, start) for start in starts]:
+            future.result()
+    return manifest.page_files()
+
+
+def merge_sdq_pages(part_files: list[FilePath], saveas: FilePath):
+    """
+    concatenate part csv files, the header is written once
+    """
+    with open(saveas, "w") as fout:
+        for i, part_file in enumerate(part_files):
+            with open(part_file, "r") as fin:
+                header = fin.readline()
+                if i == 0:
+                    fout.write(header)
+                for line in fin:
+                    fout.write(line)
+
+
+def iter_sdq_pages(part_files: list[FilePath], **read_csv_kwargs) -> Iterator[pd.DataFrame]:
+    """
+    lazily read part csv files as one dataset, one dataframe per page
+    """
+    for part_file in part_files:
+        yield pd.read_csv(part_file, **read_csv_kwargs)
+
+
+def esearch_vendor_cachekey(vendors=VendorSources) -> tuple[str, int]:
+    """
+    esearch for compounds deposited by vendors and convert the result to a pubchem cache key
+
+    :return: cache key, number of compounds
     """
-    if saveas is None:
-        saveas = f"PubchemVendorCompounds_{get_timestamp()}.csv"
     esearch_term = '"has src vendor"[Filter] AND '
     esearch_source = ['"{}"[SourceName]'.format(v) for v in vendors]
     esearch_source = " OR ".join(esearch_source)
@@ -109,8 +261,177 @@ def download_vendor_compounds(
     logger.info(f"esearch count: {count}")
     cachekey = request_cachekey_for_esearch(querykey, webenv)
     logger.info(f"esearch converted to cache key at: https://pubchem.ncbi.nlm.nih.gov//#query={cachekey}")
-    if not test_url:
-        if count_limit is None:
+    return cachekey, count
+
+
+def download_vendor_compounds(
+        vendors=VendorSources, saveas: FilePath = None, test_url=False,
+        count_limit:int=None, field_string='cid,mw,isosmiles',
+        page_size: int = None, max_workers: int = 4, parts_dir: FilePath = None, merge_pages=True,
+):
+    """
+    main function to download a list of pubchem compounds deposited by chemical vendors
+
+    :param vendors: a tuple of chemical vendor names
+    :param saveas: file to be saved as, a `.parquet` extension converts the download to typed columnar storage,
+        see `ChemScraper.utils.columnar`
+    :param test_url: if True, no download will happen, only urls are printed in log
+    :param count_limit: entry limit for downloading
+    :param field_string: fields to be downloaded, default 'cid,mw,isosmiles'
+    :param page_size: if given, download in pages of this size, see `sdq_download_pages`,
+        a failed run can be resumed by calling again with the same `parts_dir`
+    :param max_workers: number of pages downloaded at the same time
+    :param parts_dir: folder for part files, default to `<saveas>_parts`, or `PubchemVendorCompounds_parts`
+        if `saveas` is not given so that a rerun with the default arguments resumes
+    :param merge_pages: merge part files into `saveas`, otherwise use `iter_sdq_pages` on the returned part files
+    :return: None, or the list of part files if `page_size` is given
+    """
+    if page_size is not None and parts_dir is None:
+        parts_dir = "PubchemVendorCompounds_parts" if saveas is None else f"{strip_extension(saveas)}_parts"
+    if saveas is None:
+        saveas = f"PubchemVendorCompounds_{get_timestamp()}.csv"
+    query = {"vendors": list(vendors)}
+
+    # resume with the cache key of the previous run while it is valid, a new esearch gives a new key
+    saved_query, cachekey = (None, None) if page_size is None else SdqPageManifest.load_cachekey(parts_dir)
+    if cachekey is not None and all(saved_query.get(k) == v for k, v in query.items()) and \
+            saved_query["page_size"] == page_size and saved_query["field_string"] == field_string:
+        count = saved_query["total"]
+        logger.info(f"resuming sdq download in {parts_dir} with cache key: {cachekey}")
+    else:
+        cachekey, count = esearch_vendor_cachekey(vendors)
+    query["total"] = count
+    if count_limit is not None:
+        count = min(count, count_limit)
+    if test_url:
+        return
+    to_parquet = get_extension(saveas).lower() == "parquet"
+    if page_size is None:
+        if to_parquet:
+            csv_file = f"{strip_extension(saveas)}.csv"
+            sdq_download_csv_with_cachekey(cachekey, count, csv_file, field_string)
+            csv_to_parquet(csv_file, saveas)
+            removefile(csv_file)
+        else:
             sdq_download_csv_with_cachekey(cachekey, count, saveas, field_string)
+        return
+    part_files = sdq_download_pages(cachekey, count, parts_dir, page_size, max_workers, field_string, query=query)
+    if merge_pages:
+        if to_parquet:
+            csv_to_parquet(part_files, saveas)
         else:
-            sdq_download_csv_with_cachekey(cachekey, count_limit, saveas, field_string)
+            merge_sdq_pages(part_files, saveas)
+        logger.info(f"merged {len(part_files)} pages into: {saveas}")
+    return part_files
+
+
+# sdq field name -> pug rest property name
+_SdqToPugRestProperty = {
+    'mw': 'MolecularWeight',
+    'mf': 'MolecularFormula',
+    'exactmass': 'ExactMass',
+    'isosmiles': 'IsomericSMILES',
+    'canonicalsmiles': 'CanonicalSMILES',
+    'inchi': 'InChI',
+    'inchikey': 'InChIKey',
+    'iupacname': 'IUPACName',
+    'xlogp': 'XLogP',
+}
+
+
+@ncbi_limiter
+@metrics_registry.timed("request_compound_properties")
+def request_compound_properties(cids: list[int], properties: list[str]) -> str:
+    """
+    pug rest property table of a list of cids as csv text
+
+    https://pubchemdocs.ncbi.nlm.nih.gov/pug-rest
+    """
+    url = f"{settings.PubchemRestUrl}/compound/cid/property/{','.join(properties)}/CSV"
+    rep = ncbi_session.post(url, data={"cid": ",".join(str(cid) for cid in cids)})
+    metrics_registry.inc("chemscraper_bytes_total", len(rep.content), call="request_compound_properties")
+    rep.raise_for_status()
+    return rep.text
+
+
+def fetch_compound_properties(
+        cids: list[int], field_string='cid,mw,isosmiles', chunk_size: int = 1000, max_workers: int = 4,
+) -> pd.DataFrame:
+    """
+    fetch sdq fields for a list of cids from pug rest, columns are named as in a sdq download
+
+    :param field_string: sdq fields, see `_SdqToPugRestProperty` for supported fields
+    """
+    fields = field_string.split(',')
+    try:
+        properties = [_SdqToPugRestProperty[f] for f in fields if f != 'cid']
+    except KeyError as e:
+        raise ValueError(f"field not supported by pug rest: {e}")
+    rename = {'CID': 'cid'}
+    rename.update({_SdqToPugRestProperty[f]: f for f in fields if f != 'cid'})
+    if len(cids) == 0:
+        return pd.DataFrame(columns=fields)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        texts = list(executor.map(lambda c: request_compound_properties(c, properties), chunks(cids, chunk_size)))
+    df = pd.concat([pd.read_csv(io.StringIO(t)) for t in texts], axis=0, ignore_index=True)
+    return df.rename(columns=rename)[fields]
+
+
+def sync_vendor_compounds(
+        snapshot_dir: FilePath, vendors=VendorSources, field_string='cid,mw,isosmiles',
+        page_size: int = None, max_workers: int = 4,
+) -> dict[str, list[int]]:
+    """
+    incremental version of `download_vendor_compounds`
+
+    the snapshot `snapshot_dir/snapshot.csv` is created by a full sdq download in the first run,
+    later runs only download the current cid list, fetch `field_string` columns for new cids from pug rest
+    and drop removed cids, the changes of every run are saved to `snapshot_dir/changes_<timestamp>.json`
+
+    :param page_size: page size used for sdq downloads, see `sdq_download_pages`
+    :return: {"added": cids, "removed": cids}
+    """
+    createdir(snapshot_dir)
+    snapshot_csv = os.path.join(snapshot_dir, "snapshot.csv")
+    timestamp = get_timestamp()
+    cachekey, count = esearch_vendor_cachekey(vendors)
+
+    def _sdq_download(saveas, fields):
+        if page_size is None:
+            sdq_download_csv_with_cachekey(cachekey, count, saveas, fields)
+        else:
+            parts_dir = f"{strip_extension(saveas)}_parts"
+            merge_sdq_pages(sdq_download_pages(cachekey, count, parts_dir, page_size, max_workers, fields), saveas)
+            shutil.rmtree(parts_dir)
+
+    if not os.path.isfile(snapshot_csv):
+        logger.info(f"no snapshot found in {snapshot_dir}, downloading all {count} compounds")
+        tmp = snapshot_csv + ".tmp.csv"
+        _sdq_download(tmp, field_string)
+        os.replace(tmp, snapshot_csv)
+        changes = {"added": pd.read_csv(snapshot_csv, usecols=['cid'])['cid'].tolist(), "removed": []}
+    else:
+        df_snapshot = pd.read_csv(snapshot_csv)
+        if list(df_snapshot.columns) != field_string.split(','):
+            raise ValueError(f"snapshot columns {list(df_snapshot.columns)} do not match: {field_string}")
+        cid_csv = os.path.join(snapshot_dir, f"cids_{timestamp}.csv")
+        _sdq_download(cid_csv, 'cid')
+        current_cids = set(pd.read_csv(cid_csv)['cid'])
+        removefile(cid_csv)
+        known_cids = set(df_snapshot['cid'])
+        changes = {
+            "added": sorted(int(cid) for cid in current_cids - known_cids),
+            "removed": sorted(int(cid) for cid in known_cids - current_cids),
+        }
+        logger.info(f"snapshot sync, added: {len(changes['added'])}, removed: {len(changes['removed'])}")
+        df_added = fetch_compound_properties(changes['added'], field_string, max_workers=max_workers)
+        df_snapshot = df_snapshot[~df_snapshot['cid'].isin(changes['removed'])]
+        df_snapshot = pd.concat([df_snapshot, df_added], axis=0, ignore_index=True)
+        tmp = snapshot_csv + ".tmp.csv"
+        df_snapshot.to_csv(tmp, index=False)
+        os.replace(tmp, snapshot_csv)
+
+    with open(os.path.join(snapshot_dir, f"changes_{timestamp}.json"), "w") as f:
+        json.dump(changes, f)
+    return changes
@@ -1,15 +1,21 @@
+import random
+import re
 import time
 from collections import defaultdict
-from typing import Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Union
+from urllib.error import URLError
 
-import rdkit.Chem
-import requests
 from loguru import logger
-from ratelimit import limits
-from requests.exceptions import HTTPError
+from requests.exceptions import HTTPError, RequestException
+from tqdm import tqdm
 
+from ChemScraper import settings
+from ChemScraper.pubchem.cache import CompoundCache
+from ChemScraper.pubchem.limiter import ncbi_limiter, ncbi_session
 from ChemScraper.schema import Compound
-from ChemScraper.utils import find_between, download_file, FilePath, get_timestamp, removefile, inchi2smiles
+from ChemScraper.utils import find_between, FilePath, inchi2smiles, chunks, iter_url_lines, metrics_registry, \
+    canon_smiles
 
 """
 interact with power-user-gateway directly using xml
@@ -17,10 +23,10 @@ https://pubchemdocs.ncbi.nlm.nih.gov/power-user-gateway
 """
 
 
-def _generate_idxc_pct_xml(identifiers: list[str], input_type, output_type: str = "cid"):
+def _generate_idxc_pct_xml(identifiers: list[str], input_type, output_type: str = "cid", compression: str = "gzip"):
     header = '<?xml version="1.0"?>\n<!DOCTYPE PCT-Data PUBLIC "-//NCBI//NCBI PCTools/EN" "NCBI_PCTools.dtd">\n'
     body_top = """<PCT-Data>\n<PCT-Data_input>\n<PCT-InputData>\n<PCT-InputData_query>\n<PCT-Query>\n<PCT-Query_type>\n<PCT-QueryType>\n<PCT-QueryType_id-exchange>\n<PCT-QueryIDExchange>\n<PCT-QueryIDExchange_input>\n<PCT-QueryUids>"""
-    body_bot = f"""</PCT-QueryUids>\n</PCT-QueryIDExchange_input>\n<PCT-QueryIDExchange_operation-type value="same"/>\n<PCT-QueryIDExchange_output-type value="{output_type}"/>\n<PCT-QueryIDExchange_output-method value="file-pair"/>\n<PCT-QueryIDExchange_compression value="none"/>\n</PCT-QueryIDExchange>\n</PCT-QueryType_id-exchange>\n</PCT-QueryType>\n</PCT-Query_type>\n</PCT-Query>\n</PCT-InputData_query>\n</PCT-InputData>\n</PCT-Data_input>\n</PCT-Data>"""
+    body_bot = f"""</PCT-QueryUids>\n</PCT-QueryIDExchange_input>\n<PCT-QueryIDExchange_operation-type value="same"/>\n<PCT-QueryIDExchange_output-type value="{output_type}"/>\n<PCT-QueryIDExchange_output-method value="file-pair"/>\n<PCT-QueryIDExchange_compression value="{compression}"/>\n</PCT-QueryIDExchange>\n</PCT-QueryType_id-exchange>\n</PCT-QueryType>\n</PCT-Query_type>\n</PCT-Query>\n</PCT-InputData_query>\n</PCT-InputData>\n</PCT-Data_input>\n</PCT-Data>"""
     if input_type == 'smiles':
         body = "<PCT-QueryUids_smiles>\n"
         for smi in identifiers:
@@ -57,37 +63,152 @@ def _generate_pug_fetch_xml(reqid: str):
     return request_xml
 
 
-@limits(calls=4, period=1)
+@ncbi_limiter
+@metrics_registry.timed("request_pug")
 def request_pug(xml):
-    resp = requests.post(
-        url="https://pubchem.ncbi.nlm.nih.gov/pug/pug.cgi",
+    resp = ncbi_session.post(
+        url=settings.PubchemPugUrl,
         data=xml,
     )
+    metrics_registry.inc("chemscraper_bytes_total", len(resp.content), call="request_pug")
     return resp
 
 
-def request_convert_identifiers(
-        identifiers: Union[list[str], list[int]], input_type: str = 'smiles', output_type: str = 'cids',
-        tmpfile: FilePath = None,
-        total_time_limit=500, retry_interval=10,
-):
+@ncbi_limiter
+@metrics_registry.timed("request_fastidentity")
+def request_fastidentity(identifier: Union[str, int], input_type: str) -> dict:
+    url = f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/fastidentity/{input_type}/{identifier}" \
+          f"/property/InChI,CanonicalSMILES,IUPACName/json?identity_type=same_stereo_isotope"
+    resp = ncbi_session.get(url)
+    metrics_registry.inc("chemscraper_bytes_total", len(resp.content), call="request_fastidentity")
+    resp.raise_for_status()
+    return resp.json()
+
+
+class PugTimeoutError(TimeoutError):
+    """ raised when pug jobs are not finished before the deadline """
+
+
+class PugJobError(RuntimeError):
+    """ raised when pug reports a failed job """
+
+
+def _parse_pug_status(text: str) -> tuple[str, Union[str, None]]:
     """
-    :param input_type: 'smiles', 'cid', 'inchi'
-    :param output_type: 'smiles', 'cid', 'inchi', 'iupac'
+    parse the response of a status request
 
-    idx webpage
-    https://pubchem.ncbi.nlm.nih.gov/idexchange/idexchange.cgi
+    :return: (status, download url), url is None if the job is not finished
+    """
+    status = re.search(r'<PCT-Status value="([^"]+)"', text)
+    status = status.group(1) if status else "unknown"
+    if '<PCT-Download-URL_url>' in text:
+        return status, find_between(text, '<PCT-Download-URL_url>', '</PCT-Download-URL_url>')
+    return status, None
 
-    pug doc:
-    https://pubchemdocs.ncbi.nlm.nih.gov/power-user-gateway
 
-    old examples pubchem pug:
-    https://depth-first.com/articles/2007/06/11/hacking-pubchem-learning-to-speak-pug/
+class PugPoller:
+
+    def __init__(
+            self, initial_interval: float = 0.5, max_interval: float = 10.0, factor: float = 2.0,
+            jitter: float = 0.2, deadline: float = 500,
+    ):
+        """
+        poll pug request ids until their results are ready
+
+        the interval for each request id starts at `initial_interval` and is multiplied by `factor` after every
+        unfinished poll (capped at `max_interval`), a random jitter of +/- `jitter` (relative) is applied
+
+        :param deadline: seconds allowed for one call of `poll_many`
+        """
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.jitter = jitter
+        self.deadline = deadline
+        # reqid -> {"elapsed": seconds to result, "polls": number of status requests}
+        self.records: dict[str, dict] = dict()
+        # reqid -> exception, only filled when polling with `raise_errors=False`
+        self.errors: dict[str, Exception] = dict()
+
+    def _next_interval(self, interval: float) -> float:
+        return min(interval * self.factor, self.max_interval)
+
+    def _jittered(self, interval: float) -> float:
+        return interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def poll(self, reqid: str) -> str:
+        return self.poll_many([reqid])[reqid]
+
+    def poll_many(self, reqids: list[str], raise_errors: bool = True) -> dict[str, str]:
+        """
+        poll many request ids in one loop
+
+        :param raise_errors: if False, failed or timed out jobs are recorded in `self.errors` instead of raising
+        :return: a dict of reqid -> download url
+        """
+        ts_start = time.monotonic()
+        # reqid -> [next poll time, current interval, number of polls]
+        pending = {reqid: [ts_start + self._jittered(self.initial_interval), self.initial_interval, 0]
+                   for reqid in reqids}
+        results = dict()
+        while pending:
+            reqid = min(pending, key=lambda k: pending[k][0])
+            next_time, interval, npolls = pending[reqid]
+            now = time.monotonic()
+            if next_time - ts_start > self.deadline:
+                error = PugTimeoutError(
+                    f"pug jobs not finished after {now - ts_start:.1f} s: {sorted(pending.keys())}"
+                )
+                if raise_errors:
+                    raise error
+                for k in pending:
+                    self.errors[k] = error
+                break
+            if next_time > now:
+                time.sleep(next_time - now)
+
+            logger.info(f"fetching request: {reqid}")
+            npolls += 1
+            metrics_registry.inc("chemscraper_pug_polls_total")
+            try:
+                resp = request_pug(_generate_pug_fetch_xml(reqid))
+                resp.raise_for_status()
+                status, url = _parse_pug_status(resp.text)
+            except (HTTPError, IndexError) as e:
+                logger.info(f"fetching failed: {e}")
+                status, url = "unknown", None
+
+            if status.endswith("error"):
+                error = PugJobError(f"pug job {reqid} failed with status: {status}")
+                if raise_errors:
+                    raise error
+                self.errors[reqid] = error
+                pending.pop(reqid)
+                continue
+            if url:
+                elapsed = time.monotonic() - ts_start
+                self.records[reqid] = {"elapsed": elapsed, "polls": npolls}
+                logger.info(f"fetched {reqid} after {elapsed:.3f} s and {npolls} polls")
+                results[reqid] = url
+                pending.pop(reqid)
+            else:
+                interval = self._next_interval(interval)
+                pending[reqid] = [time.monotonic() + self._jittered(interval), interval, npolls]
+                logger.info(f"{reqid} status: {status}, retry after: {interval:.2f} s")
+        return results
+
+
+def submit_convert_identifiers(
+        identifiers: Union[list[str], list[int]], input_type: str = 'smiles', output_type: str = 'cids',
+        compression: str = 'gzip',
+) -> str:
+    """
+    submit an id exchange job
+
+    :param compression: compression of the result file, 'none' or 'gzip'
+    :return: pug request id
     """
-    if tmpfile is None:
-        tmpfile = f"converted_I{input_type}O{output_type}_{get_timestamp()}.txt"
-    # compose and submit idxc xml
-    xml = _generate_idxc_pct_xml(identifiers, input_type, output_type)
+    xml = _generate_idxc_pct_xml(identifiers, input_type, output_type, compression)
     resp = request_pug(xml)
     resp.raise_for_status()
 
@@ -96,70 +217,184 @@ def request_convert_identifiers(
     except IndexError as e:
         logger.error(resp.text)
         raise e
+    return reqid
 
-    fetch_xml = _generate_pug_fetch_xml(reqid)
 
-    # fetch the request id, retry if not finished
-    time.sleep(1)
-    time_counter = 0.0
-    while time_counter < total_time_limit:
-        logger.info(f"fetching request: {reqid}")
-        try:
-            fetch_resp = request_pug(fetch_xml)
-            fetch_resp.raise_for_status()
-            ftp_url = find_between(fetch_resp.text, '<PCT-Download-URL_url>', '</PCT-Download-URL_url>')
-            assert len(ftp_url) > 0
-            download_file(ftp_url, tmpfile)
-            logger.info(f"fetched!")
-            break
-        except (HTTPError, AssertionError, IndexError) as e:
-            logger.info(f"fetching failed: {e}")
-            logger.info(f"retry after: {retry_interval}, total time cost: {time_counter}/{total_time_limit}")
-            time.sleep(retry_interval)
-            time_counter += retry_interval
-
-    # read downloaded file
-    with open(tmpfile, 'r') as f:
-        lines = f.readlines()
-    result_mapping = dict()
-    for line in lines:
-        items = line.strip().split()
-        if len(items) == 0:
+def iter_converted_identifiers(ftp_url: str, input_type: str) -> Iterator[tuple[Union[str, int], Union[str, None]]]:
+    """
+    stream the result file of an id exchange job, plain or gzip compressed
+
+    :return: a generator of (input identifier, output identifier), output is None if not found
+    """
+    for line in iter_url_lines(ftp_url):
+        items = line.rstrip("\r\n").split("\t")
+        if len(items) == 0 or len(items[0].strip()) == 0:
             continue
-        elif input_type == 'cid':
+        items = [i.strip() for i in items]
+        if input_type == 'cid':
             items[0] = int(items[0])
 
-        if len(items) == 1:
-            result_mapping[items[0]] = None
+        if len(items) == 1 or len(items[1]) == 0:
+            yield items[0], None
         elif len(items) == 2:
-            result_mapping[items[0]] = items[1]
+            yield items[0], items[1]
         else:
             raise ValueError(f"funny line: {line}")
-    removefile(tmpfile)
+
+
+def download_converted_identifiers(ftp_url: str, input_type: str) -> dict:
+    """
+    read the result of an id exchange job into a dict
+    """
+    return dict(iter_converted_identifiers(ftp_url, input_type))
+
+
+def request_convert_identifiers(
+        identifiers: Union[list[str], list[int]], input_type: str = 'smiles', output_type: str = 'cids',
+        tmpfile: FilePath = None,
+        total_time_limit=500, retry_interval=10, poller: PugPoller = None,
+):
+    """
+    :param input_type: 'smiles', 'cid', 'inchi'
+    :param output_type: 'smiles', 'cid', 'inchi', 'iupac'
+    :param tmpfile: not used, the result is streamed without writing a file, kept for compatibility
+    :param total_time_limit: deadline in seconds, `PugTimeoutError` is raised if the job is not finished by then
+    :param retry_interval: max interval between two polls
+    :param poller: if given, `total_time_limit` and `retry_interval` are ignored
+
+    idx webpage
+    https://pubchem.ncbi.nlm.nih.gov/idexchange/idexchange.cgi
+
+    pug doc:
+    https://pubchemdocs.ncbi.nlm.nih.gov/power-user-gateway
+
+    old examples pubchem pug:
+    https://depth-first.com/articles/2007/06/11/hacking-pubchem-learning-to-speak-pug/
+    """
+    if poller is None:
+        poller = PugPoller(max_interval=retry_interval, deadline=total_time_limit)
+    reqid = submit_convert_identifiers(identifiers, input_type, output_type)
+    ftp_url = poller.poll(reqid)
+    return download_converted_identifiers(ftp_url, input_type)
+
+
+def run_convert_jobs(
+        jobs: list[tuple[list, str, str]], max_workers: int = 4, max_retries: int = 2, poller: PugPoller = None,
+        progress: bool = True,
+) -> list[dict]:
+    """
+    submit many id exchange jobs at once, poll them in one loop and download their results,
+    only the jobs that failed are resubmitted
+
+    :param jobs: a list of (identifiers, input_type, output_type)
+    :param max_workers: number of threads used for submitting and downloading, requests are rate limited anyway
+    :param max_retries: how many times a failed job is resubmitted
+    :param poller: poller used for all rounds
+    :param progress: show a progress bar of finished jobs
+    :return: a list of result mappings in the same order as `jobs`
+    """
+    if poller is None:
+        poller = PugPoller()
+    results = [None] * len(jobs)
+    todo = list(range(len(jobs)))
+    n_identifiers = 0
+    ts_start = time.monotonic()
+    pbar = tqdm(total=len(jobs), unit="job", disable=not progress)
+
+    def _submit(ijob):
+        return submit_convert_identifiers(*jobs[ijob])
+
+    def _download(ijob, url):
+        return download_converted_identifiers(url, jobs[ijob][1])
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for attempt in range(max_retries + 1):
+            if not todo:
+                break
+            if attempt > 0:
+                logger.warning(f"resubmitting {len(todo)} failed jobs, attempt: {attempt}/{max_retries}")
+                metrics_registry.inc("chemscraper_retries_total", len(todo), call="pug_convert_job")
+            failed = []
+            submitted = dict()
+            for ijob, future in [(ijob, executor.submit(_submit, ijob)) for ijob in todo]:
+                try:
+                    submitted[future.result()] = ijob
+                except (RequestException, IndexError) as e:
+                    logger.error(f"failed to submit job {ijob}: {e}")
+                    failed.append(ijob)
+
+            poller.errors.clear()
+            urls = poller.poll_many(list(submitted.keys()), raise_errors=False)
+            for reqid, error in poller.errors.items():
+                logger.error(f"job {submitted[reqid]} failed: {error}")
+                failed.append(submitted[reqid])
+
+            downloads = {executor.submit(_download, submitted[reqid], url): submitted[reqid]
+                         for reqid, url in urls.items()}
+            for future, ijob in downloads.items():
+                try:
+                    results[ijob] = future.result()
+                except (HTTPError, URLError, ValueError) as e:
+                    logger.error(f"failed to download job {ijob}: {e}")
+                    failed.append(ijob)
+                    continue
+                n_identifiers += len(jobs[ijob][0])
+                pbar.update(1)
+                pbar.set_postfix(ids_per_s="{:.1f}".format(n_identifiers / (time.monotonic() - ts_start)))
+            todo = sorted(failed)
+    pbar.close()
+    if todo:
+        raise PugJobError(f"jobs failed after {max_retries} retries: {todo}")
+    return results
+
+
+def request_convert_identifiers_chunked(
+        identifiers: Union[list[str], list[int]], input_type: str = 'smiles', output_type: str = 'cids',
+        chunk_size: int = 5000, max_workers: int = 4, max_retries: int = 2, poller: PugPoller = None,
+) -> dict:
+    """
+    split a large list of identifiers into chunks, each chunk is one id exchange job,
+    see `run_convert_jobs` for how the jobs are run
+
+    :return: merged result mapping in input order
+    """
+    jobs = [(chunk, input_type, output_type) for chunk in chunks(identifiers, chunk_size)]
+    logger.info(f"converting {len(identifiers)} identifiers in {len(jobs)} chunks")
+    result_mapping = dict()
+    for d in run_convert_jobs(jobs, max_workers, max_retries, poller):
+        result_mapping.update(d)
     return result_mapping
 
 
-def identify_compound(identifier: Union[str, int], input_type: str) -> Compound:
+def identify_compound(identifier: Union[str, int], input_type: str, cache: CompoundCache = None) -> Compound:
     """
     use `fastidentity` of pug rest, one per request, not suitable for bulk identification
 
     :param identifier: string or int (cid)
     :param input_type: 'smiles', 'cid', 'inchi'
+    :param cache: if given, the compound is looked up in the cache first and stored there after identification
     :return:
     """
+    if cache is not None:
+        compound = cache.get(identifier, input_type)
+        if compound is not None:
+            return compound
+        compound = identify_compound(identifier, input_type)
+        cache.put(identifier, input_type, compound)
+        return compound
+
     if input_type == 'inchi':
         smi = inchi2smiles(identifier)
         input_type = 'smiles'
         identifier = smi
 
     if input_type == 'smiles':
-        identifier = rdkit.Chem.CanonSmiles(identifier)
+        canonical = canon_smiles(identifier)
+        if canonical is None:
+            raise ValueError(f"invalid smiles: {identifier}")
+        identifier = canonical
 
-    url = f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/fastidentity/{input_type}/{identifier}/property/InChI,CanonicalSMILES,IUPACName/json"
-    url += "?identity_type=same_stereo_isotope"
-    resp = requests.get(url)
-    resp.raise_for_status()
-    data = resp.json()
+    data = request_fastidentity(identifier, input_type)
     entries = data['PropertyTable']['Properties']
     if len(entries) > 1:
         logger.warning(f'fast identity returning multiple entries: {len(entries)}')
@@ -171,18 +406,52 @@ def identify_compound(identifier: Union[str, int], input_type: str) -> Compound:
     return Compound(cid, smi, inchi, name)
 
 
-def identify_compounds(identifiers: Union[list[str], list[int]], input_type: str = 'smiles', ) -> dict[str, Compound]:
+def identify_compounds(
+        identifiers: Union[list[str], list[int]], input_type: str = 'smiles', concurrent: bool = False,
+        chunk_size: int = None, cache: CompoundCache = None,
+) -> dict[str, Compound]:
     """
     use pug, suitable for bulk identifications
 
     :param input_type: 'smiles', 'cid', 'inchi'
+    :param concurrent: if True, the four conversions are submitted at once and polled in one loop,
+        all requests still go through the shared NCBI rate limiter
+    :param chunk_size: if given, identifiers are split into chunks of this size for every conversion,
+        implies `concurrent`
+    :param cache: if given, only identifiers missing from the cache are sent to pubchem,
+        newly identified compounds are stored in the cache
     :return:
     """
-    identifier_dicts = []
+    if cache is not None:
+        compound_dict = cache.get_many(identifiers, input_type)
+        misses = [i for i in identifiers if i not in compound_dict]
+        logger.info(f"compound cache hits: {len(compound_dict)}, misses: {len(misses)}")
+        if misses:
+            identified = identify_compounds(misses, input_type, concurrent, chunk_size)
+            cache.put_many(identified, input_type)
+            compound_dict.update(identified)
+        return compound_dict
+
+    if not identifiers:
+        return dict()
     output_types = ['cid', 'inchi', 'iupac', 'smiles']
-    for output_type in output_types:
-        d = request_convert_identifiers(identifiers, input_type, output_type)
-        identifier_dicts.append(d)
+    if concurrent or chunk_size is not None:
+        if chunk_size is None:
+            chunk_size = len(identifiers)
+        identifier_chunks = list(chunks(identifiers, chunk_size))
+        jobs = [(chunk, input_type, output_type) for output_type in output_types for chunk in identifier_chunks]
+        job_results = run_convert_jobs(jobs)
+        identifier_dicts = []
+        for i in range(len(output_types)):
+            d = dict()
+            for chunk_result in job_results[i * len(identifier_chunks): (i + 1) * len(identifier_chunks)]:
+                d.update(chunk_result)
+            identifier_dicts.append(d)
+    else:
+        identifier_dicts = []
+        for output_type in output_types:
+            d = request_convert_identifiers(identifiers, input_type, output_type)
+            identifier_dicts.append(d)
 
     dd = defaultdict(dict)
     for d, iname in zip(identifier_dicts, output_types):
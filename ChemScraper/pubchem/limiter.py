@@ -0,0 +1,10 @@
+from ChemScraper.settings import NcbiRateLimits
+from ChemScraper.utils import RateLimiter, get_pooled_session
+
+"""
+one process-wide limiter and keep-alive session shared by all requests sent to NCBI servers
+"""
+
+ncbi_limiter = RateLimiter(NcbiRateLimits, name="ncbi")
+
+ncbi_session = get_pooled_session()
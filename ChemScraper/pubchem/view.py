@@ -1,11 +1,16 @@
-import pprint
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Iterable, Iterator, Union
 
-import requests
-from ratelimit import limits
-from requests.exceptions import HTTPError
+from loguru import logger
+from requests.exceptions import HTTPError, RequestException
 
+from ChemScraper.pubchem.limiter import ncbi_limiter, ncbi_session
 from ChemScraper.settings import *
-from ChemScraper.utils import traverse_json
+from ChemScraper.utils import FilePath, metrics_registry
 
 """
 interact with pug view
@@ -16,7 +21,8 @@ https://gist.github.com/KhepryQuixote/00946f2f7dd5f89324d8
 """
 
 
-@limits(calls=4, period=1)
+@ncbi_limiter
+@metrics_registry.timed("request_pug_view")
 def request_pug_view(cid: int, task='cas') -> dict:
     if task == 'cas':
         url = "https://pubchem.ncbi.nlm.nih.gov/rest/pug_view/data/compound/{}/JSON?heading=CAS".format(cid)
@@ -24,18 +30,49 @@ def request_pug_view(cid: int, task='cas') -> dict:
         url = "https://pubchem.ncbi.nlm.nih.gov/rest/pug_view/categories/compound/{}/JSON".format(cid)
     else:
         raise NotImplementedError(f"unknown task: {task}")
-    response = requests.get(url)
+    response = ncbi_session.get(url)
+    metrics_registry.inc("chemscraper_bytes_total", len(response.content), call="request_pug_view")
     response.raise_for_status()
     return response.json()
 
 
-def _get_cas_number_from_pug_view(data: dict):
-    for v in traverse_json(data):
-        leaf = v[-1]
-        if not isinstance(leaf, str):
+def _iter_pug_view_sections(sections: list[dict]):
+    for section in sections:
+        yield section
+        yield from _iter_pug_view_sections(section.get('Section', []))
+
+
+def _get_cas_numbers_from_pug_view(data: dict) -> list[dict[str, str]]:
+    """
+    walk only Section/Information/Value/StringWithMarkup of the CAS sections
+
+    :return: a list of {"cas": cas number, "source": source name of the reference}
+    """
+    record = data.get('Record', dict())
+    sources = {ref.get('ReferenceNumber'): ref.get('SourceName') for ref in record.get('Reference', [])}
+    found = []
+    for section in _iter_pug_view_sections(record.get('Section', [])):
+        if section.get('TOCHeading') != 'CAS':
             continue
-        if "https://commonchemistry.cas.org/detail" in leaf:
-            return leaf.replace("https://commonchemistry.cas.org/detail?cas_rn=", "")
+        for info in section.get('Information', []):
+            for swm in info.get('Value', dict()).get('StringWithMarkup', []):
+                cas = swm.get('String')
+                if cas:
+                    found.append({'cas': cas.strip(), 'source': sources.get(info.get('ReferenceNumber'))})
+    return found
+
+
+def _get_cas_number_from_pug_view(data: dict) -> Union[str, None]:
+    """
+    the cas number from CAS Common Chemistry if there is one, otherwise the one reported by most sources
+    """
+    found = _get_cas_numbers_from_pug_view(data)
+    for record in found:
+        if record['source'] == 'CAS Common Chemistry':
+            return record['cas']
+    if found:
+        counter = Counter(record['cas'] for record in found)
+        return counter.most_common(1)[0][0]
     return None
 
 
@@ -59,9 +96,134 @@ def get_vendor_links(cid: int):
         return dict()
 
 
+def get_all_cas_numbers(cid: int) -> list[dict[str, str]]:
+    """
+    every cas number found for a compound, with its source
+
+    :return: a list of {"cas": cas number, "source": source name}
+    """
+    try:
+        data = request_pug_view(cid, 'cas')
+        return _get_cas_numbers_from_pug_view(data)
+    except HTTPError:
+        return []
+
+
 def get_cas_number(cid: int):
     try:
         data = request_pug_view(cid, 'cas')
         return _get_cas_number_from_pug_view(data)
     except HTTPError:
         return None
+
+
+def _load_checkpoint(checkpoint: FilePath) -> dict:
+    done = dict()
+    if checkpoint is None or not os.path.isfile(checkpoint):
+        return done
+    with open(checkpoint, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # the last line can be truncated by a crash
+                continue
+            done[record["cid"]] = record["result"]
+    return done
+
+
+def _fetch_pug_view_with_retry(cid: int, task: str, parser: Callable, max_retries: int):
+    """
+    404 means pubchem has no such data, other errors are retried with a growing delay
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return parser(request_pug_view(cid, task))
+        except HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return parser(dict())
+            error = e
+        except RequestException as e:
+            error = e
+        logger.warning(f"pug view request failed for cid {cid}, attempt {attempt + 1}: {error}")
+        if attempt < max_retries:
+            metrics_registry.inc("chemscraper_retries_total", call="request_pug_view")
+            time.sleep(2 ** attempt)
+    raise error
+
+
+def iter_pug_view_many(
+        cids: Iterable[int], task: str, parser: Callable, checkpoint: FilePath = None,
+        max_workers: int = 4, max_retries: int = 3,
+) -> Iterator[tuple[int, object]]:
+    """
+    fetch and parse pug view data for many cids, requests are sent from a thread pool through
+    the shared NCBI rate limiter and keep-alive session
+
+    :param cids: pubchem cids, duplicates are fetched once
+    :param task: 'cas' or 'category', see `request_pug_view`
+    :param parser: function to extract results from the pug view json
+    :param checkpoint: a json lines file, every finished cid is appended to it, cids already
+        in the file are not fetched again
+    :param max_workers: number of requests in flight
+    :param max_retries: retries for a failed request, cids still failing are logged and skipped
+    :return: a generator of (cid, parsed result) in the order results arrive, checkpointed results come first
+    """
+    done = _load_checkpoint(checkpoint)
+    todo = []
+    for cid in dict.fromkeys(cids):
+        if cid in done:
+            yield cid, done[cid]
+        else:
+            todo.append(cid)
+    logger.info(f"pug view {task}: {len(done)} cids from checkpoint, {len(todo)} to fetch")
+
+    f_checkpoint = open(checkpoint, "a") if checkpoint is not None else None
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            todo = iter(todo)
+            in_flight = dict()
+            while True:
+                for cid in todo:
+                    in_flight[executor.submit(_fetch_pug_view_with_retry, cid, task, parser, max_retries)] = cid
+                    if len(in_flight) >= 2 * max_workers:
+                        break
+                if not in_flight:
+                    break
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    cid = in_flight.pop(future)
+                    try:
+                        result = future.result()
+                    except RequestException as e:
+                        logger.error(f"pug view {task} failed for cid {cid}: {e}")
+                        continue
+                    if f_checkpoint is not None:
+                        f_checkpoint.write(json.dumps({"cid": cid, "result": result}) + "\n")
+                        f_checkpoint.flush()
+                    yield cid, result
+    finally:
+        if f_checkpoint is not None:
+            f_checkpoint.close()
+
+
+def get_cas_numbers(
+        cids: Iterable[int], checkpoint: FilePath = None, max_workers: int = 4,
+) -> Iterator[tuple[int, Union[str, None]]]:
+    """
+    batch version of `get_cas_number`, see `iter_pug_view_many`
+
+    :return: a generator of (cid, cas number)
+    """
+    yield from iter_pug_view_many(cids, 'cas', _get_cas_number_from_pug_view, checkpoint, max_workers)
+
+
+def get_vendor_links_many(
+        cids: Iterable[int], checkpoint: FilePath = None, max_workers: int = 4,
+) -> Iterator[tuple[int, dict[str, str]]]:
+    """
+    batch version of `get_vendor_links`, see `iter_pug_view_many`
+
+    :return: a generator of (cid, vendor name -> vendor url)
+    """
+    yield from iter_pug_view_many(cids, 'category', _get_vendor_link_from_pug_view, checkpoint, max_workers)
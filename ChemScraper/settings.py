@@ -15,5 +15,47 @@ VendorSources = (
     'Thermo Fisher Scientific',
 )
 
+# decimal separator of the prices on each vendor's site, the other of "." and "," groups thousands
+VendorDecimalSeparators = {
+    'Sigma-Aldrich': '.',
+    'Thermo Fisher Scientific': '.',
+}
+
 # default rng seed
 SEED = 42
+
+# NCBI request limits as (calls, period in seconds), see `ChemScraper.pubchem`
+NcbiRateLimits = (
+    (5, 1),
+    (400, 60),
+)
+
+# endpoint of pubchem power user gateway, can be pointed to a local server for testing
+PubchemPugUrl = "https://pubchem.ncbi.nlm.nih.gov/pug/pug.cgi"
+
+# endpoint of pubchem sdq agent, can be pointed to a local server for testing
+PubchemSdqUrl = "https://pubchem.ncbi.nlm.nih.gov/sdq/sdqagent.cgi"
+
+# seconds a pubchem cache key is reused to resume a paged sdq download, see `ChemScraper.pubchem.entrez`
+PubchemCachekeyMaxAge = 4 * 3600
+
+# base url of pubchem pug rest
+PubchemRestUrl = "https://pubchem.ncbi.nlm.nih.gov/rest/pug"
+
+# url patterns blocked by the lean chrome profile, see `ChemScraper.vscraper.se.get_chrome_driver`
+LeanChromeBlockedUrls = (
+    # images, media and fonts
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico",
+    "*.mp4", "*.webm", "*.mp3",
+    "*.woff", "*.woff2", "*.ttf", "*.otf",
+    # third-party analytics and ads
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*", "*googlesyndication.com*",
+    "*facebook.net*", "*hotjar.com*", "*demdex.net*", "*omtrdc.net*", "*adobedtm.com*", "*bing.com/bat*",
+    "*linkedin.com/px*", "*quantserve.com*", "*scorecardresearch.com*", "*optimizely.com*", "*qualtrics.com*",
+)
+
+# seconds before a cached scraping result expires, by page type, see `ChemScraper.vscraper.cache`
+ScrapeCacheTtls = {
+    'patable': 24 * 3600,
+    'properties': 90 * 24 * 3600,
+}
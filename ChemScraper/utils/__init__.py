@@ -1,3 +1,7 @@
 from ChemScraper.utils.file import *
 from ChemScraper.utils.general import *
+from ChemScraper.utils.http import *
+from ChemScraper.utils.metrics import *
 from ChemScraper.utils.mol import *
+from ChemScraper.utils.sqlite_cache import *
+from ChemScraper.utils.throttle import *
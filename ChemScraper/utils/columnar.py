@@ -0,0 +1,165 @@
+from typing import Union
+
+import pandas as pd
+
+from ChemScraper.utils.file import FilePath, get_extension
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+    import pyarrow.feather as pa_feather
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+
+"""
+optional columnar storage (parquet/arrow) for large tables, requires `pyarrow`
+
+`pip install ChemScraper[columnar]`
+"""
+
+# column types of sdq downloads, see `ChemScraper.pubchem.entrez`
+VendorCompoundColumnTypes = {
+    'cid': 'int64',
+    'mw': 'float64',
+    'exactmass': 'float64',
+    'xlogp': 'float64',
+    'isosmiles': 'string',
+    'canonicalsmiles': 'string',
+    'mf': 'string',
+    'inchi': 'string',
+    'inchikey': 'string',
+    'iupacname': 'string',
+}
+
+ColumnarExtensions = ('parquet', 'feather', 'arrow')
+
+# filter tuple: (column, op, value), e.g. ('mw', '<', 300)
+FilterTuple = tuple[str, str, object]
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("columnar storage requires pyarrow, install it with `pip install pyarrow`")
+
+
+def _arrow_types(column_types: dict[str, str]) -> dict:
+    return {k: pa.type_for_alias(v) for k, v in column_types.items()}
+
+
+def csv_to_parquet(
+        csv_files: Union[FilePath, list[FilePath]], parquet_file: FilePath,
+        column_types: dict[str, str] = None, compression: str = "zstd",
+):
+    """
+    stream one or more csv files with the same columns into one parquet file, one row group per csv block
+
+    :param column_types: column name -> arrow type alias, default to `VendorCompoundColumnTypes`
+    """
+    _require_pyarrow()
+    if not isinstance(csv_files, (list, tuple)):
+        csv_files = [csv_files]
+    if column_types is None:
+        column_types = VendorCompoundColumnTypes
+    convert_options = pa_csv.ConvertOptions(column_types=_arrow_types(column_types))
+    writer = None
+    try:
+        for csv_file in csv_files:
+            reader = pa_csv.open_csv(csv_file, convert_options=convert_options)
+            for batch in reader:
+                if writer is None:
+                    writer = pq.ParquetWriter(parquet_file, batch.schema, compression=compression)
+                writer.write_table(pa.Table.from_batches([batch]))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _filters_to_expression(filters: list[FilterTuple]):
+    expression = None
+    for column, op, value in filters:
+        field = pc.field(column)
+        if op in ('=', '=='):
+            e = field == value
+        elif op == '!=':
+            e = field != value
+        elif op == '<':
+            e = field < value
+        elif op == '<=':
+            e = field <= value
+        elif op == '>':
+            e = field > value
+        elif op == '>=':
+            e = field >= value
+        elif op == 'in':
+            e = field.isin(value)
+        elif op == 'not in':
+            e = ~field.isin(value)
+        else:
+            raise ValueError(f"unknown filter operator: {op}")
+        expression = e if expression is None else expression & e
+    return expression
+
+
+def write_table(df: pd.DataFrame, fn: FilePath, compression: str = "zstd"):
+    """
+    write a dataframe, the format is decided by the file extension: csv, parquet, feather/arrow
+    """
+    ext = get_extension(fn).lower()
+    if ext == 'csv':
+        df.to_csv(fn, index=False)
+        return
+    _require_pyarrow()
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if ext == 'parquet':
+        pq.write_table(table, fn, compression=compression)
+    elif ext in ('feather', 'arrow'):
+        # uncompressed arrow ipc files can be memory mapped without copying
+        pa_feather.write_feather(table, fn, compression="uncompressed")
+    else:
+        raise ValueError(f"unknown table format: {fn}")
+
+
+def read_table(
+        fn: FilePath, columns: list[str] = None, filters: list[FilterTuple] = None, memory_map: bool = True,
+) -> pd.DataFrame:
+    """
+    read a table written by `write_table` or `csv_to_parquet`
+
+    :param columns: only read these columns
+    :param filters: a list of (column, op, value) joined by AND, e.g. [('mw', '<', 300)],
+        for parquet files row groups are skipped based on their statistics
+    :param memory_map: memory map parquet/arrow files instead of reading them into memory first
+    """
+    ext = get_extension(fn).lower()
+    if ext == 'csv':
+        df = pd.read_csv(fn, usecols=columns)
+        if filters:
+            for column, op, value in filters:
+                if op in ('=', '=='):
+                    op = '=='
+                if op in ('in', 'not in'):
+                    mask = df[column].isin(value)
+                    df = df[mask if op == 'in' else ~mask]
+                else:
+                    df = df.query(f"`{column}` {op} @value")
+        return df
+    _require_pyarrow()
+    if ext == 'parquet':
+        table = pq.read_table(
+            fn, columns=columns, memory_map=memory_map,
+            filters=_filters_to_expression(filters) if filters else None,
+        )
+    elif ext in ('feather', 'arrow'):
+        read_columns = columns
+        if columns is not None and filters:
+            read_columns = list(dict.fromkeys(list(columns) + [f[0] for f in filters]))
+        table = pa_feather.read_table(fn, columns=read_columns, memory_map=memory_map)
+        if filters:
+            table = table.filter(_filters_to_expression(filters))
+        if columns is not None:
+            table = table.select(columns)
+    else:
+        raise ValueError(f"unknown table format: {fn}")
+    return table.to_pandas()
@@ -1,3 +1,5 @@
+import gzip
+import io
 import json
 import logging
 import os
@@ -11,10 +13,10 @@ from urllib.parse import urlparse
 from urllib.request import urlopen, Request
 from urllib.request import urlretrieve
 
-import monty.json
-from fake_useragent import UserAgent
 from tqdm import tqdm
 
+from ChemScraper.utils.metrics import metrics_registry
+
 FilePath = typing.Union[pathlib.Path, os.PathLike, str]
 
 
@@ -23,11 +25,13 @@ def file_exists(fn: FilePath):
 
 
 def json_dump(o, fn: FilePath):
+    import monty.json
     with open(fn, "w") as f:
         json.dump(o, f, cls=monty.json.MontyEncoder)
 
 
 def json_load(fn: FilePath, warning=False):
+    import monty.json
     if warning:
         logging.warning("loading file: {}".format(fn))
     with open(fn, "r") as f:
@@ -119,18 +123,35 @@ def download_file(url: str, destination: FilePath = None, progress_bar=True):
 
         return inner
 
-    try:
+    with metrics_registry.timer("chemscraper_request", call="download_file"):
         if progress_bar:
             with tqdm(unit='B', unit_scale=True, miniters=1, desc=destination) as t:
                 filename, _ = urlretrieve(url, filename=destination, reporthook=my_hook(t))
         else:
             filename, _ = urlretrieve(url, filename=destination)
-    except (HTTPError, URLError, ValueError) as e:
-        raise e
+    metrics_registry.inc("chemscraper_bytes_total", os.path.getsize(filename), call="download_file")
     return filename
 
 
+def iter_url_lines(url: str, encoding: str = "utf-8", chunk_size: int = 1 << 16) -> typing.Iterator[str]:
+    """
+    stream a text file from an url line by line, gzip compressed content is decompressed on the fly
+
+    :param url: http(s), ftp or file url
+    :param encoding: text encoding of the (decompressed) content
+    :param chunk_size: buffer size in bytes
+    """
+    with urlopen(url) as response:
+        stream = io.BufferedReader(response, buffer_size=chunk_size)
+        if stream.peek(2)[:2] == b"\x1f\x8b":
+            stream = gzip.GzipFile(fileobj=stream)
+        with io.TextIOWrapper(stream, encoding=encoding) as text:
+            for line in text:
+                yield line
+
+
 def download_file_fake_agent(url, saveas: FilePath):
+    from fake_useragent import UserAgent
     ua = UserAgent()
     fp = urlopen(Request(url, headers={'User-Agent': ua.chrome}))
     with open(saveas, 'wb') as f:
@@ -1,15 +1,12 @@
 import itertools
 from datetime import datetime
 
-import numpy as np
-from monty.json import MSONable
-
 
 def find_between(s, start, end):
     return (s.split(start))[1].split(end)[0]
 
 
-def represent_nested_monty_json(o: MSONable, precision=5):
+def represent_nested_monty_json(o: "monty.json.MSONable", precision=5):
     s = "{}: ".format(o.__class__.__name__)
     for k, v in o.as_dict().items():
         if k.startswith("@"):
@@ -21,6 +18,7 @@ def represent_nested_monty_json(o: MSONable, precision=5):
 
 
 def to_float(x):
+    import numpy as np
     try:
         assert not np.isnan(x)
         return float(x)
@@ -29,6 +27,7 @@ def to_float(x):
 
 
 def unison_shuffle(a, b, seed):
+    import numpy as np
     assert len(a) == len(b)
     p = np.random.RandomState(seed=seed).permutation(len(a))
     return a[p], b[p]
@@ -71,19 +70,45 @@ def get_timestamp():
     return int(datetime.now().timestamp() * 1000)
 
 
+def iter_json_leaves(indict: dict):
+    """
+    non-copying version of `traverse_json`, yields (path, leaf) where `path` is the list of keys leading to `leaf`
+
+    `path` is one list mutated during the iteration, copy it (e.g. `list(path)`) if it is kept
+    """
+    path = []
+    if not isinstance(indict, dict):
+        yield path, indict
+        return
+    # (iterator, iterating a list, a key was pushed to path for this frame)
+    frames = [(iter(indict.items()), False, False)]
+    while frames:
+        it, is_list, pushed = frames[-1]
+        for item in it:
+            if is_list:
+                if isinstance(item, dict):
+                    frames.append((iter(item.items()), False, False))
+                    break
+                yield path, item
+            else:
+                key, value = item
+                path.append(key)
+                if isinstance(value, dict):
+                    frames.append((iter(value.items()), False, True))
+                    break
+                elif isinstance(value, list) or isinstance(value, tuple):
+                    frames.append((iter(value), True, True))
+                    break
+                yield path, value
+                path.pop()
+        else:
+            frames.pop()
+            if pushed:
+                path.pop()
+
+
 def traverse_json(indict: dict, pre=None):
     """ https://stackoverflow.com/questions/12507206 """
     pre = pre[:] if pre else []
-    if isinstance(indict, dict):
-        for key, value in indict.items():
-            if isinstance(value, dict):
-                for d in traverse_json(value, pre + [key]):
-                    yield d
-            elif isinstance(value, list) or isinstance(value, tuple):
-                for v in value:
-                    for d in traverse_json(v, pre + [key]):
-                        yield d
-            else:
-                yield pre + [key, value]
-    else:
-        yield pre + [indict]
+    for path, leaf in iter_json_leaves(indict):
+        yield pre + path + [leaf]
@@ -0,0 +1,18 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+"""
+pooled keep-alive http sessions
+"""
+
+
+def get_pooled_session(pool_maxsize: int = 16) -> requests.Session:
+    """
+    a `requests.Session` that keeps up to `pool_maxsize` connections alive per host,
+    it can be shared between threads for plain get/post requests
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
@@ -0,0 +1,29 @@
+import importlib
+import sys
+from typing import Callable
+
+"""
+lazy re-exports for package `__init__` modules (PEP 562), a name is imported from its module on first access
+
+    __getattr__, __dir__ = lazy_exports(__name__, {"identify_compound": "ChemScraper.pubchem.gateway"})
+"""
+
+
+def lazy_exports(package: str, exports: dict[str, str]) -> tuple[Callable, Callable]:
+    """
+    :param package: `__name__` of the package
+    :param exports: public name -> module defining it
+    :return: module level `__getattr__` and `__dir__`
+    """
+    def __getattr__(name: str):
+        if name not in exports:
+            raise AttributeError(f"module {package!r} has no attribute {name!r}")
+        value = getattr(importlib.import_module(exports[name]), name)
+        # cache in the package namespace, later accesses skip __getattr__
+        setattr(sys.modules[package], name, value)
+        return value
+
+    def __dir__():
+        return sorted(set(vars(sys.modules[package])) | set(exports))
+
+    return __getattr__, __dir__
@@ -0,0 +1,159 @@
+import bisect
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Sequence
+
+"""
+in-process metrics: counters and histograms keyed by name and labels, exportable as prometheus text or json
+
+the package records into `metrics_registry`:
+- chemscraper_request_seconds{call}, chemscraper_request_errors_total{call, error}: pubchem/entrez calls and downloads
+- chemscraper_bytes_total{call}: bytes received
+- chemscraper_retries_total{call}: retried requests, jobs, tasks and backend fallbacks
+- chemscraper_pug_polls_total: status requests of pug jobs
+- chemscraper_rate_limit_wait_seconds{limiter}: time spent blocked in `RateLimiter.acquire`
+- chemscraper_page_ready_seconds{vendor, page}: time from loading a vendor page until its content is present
+- chemscraper_scrape_seconds{vendor, page, backend}, chemscraper_scrape_errors_total{vendor, page, backend, error}
+- chemscraper_catalog_search_seconds{kind}: similarity and substructure queries of `CatalogSearch`
+"""
+
+# upper bounds of histogram buckets in seconds
+DefaultLatencyBuckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Histogram:
+
+    def __init__(self, buckets: Sequence[float] = DefaultLatencyBuckets):
+        self.buckets = tuple(sorted(buckets))
+        # the last count is for the +Inf bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def as_dict(self) -> dict:
+        return {
+            "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts)),
+            "sum": self.sum,
+            "count": self.count,
+        }
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _prometheus_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if len(pairs) == 0:
+        return ""
+    escaped = [(k, v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for k, v in pairs]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name -> label key -> value
+        self.counters: dict[str, dict[tuple, float]] = dict()
+        self.histograms: dict[str, dict[tuple, Histogram]] = dict()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, dict())
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = DefaultLatencyBuckets, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, dict())
+            if key not in series:
+                series[key] = Histogram(buckets)
+            series[key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """
+        time a block into the histogram `<name>_seconds`, exceptions are counted in `<name>_errors_total`
+        with their class name as the "error" label and raised again
+        """
+        ts = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.inc(f"{name}_errors_total", error=e.__class__.__name__, **labels)
+            raise
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - ts, **labels)
+
+    def timed(self, call: str, name: str = "chemscraper_request"):
+        """ decorator version of `timer` with a "call" label """
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, call=call):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def snapshot(self) -> dict:
+        """
+        :return: {"counters": {name: [{"labels": {...}, "value": ...}]},
+            "histograms": {name: [{"labels": {...}, "buckets": {upper bound: count}, "sum": ..., "count": ...}]}}
+        """
+        with self._lock:
+            return {
+                "counters": {
+                    name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                    for name, series in sorted(self.counters.items())
+                },
+                "histograms": {
+                    name: [{"labels": dict(key), **h.as_dict()} for key, h in series.items()]
+                    for name, series in sorted(self.histograms.items())
+                },
+            }
+
+    def to_json(self, indent: int = None) -> str:
+        return json.dumps(self.snapshot(), indent=indent)
+
+    def to_prometheus(self) -> str:
+        """
+        :return: metrics in the prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_prometheus_labels(key)} {value}")
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for key, h in series.items():
+                    cumulative = 0
+                    for bound, count in zip(list(h.buckets) + ["+Inf"], h.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_prometheus_labels(key, (('le', str(bound)),))} {cumulative}")
+                    lines.append(f"{name}_sum{_prometheus_labels(key)} {h.sum}")
+                    lines.append(f"{name}_count{_prometheus_labels(key)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+# process-wide registry used by the package
+metrics_registry = MetricsRegistry()
@@ -1,23 +1,36 @@
 import base64
 import collections
+import functools
+import os
 import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
+from typing import Any, Callable, Iterable, Union
 
-import rdkit.Chem
-from rdkit.Chem import MolToSmiles, MolToInchi, MolFromSmiles, MolFromSmarts
-from rdkit.Chem.Draw import MolToImage
-from rdkit.Chem.inchi import MolFromInchi
+from loguru import logger
+
+"""
+molecule helpers, rdkit is imported on first use so `parse_formula` and friends do not pay for it
+
+the `*_many` functions convert large batches: inputs are de-duplicated, looked up in a process-wide memo,
+the rest is converted in chunks across a process pool, invalid inputs give None instead of aborting the batch
+"""
 
 
 def inchi2smiles(inchi: str) -> str:
+    from rdkit.Chem import MolToSmiles
+    from rdkit.Chem.inchi import MolFromInchi
     return MolToSmiles(MolFromInchi(inchi))
 
 
 def smiles2inchi(smi: str) -> str:
+    from rdkit.Chem import MolToInchi, MolFromSmiles
     return MolToInchi(MolFromSmiles(smi))
 
 
 def neutralize_atoms(mol):
+    from rdkit.Chem import MolFromSmarts
     pattern = MolFromSmarts("[+1!h0!$([*]~[-1,-2,-3,-4]),-1!$([*]~[+1,+2,+3,+4])]")
     at_matches = mol.GetSubstructMatches(pattern)
     at_matches_list = [y[0] for y in at_matches]
@@ -64,6 +77,8 @@ def parse_formula(formula: str) -> dict[str, float]:  # from pymatgen
 
 
 def smi2imagestr(smi: str):
+    from rdkit.Chem import MolFromSmiles
+    from rdkit.Chem.Draw import MolToImage
     m = MolFromSmiles(smi)
     img = MolToImage(m)
     buffered = BytesIO()
@@ -74,5 +89,162 @@ def smi2imagestr(smi: str):
 
 
 def smiles_eq(smi1: str, smi2: str):
-    return rdkit.Chem.CanonSmiles(remove_stereo(smi1), useChiral=0) \
-           == rdkit.Chem.CanonSmiles(remove_stereo(smi2), useChiral=0)
+    canonical = [canon_smiles(remove_stereo(smi), use_chiral=False) for smi in (smi1, smi2)]
+    if None in canonical:
+        raise ValueError(f"invalid smiles: {[smi for smi, c in zip((smi1, smi2), canonical) if c is None]}")
+    return canonical[0] == canonical[1]
+
+
+class _Memo:
+    """ a bounded, thread safe mapping of (conversion, input) -> output, the oldest entries are dropped when full """
+
+    def __init__(self, max_size: int = 1_000_000):
+        self.max_size = max_size
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, kind: str, keys: Iterable[str]) -> dict[str, Union[str, None]]:
+        with self._lock:
+            return {k: self._data[(kind, k)] for k in keys if (kind, k) in self._data}
+
+    def set_many(self, kind: str, items: dict[str, Union[str, None]]):
+        with self._lock:
+            self._data.update({(kind, k): v for k, v in items.items()})
+            for _ in range(len(self._data) - self.max_size):
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# canonical forms computed in this process, shared by `canon_smiles`, `smiles_eq` and the `*_many` functions
+mol_memo = _Memo()
+
+
+def _canon_smiles_chunk(smis: list[str], use_chiral: bool) -> list[Union[str, None]]:
+    from rdkit import RDLogger
+    from rdkit.Chem import MolFromSmiles, MolToSmiles
+    RDLogger.DisableLog("rdApp.*")
+    results = []
+    for smi in smis:
+        mol = MolFromSmiles(smi) if smi else None
+        results.append(None if mol is None else MolToSmiles(mol, isomericSmiles=use_chiral))
+    return results
+
+
+def _inchi2smiles_chunk(inchis: list[str]) -> list[Union[str, None]]:
+    from rdkit import RDLogger
+    from rdkit.Chem import MolToSmiles
+    from rdkit.Chem.inchi import MolFromInchi
+    RDLogger.DisableLog("rdApp.*")
+    results = []
+    for inchi in inchis:
+        mol = MolFromInchi(inchi) if inchi else None
+        results.append(None if mol is None else MolToSmiles(mol))
+    return results
+
+
+def _smiles2inchikey_chunk(smis: list[str]) -> list[Union[str, None]]:
+    from rdkit import RDLogger
+    from rdkit.Chem import MolFromSmiles
+    from rdkit.Chem.inchi import MolToInchiKey
+    RDLogger.DisableLog("rdApp.*")
+    results = []
+    for smi in smis:
+        mol = MolFromSmiles(smi) if smi else None
+        results.append((MolToInchiKey(mol) or None) if mol is not None else None)
+    return results
+
+
+def _convert_many(
+        kind: str, func: Callable, inputs: list[str], processes: int, chunk_size: int, warn: bool = True, **kwargs
+) -> tuple[list[Union[str, None]], list[tuple[int, str]]]:
+    unique = list(dict.fromkeys(inputs))
+    known = mol_memo.get_many(kind, unique)
+    todo = [x for x in unique if x not in known]
+    processes = processes or os.cpu_count() or 1
+    chunks_todo = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+    func = functools.partial(func, **kwargs)
+    if processes == 1 or len(chunks_todo) <= 1:
+        converted = [func(c) for c in chunks_todo]
+    else:
+        with ProcessPoolExecutor(max_workers=min(processes, len(chunks_todo))) as executor:
+            converted = list(executor.map(func, chunks_todo))
+    new = {x: y for c, results in zip(chunks_todo, converted) for x, y in zip(c, results)}
+    mol_memo.set_many(kind, new)
+    known.update(new)
+    outputs = [known[x] for x in inputs]
+    invalid = [(i, x) for i, (x, y) in enumerate(zip(inputs, outputs)) if y is None]
+    if invalid and warn:
+        logger.warning(f"{kind}: {len(invalid)}/{len(inputs)} invalid inputs, e.g. {invalid[0][1]}")
+    return outputs, invalid
+
+
+def canon_smiles(smi: str, use_chiral: bool = True) -> Union[str, None]:
+    """
+    memoized canonical smiles, None if the smiles cannot be parsed
+    """
+    kind = "canon_smiles" if use_chiral else "canon_smiles_achiral"
+    # an invalid smiles is an expected answer here, only batches warn about them
+    return _convert_many(kind, _canon_smiles_chunk, [smi], 1, 1, warn=False, use_chiral=use_chiral)[0][0]
+
+
+def canon_smiles_many(
+        smis: Iterable[str], use_chiral: bool = True, processes: int = None, chunk_size: int = 20000,
+) -> tuple[list[Union[str, None]], list[tuple[int, str]]]:
+    """
+    canonicalize many smiles
+
+    :param smis: smiles, duplicates are converted once
+    :param use_chiral: keep stereochemistry, same as `rdkit.Chem.CanonSmiles(useChiral=...)`
+    :param processes: size of the process pool, default to the cpu count, 1 converts in this process
+    :param chunk_size: smiles sent to a worker at a time, batches of at most one chunk are converted in this process
+    :return: (canonical smiles in input order with None for invalid inputs, [(index, input) of invalid inputs])
+    """
+    kind = "canon_smiles" if use_chiral else "canon_smiles_achiral"
+    return _convert_many(kind, _canon_smiles_chunk, list(smis), processes, chunk_size, use_chiral=use_chiral)
+
+
+def inchi2smiles_many(
+        inchis: Iterable[str], processes: int = None, chunk_size: int = 20000,
+) -> tuple[list[Union[str, None]], list[tuple[int, str]]]:
+    """
+    batch version of `inchi2smiles`, see `canon_smiles_many` for the parameters
+
+    :return: (smiles in input order with None for invalid inputs, [(index, input) of invalid inputs])
+    """
+    return _convert_many("inchi2smiles", _inchi2smiles_chunk, list(inchis), processes, chunk_size)
+
+
+def smiles2inchikey_many(
+        smis: Iterable[str], processes: int = None, chunk_size: int = 20000,
+) -> tuple[list[Union[str, None]], list[tuple[int, str]]]:
+    """
+    inchikeys of many smiles, see `canon_smiles_many` for the parameters
+
+    :return: (inchikeys in input order with None for invalid inputs, [(index, input) of invalid inputs])
+    """
+    return _convert_many("smiles2inchikey", _smiles2inchikey_chunk, list(smis), processes, chunk_size)
+
+
+def dedupe_by_canonical_smiles(
+        items: Iterable[Any], key: Callable[[Any], str] = None, use_chiral: bool = True, processes: int = None,
+        chunk_size: int = 20000,
+) -> tuple[dict[str, list[Any]], list[Any]]:
+    """
+    group items by the canonical smiles of their key
+
+    :param items: e.g. smiles, or rows of a vendor csv with `key=lambda r: r["isosmiles"]`
+    :param key: function giving the smiles of an item, default to the item itself
+    :return: (canonical smiles -> items in input order, items whose smiles is invalid),
+        the first item of each group is the de-duplicated item
+    """
+    items = list(items)
+    smis = items if key is None else [key(item) for item in items]
+    canonical, invalid = canon_smiles_many(smis, use_chiral=use_chiral, processes=processes, chunk_size=chunk_size)
+    groups = dict()
+    for item, c in zip(items, canonical):
+        if c is not None:
+            groups.setdefault(c, []).append(item)
+    return groups, [items[i] for i, _ in invalid]
@@ -0,0 +1,143 @@
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Iterable, Union
+
+from ChemScraper.utils.file import FilePath
+
+"""
+a small persistent key-value store on top of sqlite, values are strings, entries are grouped by namespace
+"""
+
+
+class SqliteCache:
+
+    def __init__(self, path: FilePath, ttl: Union[float, dict[str, float]] = None, max_entries: int = None):
+        """
+        :param path: sqlite database file, ":memory:" for a non-persistent cache
+        :param ttl: seconds before an entry expires, either one value or a dict of namespace -> ttl,
+            None means never expire
+        :param max_entries: the least recently accessed entries are evicted once the cache grows beyond this size
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = Counter()
+        self.misses = Counter()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+        self._conn.commit()
+
+    def _ttl(self, namespace: str) -> Union[float, None]:
+        if isinstance(self.ttl, dict):
+            return self.ttl.get(namespace)
+        return self.ttl
+
+    def get_many(self, namespace: str, keys: Iterable[str], record_stats: bool = True) -> dict[str, str]:
+        """
+        :param record_stats: count this lookup in hit/miss statistics
+        :return: a dict of key -> value for keys found and not expired
+        """
+        keys = list(dict.fromkeys(keys))
+        now = time.time()
+        ttl = self._ttl(namespace)
+        found = dict()
+        expired = []
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, value, created FROM cache WHERE namespace = ? AND key IN ({','.join('?' * len(batch))})",
+                    [namespace, *batch],
+                )
+                for key, value, created in rows:
+                    if ttl is not None and now - created > ttl:
+                        expired.append(key)
+                    else:
+                        found[key] = value
+            self._conn.executemany(
+                "UPDATE cache SET accessed = ? WHERE namespace = ? AND key = ?",
+                [(now, namespace, k) for k in found],
+            )
+            self._conn.executemany(
+                "DELETE FROM cache WHERE namespace = ? AND key = ?", [(namespace, k) for k in expired]
+            )
+            self._conn.commit()
+            if record_stats:
+                self.hits[namespace] += len(found)
+                self.misses[namespace] += len(keys) - len(found)
+        return found
+
+    def get(self, namespace: str, key: str) -> Union[str, None]:
+        return self.get_many(namespace, [key]).get(key)
+
+    def set_many(self, namespace: str, items: dict[str, str]):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                [(namespace, k, v, now, now) for k, v in items.items()],
+            )
+            self._conn.commit()
+        if self.max_entries is not None:
+            self.evict()
+
+    def set(self, namespace: str, key: str, value: str):
+        self.set_many(namespace, {key: value})
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+            self._conn.commit()
+
+    def evict(self) -> int:
+        """
+        remove expired entries, then the least recently accessed ones beyond `max_entries`
+
+        :return: number of entries removed
+        """
+        now = time.time()
+        removed = 0
+        with self._lock:
+            namespaces = [r[0] for r in self._conn.execute("SELECT DISTINCT namespace FROM cache")]
+            for namespace in namespaces:
+                ttl = self._ttl(namespace)
+                if ttl is not None:
+                    removed += self._conn.execute(
+                        "DELETE FROM cache WHERE namespace = ? AND created < ?", (namespace, now - ttl)
+                    ).rowcount
+            if self.max_entries is not None:
+                removed += self._conn.execute(
+                    "DELETE FROM cache WHERE rowid IN "
+                    "(SELECT rowid FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_entries,)
+                ).rowcount
+            self._conn.commit()
+        return removed
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """
+        :return: a dict of namespace -> {"hits": ..., "misses": ..., "entries": ...}
+        """
+        with self._lock:
+            entries = dict(self._conn.execute("SELECT namespace, COUNT(*) FROM cache GROUP BY namespace"))
+        namespaces = set(entries) | set(self.hits) | set(self.misses)
+        return {
+            ns: {"hits": self.hits[ns], "misses": self.misses[ns], "entries": entries.get(ns, 0)}
+            for ns in sorted(namespaces)
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,89 @@
+import collections
+import functools
+import threading
+import time
+from typing import Sequence
+
+from ChemScraper.utils.metrics import metrics_registry
+
+"""
+blocking sliding-window rate limiters that can be shared between threads
+
+unlike `ratelimit.limits`, which raises once a limit is exceeded, callers here wait until a call is allowed,
+unlike a token bucket there is no initial burst: no window of `period` seconds ever holds more than `calls` calls
+"""
+
+
+class SlidingWindow:
+
+    def __init__(self, calls: int, period: float):
+        """
+        remembers the times of the last `calls` calls, a new call is allowed once the oldest of them
+        is at least `period` seconds old
+
+        :param calls: max number of calls in a period
+        :param period: length of the period in seconds
+        """
+        self.calls = calls
+        self.period = period
+        self.times = collections.deque(maxlen=calls)
+
+    def wait_time(self, now: float) -> float:
+        """ seconds to wait before one more call fits in the window """
+        if len(self.times) < self.calls:
+            return 0.0
+        return max(0.0, self.times[0] + self.period - now)
+
+    def consume(self, now: float):
+        self.times.append(now)
+
+
+class RateLimiter:
+
+    def __init__(self, limits: Sequence[tuple[int, float]], name: str = "default"):
+        """
+        a limiter composed of several sliding windows, a call is allowed only if it fits in every window
+
+        :param limits: a list of (calls, period) pairs, e.g. ((5, 1), (400, 60))
+        :param name: label of the waits recorded in `chemscraper_rate_limit_wait_seconds`
+        """
+        self.name = name
+        self.windows = [SlidingWindow(calls, period) for calls, period in limits]
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def thread_waited(self) -> float:
+        """
+        :return: seconds the current thread has spent waiting in `acquire` so far
+        """
+        return getattr(self._local, "waited", 0.0)
+
+    def acquire(self) -> float:
+        """
+        block until a call is allowed
+
+        :return: seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                delay = max([w.wait_time(now) for w in self.windows], default=0.0)
+                if delay <= 0:
+                    for w in self.windows:
+                        w.consume(now)
+                    metrics_registry.observe("chemscraper_rate_limit_wait_seconds", waited, limiter=self.name)
+                    self._local.waited = self.thread_waited() + waited
+                    return waited
+            time.sleep(delay)
+            waited += delay
+
+    def __call__(self, func):
+        """ use the limiter as a decorator """
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self.acquire()
+            return func(*args, **kwargs)
+
+        return wrapper
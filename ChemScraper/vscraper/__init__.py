@@ -1,5 +1,32 @@
-from ChemScraper.vscraper.se import get_chrome_driver
-from ChemScraper.vscraper.sigma_aldrich import get_sigma_aldrich_patable, get_sigma_aldrich_patables, \
-    sigma_sds_url_from_product_url, get_sigma_aldrich_properties, get_sigma_aldrich_properties_from_cas, \
-    get_sigma_aldrich_properties_from_mf
-from ChemScraper.vscraper.thermo_fisher import get_thermo_fisher_patables_in_search, get_thermo_fisher_patable
+from ChemScraper.utils.lazy import lazy_exports
+
+"""
+vendor scrapers, selenium, pandas and bs4 are imported when one of these names is first used
+"""
+
+_exports = {
+    "get_chrome_driver": "ChemScraper.vscraper.se",
+    "get_sigma_aldrich_patable": "ChemScraper.vscraper.sigma_aldrich",
+    "get_sigma_aldrich_patables": "ChemScraper.vscraper.sigma_aldrich",
+    "sigma_sds_url_from_product_url": "ChemScraper.vscraper.sigma_aldrich",
+    "get_sigma_aldrich_properties": "ChemScraper.vscraper.sigma_aldrich",
+    "get_sigma_aldrich_properties_from_cas": "ChemScraper.vscraper.sigma_aldrich",
+    "get_sigma_aldrich_properties_from_mf": "ChemScraper.vscraper.sigma_aldrich",
+    "get_thermo_fisher_patables_in_search": "ChemScraper.vscraper.thermo_fisher",
+    "get_thermo_fisher_patable": "ChemScraper.vscraper.thermo_fisher",
+    "DriverPool": "ChemScraper.vscraper.pool",
+    "BrowserCrashError": "ChemScraper.vscraper.pool",
+    "PoolExhaustedError": "ChemScraper.vscraper.pool",
+    "scrape_many": "ChemScraper.vscraper.pool",
+    "StaticBackend": "ChemScraper.vscraper.backend",
+    "SeleniumBackend": "ChemScraper.vscraper.backend",
+    "FallbackBackend": "ChemScraper.vscraper.backend",
+    "CachedBackend": "ChemScraper.vscraper.backend",
+    "ScrapeCache": "ChemScraper.vscraper.cache",
+    "crawl_sigma_aldrich_patables": "ChemScraper.vscraper.crawler",
+    "iter_sigma_aldrich_product_links": "ChemScraper.vscraper.crawler",
+}
+
+__all__ = list(_exports)
+
+__getattr__, __dir__ = lazy_exports(__name__, _exports)
@@ -0,0 +1,150 @@
+import abc
+import threading
+from typing import Callable, Union
+
+from loguru import logger
+from selenium import webdriver
+
+from ChemScraper.utils import get_pooled_session, metrics_registry
+from ChemScraper.vscraper.cache import ScrapeCache
+from ChemScraper.vscraper.pool import DriverPool
+from ChemScraper.vscraper.sigma_aldrich import get_sigma_aldrich_patable, get_sigma_aldrich_properties, \
+    parse_sigma_aldrich_patable_html, parse_sigma_aldrich_properties_html
+from ChemScraper.vscraper.thermo_fisher import get_thermo_fisher_patable, parse_thermo_fisher_patable_html
+
+"""
+pluggable backends for scraping vendor pages
+
+a page is identified by (vendor, page type, url), page types:
+- "patable": price/availability table of a product page
+- "properties": property dict of a product page
+"""
+
+# used by `StaticBackend` when no user agent is given
+DefaultUserAgent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 " \
+                   "(KHTML, like Gecko) Chrome/118.0.0.0 Safari/537.36"
+
+
+class ScraperBackend(abc.ABC):
+
+    @abc.abstractmethod
+    def supports(self, vendor: str, page_type: str) -> bool:
+        pass
+
+    @abc.abstractmethod
+    def scrape(self, vendor: str, page_type: str, url: str):
+        pass
+
+
+class StaticBackend(ScraperBackend):
+    # (vendor, page type) -> function(html, url)
+    parsers: dict[tuple[str, str], Callable] = {
+        ('Sigma-Aldrich', 'patable'): parse_sigma_aldrich_patable_html,
+        ('Sigma-Aldrich', 'properties'): lambda html, url: parse_sigma_aldrich_properties_html(html),
+        ('Thermo Fisher Scientific', 'patable'): parse_thermo_fisher_patable_html,
+    }
+
+    def __init__(self, user_agent: str = DefaultUserAgent, timeout: float = 10):
+        """
+        fetch pages with plain http requests and parse the html, no javascript is run
+        """
+        self.session = get_pooled_session()
+        self.session.headers.update({"User-Agent": user_agent})
+        self.timeout = timeout
+
+    def supports(self, vendor: str, page_type: str) -> bool:
+        return (vendor, page_type) in self.parsers
+
+    def fetch(self, url: str) -> str:
+        resp = self.session.get(url, timeout=self.timeout)
+        metrics_registry.inc("chemscraper_bytes_total", len(resp.content), call="static_fetch")
+        resp.raise_for_status()
+        return resp.text
+
+    def scrape(self, vendor: str, page_type: str, url: str):
+        with metrics_registry.timer("chemscraper_scrape", vendor=vendor, page=page_type, backend="static"):
+            return self.parsers[(vendor, page_type)](self.fetch(url), url)
+
+
+class SeleniumBackend(ScraperBackend):
+    # (vendor, page type) -> function(driver, url)
+    scrapers: dict[tuple[str, str], Callable] = {
+        ('Sigma-Aldrich', 'patable'): get_sigma_aldrich_patable,
+        ('Sigma-Aldrich', 'properties'): get_sigma_aldrich_properties,
+        ('Thermo Fisher Scientific', 'patable'): get_thermo_fisher_patable,
+    }
+
+    def __init__(self, driver: Union[webdriver.Chrome, DriverPool]):
+        """
+        render pages in a browser, either one driver or a pool of drivers, calls sharing one driver are serialized
+        """
+        self.driver = driver
+        self._lock = threading.Lock()
+
+    def supports(self, vendor: str, page_type: str) -> bool:
+        return (vendor, page_type) in self.scrapers
+
+    def scrape(self, vendor: str, page_type: str, url: str):
+        scraper = self.scrapers[(vendor, page_type)]
+        if isinstance(self.driver, DriverPool):
+            with self.driver.lease(vendor) as driver:
+                with metrics_registry.timer("chemscraper_scrape", vendor=vendor, page=page_type, backend="selenium"):
+                    return scraper(driver, url)
+        with self._lock:
+            with metrics_registry.timer("chemscraper_scrape", vendor=vendor, page=page_type, backend="selenium"):
+                return scraper(self.driver, url)
+
+
+class FallbackBackend(ScraperBackend):
+
+    def __init__(self, backends: list[ScraperBackend], routes: dict[tuple[str, str], list[ScraperBackend]] = None):
+        """
+        try backends in order until one succeeds, e.g. [StaticBackend(), SeleniumBackend(driver)],
+        any error of a backend, a failed request as well as a page its parser does not understand, moves on to the next
+
+        :param backends: default order of backends
+        :param routes: (vendor, page type) -> order of backends, overrides the default for this page type
+        """
+        self.backends = backends
+        self.routes = routes or dict()
+
+    def supports(self, vendor: str, page_type: str) -> bool:
+        return any(b.supports(vendor, page_type) for b in self.routes.get((vendor, page_type), self.backends))
+
+    def scrape(self, vendor: str, page_type: str, url: str):
+        """
+        :raise LookupError: if no backend supports the page
+        :raise Exception: the error of the last backend if all of them failed
+        """
+        backends = [b for b in self.routes.get((vendor, page_type), self.backends) if b.supports(vendor, page_type)]
+        if len(backends) == 0:
+            raise LookupError(f"no backend for: {vendor} {page_type}")
+        for i, backend in enumerate(backends):
+            try:
+                return backend.scrape(vendor, page_type, url)
+            except Exception as e:
+                if i == len(backends) - 1:
+                    raise e
+                logger.info(f"{backend.__class__.__name__} failed for {url}, falling back: {e}")
+                metrics_registry.inc("chemscraper_retries_total", call="scrape_fallback")
+
+
+class CachedBackend(ScraperBackend):
+
+    def __init__(self, backend: ScraperBackend, cache: ScrapeCache, refresh: bool = False):
+        """
+        return results of `backend` from a `ScrapeCache` when possible
+
+        :param refresh: scrape every page again and overwrite the cached results
+        """
+        self.backend = backend
+        self.cache = cache
+        self.refresh = refresh
+
+    def supports(self, vendor: str, page_type: str) -> bool:
+        return self.backend.supports(vendor, page_type)
+
+    def scrape(self, vendor: str, page_type: str, url: str):
+        return self.cache.fetch(
+            vendor, page_type, url, lambda: self.backend.scrape(vendor, page_type, url), self.refresh
+        )
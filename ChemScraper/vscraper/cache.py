@@ -0,0 +1,98 @@
+import io
+import json
+from typing import Callable, Union
+from urllib.parse import urlparse
+
+import pandas as pd
+from loguru import logger
+
+from ChemScraper.settings import ScrapeCacheTtls
+from ChemScraper.utils import FilePath, SqliteCache, remove_url_query
+
+"""
+persistent cache of parsed vendor pages, keyed by (vendor, page type, normalized product url)
+
+entries are grouped in namespaces of "<vendor>/<page type>" so hits and misses can be monitored per vendor,
+each page type expires after its own ttl, see `settings.ScrapeCacheTtls`
+"""
+
+
+def normalize_product_url(url: str) -> str:
+    """
+    drop the query and fragment (e.g. fisher's "#?keyword=..."), lower case the host, strip trailing slashes
+    """
+    parsed = urlparse(remove_url_query(url))
+    return parsed._replace(netloc=parsed.netloc.lower(), path=parsed.path.rstrip("/"), fragment="").geturl()
+
+
+def _dumps(value) -> str:
+    if isinstance(value, pd.DataFrame):
+        return json.dumps({"type": "dataframe", "data": value.to_json(orient="split")})
+    return json.dumps({"type": "json", "data": value})
+
+
+def _loads(text: str):
+    record = json.loads(text)
+    if record["type"] == "dataframe":
+        # dtype=False keeps prices and pack sizes as the scraped strings
+        return pd.read_json(io.StringIO(record["data"]), orient="split", dtype=False)
+    return record["data"]
+
+
+class ScrapeCache:
+
+    def __init__(
+            self, path: FilePath = "scrape_cache.sqlite", ttl: dict[str, float] = None, max_entries: int = None,
+    ):
+        """
+        :param path: sqlite database file
+        :param ttl: page type -> seconds before an entry expires, updates `settings.ScrapeCacheTtls`,
+            page types not listed never expire
+        :param max_entries: least recently used entries are evicted beyond this size
+        """
+        self.ttl = dict(ScrapeCacheTtls)
+        self.ttl.update(ttl or dict())
+        self.store = SqliteCache(path, ttl=dict(), max_entries=max_entries)
+
+    def _namespace(self, vendor: str, page_type: str) -> str:
+        namespace = f"{vendor}/{page_type}"
+        self.store.ttl.setdefault(namespace, self.ttl.get(page_type))
+        return namespace
+
+    def get(self, vendor: str, page_type: str, url: str):
+        """
+        :return: the cached result, None if missing or expired
+        """
+        text = self.store.get(self._namespace(vendor, page_type), normalize_product_url(url))
+        return None if text is None else _loads(text)
+
+    def put(self, vendor: str, page_type: str, url: str, value: Union[pd.DataFrame, dict, list, str]):
+        self.store.set(self._namespace(vendor, page_type), normalize_product_url(url), _dumps(value))
+
+    def invalidate(self, vendor: str, page_type: str, url: str):
+        self.store.delete(self._namespace(vendor, page_type), normalize_product_url(url))
+
+    def fetch(self, vendor: str, page_type: str, url: str, scrape: Callable[[], object], refresh: bool = False):
+        """
+        return the cached result of a page, or call `scrape` and cache what it returns
+
+        :param scrape: function without arguments scraping the page, exceptions are not cached
+        :param refresh: ignore the cached result and scrape again
+        """
+        if not refresh:
+            value = self.get(vendor, page_type, url)
+            if value is not None:
+                logger.info(f"cache hit for {vendor} {page_type}: {url}")
+                return value
+        value = scrape()
+        self.put(vendor, page_type, url, value)
+        return value
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """
+        :return: a dict of "<vendor>/<page type>" -> {"hits": ..., "misses": ..., "entries": ...}
+        """
+        return self.store.stats()
+
+    def close(self):
+        self.store.close()
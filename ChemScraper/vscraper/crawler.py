@@ -0,0 +1,107 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
+from typing import Iterator, Union
+
+import pandas as pd
+from loguru import logger
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+from ChemScraper.vscraper.backend import ScraperBackend, FallbackBackend, StaticBackend, SeleniumBackend, \
+    CachedBackend
+from ChemScraper.vscraper.cache import ScrapeCache
+from ChemScraper.vscraper.pool import DriverPool
+from ChemScraper.vscraper.se import log_page_ready
+from ChemScraper.vscraper.sigma_aldrich import sigma_search_url
+
+"""
+crawl all result pages of a vendor search and scrape the product pages concurrently
+"""
+
+
+@contextmanager
+def _borrow(driver: Union[webdriver.Chrome, DriverPool], vendor: str):
+    if isinstance(driver, DriverPool):
+        with driver.lease(vendor) as d:
+            yield d
+    else:
+        yield driver
+
+
+def iter_sigma_aldrich_product_links(
+        driver: Union[webdriver.Chrome, DriverPool], cas: str, max_pages: int = 20, timeout: float = 5,
+) -> Iterator[str]:
+    """
+    walk the search result pages of a cas number, yield each product url once
+
+    the walk stops at the first page without new product links
+    """
+    seen = set()
+    product_elements_locator = (By.XPATH, '//a[contains(@href, "/product/")]')
+    for page in range(1, max_pages + 1):
+        url = sigma_search_url(cas, page)
+        logger.info(f"sigma-aldrich search url: {url}")
+        with _borrow(driver, 'Sigma-Aldrich') as d:
+            d.get(url)
+            ts1 = time.perf_counter()
+            try:
+                product_elements = WebDriverWait(d, timeout=timeout).until(
+                    EC.presence_of_all_elements_located(product_elements_locator)
+                )
+            except TimeoutException:
+                break
+            log_page_ready('Sigma-Aldrich', 'search', ts1)
+            links = [elem.get_attribute('href') for elem in product_elements]
+        new_links = [link for link in dict.fromkeys(links) if link not in seen]
+        if len(new_links) == 0:
+            break
+        seen.update(new_links)
+        yield from new_links
+    logger.info(f"sigma-aldrich search returns # of products: {len(seen)}")
+
+
+def crawl_sigma_aldrich_patables(
+        driver: Union[webdriver.Chrome, DriverPool], cas: str, backend: ScraperBackend = None,
+        max_workers: int = 4, max_pages: int = 20, cache: ScrapeCache = None, refresh: bool = False,
+) -> Iterator[pd.DataFrame]:
+    """
+    crawl all search result pages for a cas number and scrape product pages as soon as their links are found,
+    at most `max_workers` product pages are scraped at the same time
+
+    :param driver: browser for the search pages (they are rendered by javascript), or a pool of browsers
+    :param backend: backend for product pages, default to static parsing with the browser(s) as fallback,
+        use a `DriverPool` if product pages need a browser and should run in parallel
+    :param cache: if given, cached product pages are not scraped again, search pages are always crawled
+    :param refresh: scrape product pages even if they are cached
+    :return: a generator of price tables in the order they finish
+    """
+    if backend is None:
+        backend = FallbackBackend([StaticBackend(), SeleniumBackend(driver)])
+    if cache is not None:
+        backend = CachedBackend(backend, cache, refresh)
+    in_flight = dict()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        def _collect(block: bool):
+            finished, _ = wait(in_flight, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+            for future in finished:
+                link = in_flight.pop(future)
+                try:
+                    yield future.result()
+                except Exception as e:
+                    logger.critical(f'FAILED to extract patable: {link}')
+                    logger.error(e)
+
+        links = iter_sigma_aldrich_product_links(driver, cas, max_pages)
+        if not isinstance(driver, DriverPool):
+            # one browser cannot walk search pages while it is the fallback for product pages
+            links = list(links)
+        for link in links:
+            in_flight[executor.submit(backend.scrape, 'Sigma-Aldrich', 'patable', link)] = link
+            yield from _collect(block=len(in_flight) >= 2 * max_workers)
+        while in_flight:
+            yield from _collect(block=True)
@@ -0,0 +1,247 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, Union
+
+import pandas as pd
+from loguru import logger
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException, InvalidSessionIdException
+
+from ChemScraper.settings import VendorSources
+from ChemScraper.utils import metrics_registry
+from ChemScraper.vscraper.se import get_chrome_driver
+from ChemScraper.vscraper.sigma_aldrich import get_sigma_aldrich_patables
+from ChemScraper.vscraper.thermo_fisher import get_thermo_fisher_patables_in_search
+
+"""
+a pool of warm browsers shared by scraping threads
+"""
+
+
+class _CountingDriver:
+    """ forward everything to a driver, count page loads """
+
+    def __init__(self, driver: webdriver.Chrome):
+        self._driver = driver
+        self.pages = 0
+
+    def get(self, url: str):
+        self.pages += 1
+        return self._driver.get(url)
+
+    def __getattr__(self, item):
+        return getattr(self._driver, item)
+
+
+class BrowserCrashError(WebDriverException):
+    """ the browser of a lease died, it has been replaced """
+
+
+class PoolExhaustedError(RuntimeError):
+    """ every browser of a pool died and could not be restarted """
+
+
+def _is_alive(driver) -> bool:
+    try:
+        driver.window_handles
+        return True
+    except WebDriverException:
+        return False
+
+
+class DriverPool:
+
+    def __init__(
+            self, size: int = 2, max_pages: int = 100, vendor_limits: dict[str, int] = None,
+            driver_factory: Callable[..., webdriver.Chrome] = get_chrome_driver, restart_attempts: int = 3,
+            **driver_kwargs,
+    ):
+        """
+        start `size` browsers once and lend them to threads
+
+        :param size: number of browsers
+        :param max_pages: a browser is restarted after loading this many pages
+        :param vendor_limits: vendor name -> max number of browsers working on this vendor at the same time
+        :param driver_factory: function to start a browser, called with `driver_kwargs`
+        :param restart_attempts: tries to start a replacement browser, the pool shrinks by one if all of them fail
+        """
+        self.size = size
+        self.max_pages = max_pages
+        self.driver_factory = driver_factory
+        self.restart_attempts = restart_attempts
+        self.driver_kwargs = driver_kwargs
+        self._vendor_semaphores = {
+            vendor: threading.BoundedSemaphore(limit) for vendor, limit in (vendor_limits or dict()).items()
+        }
+        self._idle = queue.Queue()
+        self._drivers = []
+        # browsers in the pool, idle or leased, a slot is only given up when its browser cannot be restarted
+        self._slots = 0
+        self._slots_lock = threading.Lock()
+        with ThreadPoolExecutor(max_workers=size) as executor:
+            for driver in executor.map(lambda _: self._new_driver(), range(size)):
+                self._idle.put(driver)
+                self._slots += 1
+
+    def _new_driver(self) -> _CountingDriver:
+        driver = _CountingDriver(self.driver_factory(**self.driver_kwargs))
+        self._drivers.append(driver)
+        return driver
+
+    def _retire(self, driver: _CountingDriver):
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass
+        self._drivers.remove(driver)
+
+    def _replace(self, driver: _CountingDriver, reason: str) -> Union[_CountingDriver, None]:
+        """
+        :param reason: why the browser is replaced, logged if the slot is given up
+        :return: a new browser in place of `driver`, None if it could not be started and the slot is given up
+        """
+        self._retire(driver)
+        for attempt in range(1, self.restart_attempts + 1):
+            try:
+                return self._new_driver()
+            except Exception as e:
+                logger.warning(f"failed to start a browser, attempt {attempt}/{self.restart_attempts}: {e}")
+        with self._slots_lock:
+            self._slots -= 1
+            slots = self._slots
+        logger.error(f"giving up a browser slot after {reason}, {slots}/{self.size} browsers left")
+        return None
+
+    def _get_idle(self, poll_interval: float = 1.0) -> _CountingDriver:
+        while True:
+            if self._slots <= 0:
+                raise PoolExhaustedError(f"all {self.size} browsers died and could not be restarted")
+            try:
+                return self._idle.get(timeout=poll_interval)
+            except queue.Empty:
+                continue
+
+    @contextmanager
+    def lease(self, vendor: str = None):
+        """
+        borrow a browser, blocks until one is idle and the vendor limit allows it
+
+        a browser that loaded `max_pages` pages is replaced by a new one, so is a browser whose session died,
+        the error is then raised as `BrowserCrashError`, other selenium errors (e.g. `TimeoutException`)
+        are raised as they are and the browser is kept
+
+        :raise PoolExhaustedError: if no browser is left, waiting callers are woken up as well
+        """
+        semaphore = self._vendor_semaphores.get(vendor)
+        if semaphore is not None:
+            semaphore.acquire()
+        try:
+            driver = self._get_idle()
+        except PoolExhaustedError:
+            if semaphore is not None:
+                semaphore.release()
+            raise
+        reason = None
+        try:
+            yield driver
+        except WebDriverException as e:
+            if isinstance(e, InvalidSessionIdException) or not _is_alive(driver):
+                reason = f"a crash ({e.__class__.__name__}: {e.msg})"
+                logger.warning(f"browser crashed after {driver.pages} pages, restarting: {reason}")
+                raise BrowserCrashError(f"{e.__class__.__name__}: {e.msg}") from e
+            raise
+        finally:
+            if reason is None and driver.pages >= self.max_pages:
+                reason = f"{driver.pages} pages"
+                logger.info(f"recycling browser after {reason}")
+            if reason is not None:
+                # errors starting the replacement are logged, the error of the lease is what the caller sees
+                driver = self._replace(driver, reason)
+            if driver is not None:
+                self._idle.put(driver)
+            if semaphore is not None:
+                semaphore.release()
+
+    def close(self):
+        for driver in list(self._drivers):
+            self._retire(driver)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _scrape_sigma_aldrich(driver, cas: str) -> pd.DataFrame:
+    return get_sigma_aldrich_patables(driver, cas)
+
+
+def _scrape_thermo_fisher(driver, cas: str) -> pd.DataFrame:
+    return get_thermo_fisher_patables_in_search(driver, cas, use_quickview=True, max_results=1)
+
+
+# vendor name -> function(driver, cas) returning the price/availability table
+VendorPatableScrapers = {
+    'Sigma-Aldrich': _scrape_sigma_aldrich,
+    'Thermo Fisher Scientific': _scrape_thermo_fisher,
+}
+
+
+def scrape_many(
+        cas_list: Iterable[str], vendors: Iterable[str] = VendorSources, pool: DriverPool = None,
+        max_retries: int = 1, **pool_kwargs,
+) -> Iterator[tuple[str, str, Union[pd.DataFrame, None], Union[Exception, None]]]:
+    """
+    scrape price/availability tables for many cas numbers from many vendors in parallel
+
+    :param cas_list: cas numbers
+    :param vendors: vendor names, see `VendorPatableScrapers`
+    :param pool: a driver pool, if None, one is created with `pool_kwargs` and closed at the end
+    :param max_retries: retries of a task after its browser crashed, see `DriverPool.lease`
+    :return: a generator of (cas, vendor, table, exception) in the order the tasks finish,
+        either table or exception is None
+    """
+    own_pool = pool is None
+    if own_pool:
+        pool = DriverPool(**pool_kwargs)
+    vendors = list(vendors)
+    for vendor in vendors:
+        if vendor not in VendorPatableScrapers:
+            raise ValueError(f"no scraper for vendor: {vendor}")
+
+    def _task(cas, vendor):
+        for attempt in range(max_retries + 1):
+            try:
+                with pool.lease(vendor) as driver:
+                    return VendorPatableScrapers[vendor](driver, cas)
+            except BrowserCrashError as e:
+                if attempt == max_retries:
+                    raise e
+                metrics_registry.inc("chemscraper_retries_total", call="scrape_many")
+
+    tasks = ((cas, vendor) for cas in cas_list for vendor in vendors)
+    try:
+        with ThreadPoolExecutor(max_workers=pool.size) as executor:
+            in_flight = dict()
+            while True:
+                for cas, vendor in tasks:
+                    in_flight[executor.submit(_task, cas, vendor)] = (cas, vendor)
+                    if len(in_flight) >= 2 * pool.size:
+                        break
+                if not in_flight:
+                    break
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    cas, vendor = in_flight.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        yield cas, vendor, future.result(), None
+                    else:
+                        logger.critical(f"FAILED to scrape {vendor} for: {cas}")
+                        yield cas, vendor, None, error
+    finally:
+        if own_pool:
+            pool.close()
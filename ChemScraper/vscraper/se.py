@@ -1,42 +1,143 @@
-from fake_useragent import UserAgent
+import threading
+import time
+
+from loguru import logger
 from selenium import webdriver
-from selenium.common.exceptions import WebDriverException
+from selenium.common.exceptions import WebDriverException, NoSuchElementException, StaleElementReferenceException
 from selenium.webdriver.chrome.service import Service as ChromeService
 from selenium.webdriver.remote.webelement import WebElement
 from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
 
-from ChemScraper.utils import get_folder
+from ChemScraper.settings import LeanChromeBlockedUrls
+from ChemScraper.utils import get_folder, metrics_registry
 
 """
 selenium driver set up
 """
 
-ua = UserAgent()  # error msg for the first run
+_ua = None
+_ua_lock = threading.Lock()
+
+
+def get_user_agent():
+    """ the shared `fake_useragent.UserAgent`, created on first use as it may load data over the network """
+    global _ua
+    with _ua_lock:
+        if _ua is None:
+            from fake_useragent import UserAgent
+            _ua = UserAgent()  # error msg for the first run
+    return _ua
+
+
+def __getattr__(name):
+    # `ua` used to be created at import time
+    if name == 'ua':
+        return get_user_agent()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def log_page_ready(vendor: str, page: str, ts: float):
+    """ log and record the seconds since `ts` (a `time.perf_counter` value) as the time a page took to be ready """
+    elapsed = time.perf_counter() - ts
+    logger.info("page ready after: {:.3f} s".format(elapsed))
+    metrics_registry.observe("chemscraper_page_ready_seconds", elapsed, vendor=vendor, page=page)
 
 
 def textify_elements(eles: list[WebElement]):
     return [e.text for e in eles]
 
 
-def get_chrome_driver(headless=True) -> webdriver.Chrome:
+_EXTRACT_TABLE_JS = """
+const [tableXpath, headerXpath, rowXpath, cellXpath] = arguments;
+const all = (xpath, node) => {
+    const snapshot = document.evaluate(xpath, node, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    const nodes = [];
+    for (let i = 0; i < snapshot.snapshotLength; i++) nodes.push(snapshot.snapshotItem(i));
+    return nodes;
+};
+const table = all(tableXpath, document)[0];
+if (!table) return null;
+const cell = c => ({
+    text: (c.innerText || "").trim(),
+    hrefs: Array.from(c.querySelectorAll("a[href]")).map(a => a.href),
+});
+return {
+    headers: all(headerXpath, table).map(h => (h.innerText || "").trim()),
+    rows: all(rowXpath, table).map(r => all(cellXpath, r).map(cell)),
+};
+"""
+
+
+def extract_table(
+        driver: webdriver.Chrome, table_xpath: str, header_xpath: str = './thead/tr/th',
+        row_xpath: str = './tbody/tr', cell_xpath: str = './td',
+) -> dict:
+    """
+    read a whole table in one `execute_script` call instead of one webdriver request per element
+
+    :param table_xpath: xpath of the table, the first match is used
+    :param header_xpath: xpath of header cells relative to the table
+    :param row_xpath: xpath of rows relative to the table
+    :param cell_xpath: xpath of cells relative to a row
+    :return: {"headers": [header text], "rows": [[{"text": cell text, "hrefs": [link urls in the cell]}]]},
+        None if the table is not found
+    """
+    return driver.execute_script(_EXTRACT_TABLE_JS, table_xpath, header_xpath, row_xpath, cell_xpath)
+
+
+ChromeProfiles = ('full', 'lean')
+
+
+def get_chrome_driver(headless=True, profile: str = 'full', blocked_urls: list[str] = None) -> webdriver.Chrome:
+    """
+    start a chrome driver
+
+    :param headless: run without a window
+    :param profile: "full" loads everything a regular browser would;
+        "lean" skips images, media, fonts and known trackers (`settings.LeanChromeBlockedUrls`),
+        returns from `get` once the DOM is ready (eager page load) and disables extensions and gpu
+    :param blocked_urls: extra url patterns (`*` wildcards) to block, added to those of the profile
+    :return: the driver
+    """
+    assert profile in ChromeProfiles, f"unknown chrome profile: {profile}"
     window_size = "1920,1080"
     options = webdriver.ChromeOptions()
     options.add_argument("--window-size=%s" % window_size)
-    options.add_argument(f'user-agent={ua.chrome}')
-    options.add_experimental_option("prefs", {
+    options.add_argument(f'user-agent={get_user_agent().chrome}')
+    prefs = {
         "download.default_directory": f"{get_folder(__file__)}",
         "download.prompt_for_download": False,
         "download.directory_upgrade": True,
         "safebrowsing.enabled": True
-    })
+    }
+    blocked = list(blocked_urls or [])
+    if profile == 'lean':
+        # 2 = block, images are also covered by the url patterns for those not recognised by content type
+        prefs.update({
+            "profile.managed_default_content_settings.images": 2,
+            "profile.managed_default_content_settings.media_stream": 2,
+            "profile.default_content_setting_values.notifications": 2,
+            "profile.default_content_setting_values.geolocation": 2,
+        })
+        options.page_load_strategy = 'eager'
+        options.add_argument("--disable-extensions")
+        options.add_argument("--disable-gpu")
+        options.add_argument("--blink-settings=imagesEnabled=false")
+        options.add_argument("--mute-audio")
+        blocked = list(LeanChromeBlockedUrls) + blocked
+    options.add_experimental_option("prefs", prefs)
 
     if headless:
         options.add_argument("--headless")  # https://stackoverflow.com/questions/16180428/
     try:
         driver = webdriver.Chrome(options=options)
     except WebDriverException:
+        from webdriver_manager.chrome import ChromeDriverManager
         driver = webdriver.Chrome(service=ChromeService(ChromeDriverManager().install()), options=options)
+    if blocked:
+        # fonts, media and third-party scripts have no content setting, they are dropped at the network level
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocked})
     return driver
 
 
@@ -61,3 +162,39 @@ def ec_clickable_of_all_elements(elements):
         return elements
 
     return _predicate
+
+
+# jquery requests in flight, 0 if the page does not use jquery
+_PendingRequestsJs = "return window.jQuery ? window.jQuery.active : 0;"
+
+
+def is_selected_button(element) -> bool:
+    """ a toggle button (e.g. a quantity choice) is selected, judged from its class and aria attributes """
+    classes = (element.get_attribute("class") or "").lower().split()
+    if any(c in classes for c in ("selected", "active", "is-selected")):
+        return True
+    return any(element.get_attribute(a) == "true" for a in ("aria-pressed", "aria-checked", "aria-selected"))
+
+
+def ec_text_settled(locator, old_text: str, clicked):
+    """
+    wait for the text of a visible element after clicking `clicked`, return the text once it differs
+    from `old_text`, or once `clicked` is selected and no jquery request is pending, which is the case when
+    the new choice shows the same text
+    """
+
+    def _predicate(driver):
+        try:
+            element = driver.find_element(*locator)
+            text = element.text
+            if not element.is_displayed() or not text:
+                return False
+            if text != old_text:
+                return text
+            if is_selected_button(clicked) and driver.execute_script(_PendingRequestsJs) == 0:
+                return text
+            return False
+        except (NoSuchElementException, StaleElementReferenceException):
+            return False
+
+    return _predicate
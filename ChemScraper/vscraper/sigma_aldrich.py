@@ -1,6 +1,7 @@
 import time
 
 import pandas as pd
+from bs4 import BeautifulSoup
 from loguru import logger
 from selenium import webdriver
 from selenium.common.exceptions import TimeoutException
@@ -9,38 +10,98 @@ from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 
-from ChemScraper.utils import chunks
-from ChemScraper.vscraper.se import textify_elements
+from ChemScraper.vscraper.cache import ScrapeCache
+from ChemScraper.vscraper.se import extract_table, log_page_ready
 
 
-def get_sigma_aldrich_patable(driver: webdriver.Chrome, product_url: str) -> pd.DataFrame:
+def get_sigma_aldrich_patable(
+        driver: webdriver.Chrome, product_url: str, cache: ScrapeCache = None, refresh: bool = False,
+) -> pd.DataFrame:
     """
     scraping the product page
 
     :param driver: Se driver
     :param product_url: either from pubchem or from a sigma-aldrich search
+    :param cache: if given, a cached table is returned without loading the page
+    :param refresh: scrape the page even if it is cached
     :return:
     """
+    if cache is not None:
+        return cache.fetch(
+            'Sigma-Aldrich', 'patable', product_url, lambda: get_sigma_aldrich_patable(driver, product_url), refresh
+        )
     logger.info(f"sigma-aldrich product url: {product_url}")
     driver.get(product_url)
     wait = WebDriverWait(driver, timeout=5)
     ts1 = time.perf_counter()
     # stricter path to elements in the first table
-    cols = wait.until(EC.presence_of_all_elements_located((By.XPATH, '/descendant::table[1]/thead/tr/th')))
-    rows = wait.until(EC.presence_of_all_elements_located((By.XPATH, '/descendant::table[1]/tbody/tr/td')))
-    logger.info("page ready after: {:.3f} s".format(time.perf_counter() - ts1))
-    ncols = len(cols)
-    assert len(rows) % ncols == 0
-    rows = chunks(rows, ncols)
-    rows = [textify_elements(r) for r in rows]
-    cols = textify_elements(cols)
+    wait.until(EC.presence_of_all_elements_located((By.XPATH, '/descendant::table[1]/thead/tr/th')))
+    wait.until(EC.presence_of_all_elements_located((By.XPATH, '/descendant::table[1]/tbody/tr/td')))
+    log_page_ready('Sigma-Aldrich', 'patable', ts1)
+    table = extract_table(driver, '/descendant::table[1]')
+    cols = table['headers']
+    rows = [[c['text'] for c in r] for r in table['rows']]
+    rows = [r for r in rows if len(r) > 0]
+    assert all(len(r) == len(cols) for r in rows)
     df = pd.DataFrame(rows)
     df.columns = cols
     df['url'] = [product_url, ] * len(rows)
     return df
 
 
-def get_sigma_aldrich_properties(driver, product_url: str) -> dict[str, str]:
+def parse_sigma_aldrich_patable_html(html: str, product_url: str) -> pd.DataFrame:
+    """
+    static version of `get_sigma_aldrich_patable`, parse the first table of a product page
+
+    :raise ValueError: if the table is not in the html, e.g. it is rendered by javascript
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    table = soup.find("table")
+    if table is None or table.thead is None or table.tbody is None:
+        raise ValueError(f"no price table found in html: {product_url}")
+    cols = [th.get_text(" ", strip=True) for th in table.thead.find_all("th")]
+    rows = [[td.get_text(" ", strip=True) for td in tr.find_all("td")] for tr in table.tbody.find_all("tr")]
+    rows = [r for r in rows if len(r) > 0]
+    if len(cols) == 0 or len(rows) == 0 or any(len(r) != len(cols) for r in rows):
+        raise ValueError(f"unexpected price table shape in html: {product_url}")
+    df = pd.DataFrame(rows)
+    df.columns = cols
+    df['url'] = [product_url, ] * len(rows)
+    return df
+
+
+def parse_sigma_aldrich_properties_html(html: str) -> dict[str, str]:
+    """
+    static version of `get_sigma_aldrich_properties`
+
+    :raise ValueError: if the property table is not in the html
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    property_divs = soup.find_all(id='pdp-properties--table')
+    if len(property_divs) == 0:
+        raise ValueError("no property table found in html")
+    properties = dict()
+    for prop_div in property_divs:
+        items = [t for t in prop_div.get_text("\n", strip=True).split("\n") if t]
+        if len(items) < 2:
+            raise ValueError(f"expected more than 2 items from the text: {prop_div.get_text()}")
+        name, value = items[0], "\n".join(items[1:])
+        properties[name.strip()] = value.strip()
+    return properties
+
+
+def get_sigma_aldrich_properties(
+        driver, product_url: str, cache: ScrapeCache = None, refresh: bool = False,
+) -> dict[str, str]:
+    """
+    :param cache: if given, cached properties are returned without loading the page
+    :param refresh: scrape the page even if it is cached
+    """
+    if cache is not None:
+        return cache.fetch(
+            'Sigma-Aldrich', 'properties', product_url, lambda: get_sigma_aldrich_properties(driver, product_url),
+            refresh
+        )
     logger.info(f"sigma-aldrich product url: {product_url}")
     driver.get(product_url)
     wait = WebDriverWait(driver, timeout=5)
@@ -54,7 +115,7 @@ def get_sigma_aldrich_properties(driver, product_url: str) -> dict[str, str]:
 
     property_divs = wait.until(EC.presence_of_all_elements_located((By.ID, 'pdp-properties--table')))
 
-    logger.info("page ready after: {:.3f} s".format(time.perf_counter() - ts1))
+    log_page_ready('Sigma-Aldrich', 'properties', ts1)
     properties = dict()
     for prop_div in property_divs:
         items = prop_div.text.split("\n")
@@ -64,7 +125,25 @@ def get_sigma_aldrich_properties(driver, product_url: str) -> dict[str, str]:
     return properties
 
 
-def get_sigma_aldrich_properties_from_cas(driver, cas: str) -> dict[str, str]:
+def _scrape_product_page(driver, page_type: str, link: str, backend, cache: ScrapeCache, refresh: bool):
+    if backend is None:
+        scraper = {'patable': get_sigma_aldrich_patable, 'properties': get_sigma_aldrich_properties}[page_type]
+        return scraper(driver, link, cache=cache, refresh=refresh)
+    if cache is None:
+        return backend.scrape('Sigma-Aldrich', page_type, link)
+    return cache.fetch(
+        'Sigma-Aldrich', page_type, link, lambda: backend.scrape('Sigma-Aldrich', page_type, link), refresh
+    )
+
+
+def get_sigma_aldrich_properties_from_cas(
+        driver, cas: str, backend=None, cache: ScrapeCache = None, refresh: bool = False,
+) -> dict[str, str]:
+    """
+    :param backend: if given, product pages are scraped with this `ScraperBackend` instead of `driver`
+    :param cache: if given, cached product pages are not scraped again
+    :param refresh: scrape product pages even if they are cached
+    """
     url = sigma_search_url(cas)
     logger.info(f"sigma-aldrich search url: {url}")
     driver.get(url)
@@ -72,12 +151,11 @@ def get_sigma_aldrich_properties_from_cas(driver, cas: str) -> dict[str, str]:
     wait = WebDriverWait(driver, timeout=15)
     ts1 = time.perf_counter()
     product_elements = wait.until(EC.presence_of_all_elements_located(product_elements_locator))
-    logger.info("page ready after: {:.3f} s".format(time.perf_counter() - ts1))
+    log_page_ready('Sigma-Aldrich', 'search', ts1)
     links = [elem.get_attribute('href') for elem in product_elements]
     for link in links:
         try:
-            prop_dict = get_sigma_aldrich_properties(driver, link)
-            return prop_dict
+            return _scrape_product_page(driver, 'properties', link, backend, cache, refresh)
         except Exception as e:
             logger.critical(f'FAILED to extract properties: {link}')
             logger.error(e)
@@ -86,7 +164,14 @@ def get_sigma_aldrich_properties_from_cas(driver, cas: str) -> dict[str, str]:
     return {}
 
 
-def get_sigma_aldrich_properties_from_mf(driver, mf: str) -> dict[str, str]:
+def get_sigma_aldrich_properties_from_mf(
+        driver, mf: str, backend=None, cache: ScrapeCache = None, refresh: bool = False,
+) -> dict[str, str]:
+    """
+    :param backend: if given, product pages are scraped with this `ScraperBackend` instead of `driver`
+    :param cache: if given, cached product pages are not scraped again
+    :param refresh: scrape product pages even if they are cached
+    """
     url = sigma_search_url_mf(mf)
     logger.info(f"sigma-aldrich search url: {url}")
     driver.get(url)
@@ -98,12 +183,11 @@ def get_sigma_aldrich_properties_from_mf(driver, mf: str) -> dict[str, str]:
     except TimeoutException:
         logger.critical(f'FAILED to find properties for: {mf}')
         return {}
-    logger.info("page ready after: {:.3f} s".format(time.perf_counter() - ts1))
+    log_page_ready('Sigma-Aldrich', 'search', ts1)
     links = [elem.get_attribute('href') for elem in product_elements]
     for link in links:
         try:
-            prop_dict = get_sigma_aldrich_properties(driver, link)
-            return prop_dict
+            return _scrape_product_page(driver, 'properties', link, backend, cache, refresh)
         except Exception as e:
             logger.critical(f'FAILED to extract properties: {link}')
             logger.error(e)
@@ -112,7 +196,14 @@ def get_sigma_aldrich_properties_from_mf(driver, mf: str) -> dict[str, str]:
     return {}
 
 
-def get_sigma_aldrich_patables(driver, cas: str) -> pd.DataFrame:
+def get_sigma_aldrich_patables(
+        driver, cas: str, backend=None, cache: ScrapeCache = None, refresh: bool = False,
+) -> pd.DataFrame:
+    """
+    :param backend: if given, product pages are scraped with this `ScraperBackend` instead of `driver`
+    :param cache: if given, cached product pages are not scraped again
+    :param refresh: scrape product pages even if they are cached
+    """
     url = sigma_search_url(cas)
     logger.info(f"sigma-aldrich search url: {url}")
     driver.get(url)
@@ -120,20 +211,18 @@ def get_sigma_aldrich_patables(driver, cas: str) -> pd.DataFrame:
     wait = WebDriverWait(driver, timeout=5)
     ts1 = time.perf_counter()
     product_elements = wait.until(EC.visibility_of_all_elements_located(product_elements_locator))
-    logger.info("page ready after: {:.3f} s".format(time.perf_counter() - ts1))
-    links = [elem.get_attribute('href') for elem in product_elements]
-    unique_links = []
+    log_page_ready('Sigma-Aldrich', 'search', ts1)
+    # dict keeps the order of first appearance
+    unique_links = dict.fromkeys(elem.get_attribute('href') for elem in product_elements)
     dataframes = []
-    for link in links:
-        if link not in unique_links:
-            unique_links.append(link)
-            try:
-                df = get_sigma_aldrich_patable(driver, link)
-                dataframes.append(df)
-            except Exception as e:
-                logger.critical(f'FAILED to extract patable: {link}')
-                # logger.error(e)
-                continue
+    for link in unique_links:
+        try:
+            df = _scrape_product_page(driver, 'patable', link, backend, cache, refresh)
+            dataframes.append(df)
+        except Exception as e:
+            logger.critical(f'FAILED to extract patable: {link}')
+            # logger.error(e)
+            continue
 
     logger.info(f"sigma-aldrich search returns # of products: {len(dataframes)}")
     return pd.concat(dataframes, axis=0, ignore_index=True)
@@ -145,12 +234,14 @@ def sigma_sds_url_from_product_url(product_url: str):
     return sds_url
 
 
-def sigma_search_url(cas: str):
-    # TODO the perpage param does not work in browser, it's always 30, need to automate page turn
-    url = f"https://www.sigmaaldrich.com/US/en/search/{cas}?focus=products&page=1&perpage=30&sort=relevance&term={cas}&type=cas_number"
+def sigma_search_url(cas: str, page: int = 1):
+    # the perpage param does not work in browser, it's always 30, use `iter_sigma_aldrich_product_links` for all pages
+    url = f"https://www.sigmaaldrich.com/US/en/search/{cas}?focus=products&page={page}&perpage=30&sort=relevance" \
+          f"&term={cas}&type=cas_number"
     return url
 
 
 def sigma_search_url_mf(mf: str):
-    url = f"https://www.sigmaaldrich.com/US/en/search/{mf}?focus=products&page=1&perpage=30&sort=relevance&term={mf}&type=mol_form"
+    url = f"https://www.sigmaaldrich.com/US/en/search/{mf}?focus=products&page=1&perpage=30&sort=relevance" \
+          f"&term={mf}&type=mol_form"
     return url
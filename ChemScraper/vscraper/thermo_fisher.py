@@ -1,13 +1,17 @@
+import json
 import time
 
 import pandas as pd
+from bs4 import BeautifulSoup
 from loguru import logger
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 
-from ChemScraper.vscraper.se import WebElement, ec_visibility_of_all_elements, textify_elements
+from ChemScraper.vscraper.cache import ScrapeCache
+from ChemScraper.vscraper.se import extract_table, ec_text_settled, is_selected_button, log_page_ready
 
 
 def get_thermo_fisher_patables_in_search(
@@ -19,12 +23,14 @@ def get_thermo_fisher_patables_in_search(
     logger.info(f"getting searching url: {search_url}")
     driver.get(search_url)
     wait = WebDriverWait(driver, timeout=5)
+    ts_search = time.perf_counter()
     pa_buttons = wait.until(EC.visibility_of_all_elements_located(
         (By.XPATH, '//a[contains(@id, "qa_srch_res_quickView_")]')
     ))
     title_buttons = wait.until(EC.visibility_of_all_elements_located(
         (By.XPATH, '//a[contains(@id, "qa_srch_res_title_")]')
     ))
+    log_page_ready('Thermo Fisher Scientific', 'search', ts_search)
     if use_quickview:
         logger.info("using quick view from search results")
         if max_results != 1:
@@ -33,41 +39,37 @@ def get_thermo_fisher_patables_in_search(
         logger.info("clicking quick view button...")
         ts1 = time.perf_counter()
         button.click()
-        tr_elements = wait.until(
+        wait.until(
             EC.visibility_of_all_elements_located(
                 (By.XPATH, '//table[contains(@class, "qv_table")]//tr[contains(@class, "qvTRow")]')
             )
         )
-        th_elements = wait.until(
+        wait.until(
             EC.visibility_of_all_elements_located(
                 (By.XPATH, '//table[contains(@class, "qv_table")]//tr[@class="header-row"]//th')
             )
         )
-        cols = textify_elements(th_elements)
+        table = extract_table(
+            driver, '//table[contains(@class, "qv_table")]',
+            header_xpath='.//tr[@class="header-row"]//th', row_xpath='.//tr[contains(@class, "qvTRow")]',
+        )
+        cols = table['headers']
         cols[0] = 'sds_url'
         cols = ['product_url', ] + cols
         rows = []
-        for tr in tr_elements:
-            tds = tr.find_elements(By.TAG_NAME, 'td')
-            tds = wait.until(ec_visibility_of_all_elements(tds))
+        for cells in table['rows']:
             row_values = []
-            for icell, cell in enumerate(tds):
-                cell: WebElement
+            for icell, cell in enumerate(cells):
                 if icell == 0:
                     product_link = None
                     sds_link = None
-                    links = cell.find_elements(By.TAG_NAME, 'a')
-                    links = wait.until(ec_visibility_of_all_elements(links))
                     try:
-                        product_link, sds_link = links
-                        product_link = product_link.get_attribute('href')
-                        sds_link = sds_link.get_attribute('href')
-                    except Exception as e:
+                        product_link, sds_link = cell['hrefs']
+                    except ValueError:
                         logger.critical('error in parsing links (first cell)')
-                        # logger.error(e)
                     row_values += [product_link, sds_link]
                 else:
-                    row_values.append(cell.text)
+                    row_values.append(cell['text'])
             rows.append(row_values)
         logger.info('parsed quick view table in: {:.3f} s'.format(time.perf_counter() - ts1))
         df = pd.DataFrame(rows, columns=cols)
@@ -87,36 +89,161 @@ def get_thermo_fisher_patables_in_search(
         return pd.concat(dfs, axis=0, ignore_index=True)
 
 
-def get_thermo_fisher_patable(driver: webdriver.Chrome, product_url: str, sleep_for_price_label=0.5) -> pd.DataFrame:
+def _offer_price_unit(offer: dict) -> str:
+    # an offer is priced per item sold unless its price specification says otherwise
+    spec = offer.get('priceSpecification')
+    if isinstance(spec, list):
+        spec = spec[0] if spec else None
+    if isinstance(spec, dict):
+        unit = spec.get('unitText') or (spec.get('referenceQuantity') or dict()).get('unitText')
+        if unit:
+            return unit
+    return "Each"
+
+
+def parse_thermo_fisher_product_json(json_texts: list[str], product_url: str) -> list[dict]:
+    """
+    read quantity/price variants from the schema.org `Product` json embedded in a product page
+
+    :param json_texts: contents of `<script type="application/ld+json">` elements
+    :return: records as in `get_thermo_fisher_patable` without `sds_url`, empty if no offers are found,
+        "unit" is what the price is for as after the "/" of the page's price label, e.g. "Each"
+    """
+    records = []
+    for text in json_texts:
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError:
+            continue
+        products = data if isinstance(data, list) else data.get('@graph', [data])
+        for product in products:
+            if not isinstance(product, dict) or product.get('@type') != 'Product':
+                continue
+            offers = product.get('offers', [])
+            if isinstance(offers, dict):
+                offers = offers.get('offers', [offers])
+            for offer in offers:
+                if offer.get('price') is None:
+                    continue
+                price = str(offer['price'])
+                if offer.get('priceCurrency', 'USD') == 'USD':
+                    price = "$" + price
+                else:
+                    price = f"{price} {offer['priceCurrency']}"
+                records.append({
+                    'product_url': product_url,
+                    'quantity': offer.get('name') or offer.get('description') or offer.get('sku'),
+                    'price': price,
+                    'unit': _offer_price_unit(offer),
+                })
+    return records
+
+
+def parse_thermo_fisher_patable_html(html: str, product_url: str) -> pd.DataFrame:
+    """
+    static version of `get_thermo_fisher_patable` using the embedded product json
+
+    :raise ValueError: if the page has no product json with offers
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    json_texts = [script.get_text() for script in soup.find_all("script", type="application/ld+json")]
+    data = parse_thermo_fisher_product_json(json_texts, product_url)
+    if len(data) == 0:
+        raise ValueError(f"no product json with offers found in html: {product_url}")
+    sds_link = soup.find("a", id="qa_msds_item_link")
+    for record in data:
+        record['sds_url'] = sds_link.get('href') if sds_link else None
+    return pd.DataFrame.from_records(data)[['product_url', 'sds_url', 'quantity', 'price', 'unit']]
+
+
+def get_thermo_fisher_patable(
+        driver: webdriver.Chrome, product_url: str, sleep_for_price_label: float = None,
+        price_label_timeout: float = 3, use_product_json: bool = True, cache: ScrapeCache = None,
+        refresh: bool = False,
+) -> pd.DataFrame:
     """
     scraping the product page
+
+    :param sleep_for_price_label: if given, sleep this long after each click instead of waiting for the label to change
+    :param price_label_timeout: max seconds to wait for the price label after a click, the wait ends early when
+        the label changes or the clicked button is selected with no request pending
+    :param use_product_json: read all variants from the embedded product json if the page has one, no clicking
+    :param cache: if given, a cached table is returned without loading the page
+    :param refresh: scrape the page even if it is cached
     """
+    if cache is not None:
+        return cache.fetch(
+            'Thermo Fisher Scientific', 'patable', product_url,
+            lambda: get_thermo_fisher_patable(
+                driver, product_url, sleep_for_price_label, price_label_timeout, use_product_json
+            ),
+            refresh
+        )
     logger.info(f"thermo-fisher product url: {product_url}")
     driver.get(product_url)
     wait = WebDriverWait(driver, timeout=5)
     ts1 = time.perf_counter()
+    price_locator = (By.XPATH, '//label[@class="price"]')
+    sds_locator = (By.XPATH, '//a[@id="qa_msds_item_link"]')
+
+    if use_product_json:
+        json_texts = driver.execute_script(
+            'return Array.from(document.querySelectorAll(\'script[type="application/ld+json"]\')).map(s => s.text);'
+        )
+        data = parse_thermo_fisher_product_json(json_texts, product_url)
+        if len(data) > 0:
+            sds_links = driver.find_elements(*sds_locator)
+            sds_link = sds_links[0].get_attribute('href') if sds_links else None
+            for record in data:
+                record['sds_url'] = sds_link
+            logger.info("scraped {} variants from product json in: {:.3f} s".format(
+                len(data), time.perf_counter() - ts1))
+            return pd.DataFrame.from_records(data)[['product_url', 'sds_url', 'quantity', 'price', 'unit']]
+
     quantity_buttons = wait.until(
         EC.visibility_of_all_elements_located((By.XPATH, '//div[contains(@id, "attributeButton_Quantity")]')))
     data = []
+    time_waited = 0.0
     for button in quantity_buttons:
-        button.click()
-        time.sleep(sleep_for_price_label)  # wait for price_label to change
+        labels = driver.find_elements(*price_locator)
+        old_label = labels[0].text if labels else None
         quantity = button.text
-        logger.info(f'clicked button: {quantity}')
+        ts_click = time.perf_counter()
         try:
-            price_label = wait.until(EC.visibility_of_element_located((By.XPATH, '//label[@class="price"]')))
-            logger.info(f'price label is: {price_label.text}')
-            price_label = price_label.text
-            price, unit = price_label.strip().split("/")
+            if is_selected_button(button) and old_label:
+                # already selected, the label shows its price, nothing to click or wait for
+                price_label = old_label
+            else:
+                button.click()
+                logger.info(f'clicked button: {quantity}')
+                if sleep_for_price_label is not None:
+                    time.sleep(sleep_for_price_label)
+                    price_label = wait.until(EC.visibility_of_element_located(price_locator)).text
+                else:
+                    try:
+                        price_label = WebDriverWait(driver, timeout=price_label_timeout, poll_frequency=0.05).until(
+                            ec_text_settled(price_locator, old_label, button)
+                        )
+                    except TimeoutException:
+                        # a label that did not change may still show the price of the previous quantity
+                        price_label = wait.until(EC.visibility_of_element_located(price_locator)).text
+                        if price_label == old_label:
+                            logger.warning(f'price label did not update after clicking: {quantity}, '
+                                           f'still showing: {old_label}')
+                            price_label = None
+            logger.info(f'price label is: {price_label}')
+            if price_label is None:
+                price, unit = None, None
+            else:
+                price, unit = [x.strip() for x in price_label.strip().split("/")]
         except Exception as e:
             logger.critical(f'failed to extract price_label: {quantity}')
             # logger.error(e)
             price = None
             unit = None
+        time_waited += time.perf_counter() - ts_click
         try:
-            sds_link = wait.until(EC.visibility_of_element_located(
-                (By.XPATH, '//a[@id="qa_msds_item_link"]')
-            )).get_attribute('href')
+            sds_link = wait.until(EC.visibility_of_element_located(sds_locator)).get_attribute('href')
         except Exception as e:
             logger.critical(f'failed to extract sds url: {quantity}')
             # logger.error(e)
@@ -129,6 +256,9 @@ def get_thermo_fisher_patable(driver: webdriver.Chrome, product_url: str, sleep_
             'unit': unit,
         })
     logger.info("scraped product url in: {:.3f} s".format(time.perf_counter() - ts1))
+    if sleep_for_price_label is None:
+        logger.info("waited {:.3f} s for {} price labels, saved {:.3f} s vs fixed 0.5 s sleeps".format(
+            time_waited, len(quantity_buttons), 0.5 * len(quantity_buttons) - time_waited))
     df = pd.DataFrame.from_records(data)
     return df
 
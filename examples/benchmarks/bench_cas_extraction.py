@@ -0,0 +1,78 @@
+import glob
+import json
+import os
+import timeit
+import tracemalloc
+
+from ChemScraper.pubchem.view import _get_cas_number_from_pug_view, _get_cas_numbers_from_pug_view
+from ChemScraper.utils import iter_json_leaves
+
+"""
+compare cas extraction from saved pug view documents:
+- full traversal: the previous approach, `traverse_json` copying a path list at every node + a string scan of all leaves
+- leaves only: the non-copying `iter_json_leaves` + the same string scan
+- targeted: walking only Section/Information/Value/StringWithMarkup
+"""
+
+
+def _traverse_json_copying(indict, pre=None):
+    pre = pre[:] if pre else []
+    if isinstance(indict, dict):
+        for key, value in indict.items():
+            if isinstance(value, dict):
+                for d in _traverse_json_copying(value, pre + [key]):
+                    yield d
+            elif isinstance(value, list) or isinstance(value, tuple):
+                for v in value:
+                    for d in _traverse_json_copying(v, pre + [key]):
+                        yield d
+            else:
+                yield pre + [key, value]
+    else:
+        yield pre + [indict]
+
+
+def cas_full_traversal(data):
+    for v in _traverse_json_copying(data):
+        leaf = v[-1]
+        if isinstance(leaf, str) and "https://commonchemistry.cas.org/detail" in leaf:
+            return leaf.replace("https://commonchemistry.cas.org/detail?cas_rn=", "")
+
+
+def cas_leaves_only(data):
+    for path, leaf in iter_json_leaves(data):
+        if isinstance(leaf, str) and "https://commonchemistry.cas.org/detail" in leaf:
+            return leaf.replace("https://commonchemistry.cas.org/detail?cas_rn=", "")
+
+
+def measure(func, docs, number=200):
+    t = timeit.timeit(lambda: [func(d) for d in docs], number=number) / number / len(docs)
+    tracemalloc.start()
+    for d in docs:
+        func(d)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return t, peak
+
+
+if __name__ == '__main__':
+    fixtures = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "pug_view_cas_*.json")))
+    docs = []
+    for fn in fixtures:
+        with open(fn) as f:
+            docs.append(json.load(f))
+
+    for d in docs:
+        # the full traversal only finds cas numbers with a CAS Common Chemistry reference
+        assert cas_full_traversal(d) in (None, _get_cas_number_from_pug_view(d))
+
+    print(f"{len(docs)} pug view documents")
+    print("{:<18}{:>14}{:>16}".format("method", "us / document", "peak alloc (B)"))
+    for name, func in [
+        ("full traversal", cas_full_traversal),
+        ("leaves only", cas_leaves_only),
+        ("targeted", _get_cas_number_from_pug_view),
+        ("targeted (all)", _get_cas_numbers_from_pug_view),
+    ]:
+        t, peak = measure(func, docs)
+        print("{:<18}{:>14.1f}{:>16}".format(name, t * 1e6, peak))
@@ -0,0 +1,124 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from ChemScraper.catalog import search
+from ChemScraper.catalog.search import tanimoto_top_k, superset_rows, popcount_rows, build_fingerprint_index
+
+"""
+catalogue search on synthetic data
+
+- kernels: tanimoto top-k and the pattern screen over `--n` random fingerprints (1M by default, ~0.5 GB of arrays
+  in a temporary folder, memory mapped like a real index), numpy `bitwise_count` vs the byte lookup table,
+  1 shard vs `--shards`
+- end to end: `--n-mols` generated molecules fingerprinted with `build_fingerprint_index`, substructure queries
+  with the screen vs matching every row with rdkit
+"""
+
+Fragments = ("c1ccccc1", "c1ccncc1", "C1CCNCC1", "C1CCOC1", "C(=O)", "N", "O", "CC", "C(F)(F)", "C(Cl)",
+             "c1ccc2ccccc2c1", "S(=O)(=O)")
+
+SubstructureQueries = ("c1ccncc1", "C(F)(F)c1ccccc1", "O=CN1CCCCC1", "c1ccc2ccccc2c1C(=O)")
+
+
+def random_fingerprints(n: int, n_bytes: int, bit_density_log2: int, seed: int) -> np.ndarray:
+    """ packed fingerprints where each bit is set with probability 2 ** -bit_density_log2 """
+    rng = np.random.default_rng(seed)
+    words = np.full((n, n_bytes // 8), np.iinfo(np.uint64).max, dtype=np.uint64)
+    for _ in range(bit_density_log2):
+        words &= rng.integers(0, np.iinfo(np.uint64).max, size=words.shape, dtype=np.uint64, endpoint=True)
+    return words.view(np.uint8)
+
+
+def timeit(func, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        ts = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - ts)
+    return min(times)
+
+
+def bench_kernels(n: int, shards: int, repeat: int, workdir: str):
+    print(f"generating {n} random fingerprints")
+    morgan = np.lib.format.open_memmap(os.path.join(workdir, "morgan.npy"), mode="w+", dtype=np.uint8, shape=(n, 256))
+    pattern = np.lib.format.open_memmap(os.path.join(workdir, "pattern.npy"), mode="w+", dtype=np.uint8, shape=(n, 256))
+    for i in range(0, n, 100_000):
+        j = min(i + 100_000, n)
+        # ~64 of 2048 morgan bits, ~256 of 2048 pattern bits
+        morgan[i:j] = random_fingerprints(j - i, 256, 5, seed=i)
+        pattern[i:j] = random_fingerprints(j - i, 256, 3, seed=n + i)
+    morgan.flush()
+    pattern.flush()
+    counts = popcount_rows(morgan)
+    del morgan, pattern
+    morgan = np.load(os.path.join(workdir, "morgan.npy"), mmap_mode="r")
+    pattern = np.load(os.path.join(workdir, "pattern.npy"), mmap_mode="r")
+    query = np.asarray(morgan[n // 2])
+    screen_query = random_fingerprints(1, 256, 6, seed=2 ** 31)[0]
+
+    print("{:<48}{:>12}{:>14}".format("kernel", "best (s)", "rows / s"))
+    bitwise_count = search._bitwise_count
+    variants = [("bitwise_count", bitwise_count), ("byte lookup table", None)] if bitwise_count else \
+        [("byte lookup table", None)]
+    for popcount_name, func in variants:
+        search._bitwise_count = func
+        for n_shards in sorted({1, shards}):
+            elapsed = timeit(lambda: tanimoto_top_k(morgan, counts, query, k=10, shards=n_shards), repeat)
+            name = f"tanimoto top-10, {popcount_name}, {n_shards} shard(s)"
+            print("{:<48}{:>12.3f}{:>14.3g}".format(name, elapsed, n / elapsed))
+    search._bitwise_count = bitwise_count
+    for n_shards in sorted({1, shards}):
+        elapsed = timeit(lambda: superset_rows(pattern, screen_query, shards=n_shards), repeat)
+        name = f"pattern screen, {n_shards} shard(s)"
+        print("{:<48}{:>12.3f}{:>14.3g}".format(name, elapsed, n / elapsed))
+    rows, sims = tanimoto_top_k(morgan, counts, query, k=10, shards=shards)
+    assert rows[0] == n // 2 and sims[0] == 1.0, "the query row must be its own nearest neighbour"
+
+
+def bench_substructure(n_mols: int, shards: int, workdir: str):
+    from rdkit import RDLogger
+    from rdkit.Chem import MolFromSmiles
+    RDLogger.DisableLog("rdApp.*")
+    random.seed(0)
+    smis = ["".join(random.choice(Fragments) for _ in range(random.randint(2, 7))) for _ in range(n_mols)]
+    table = os.path.join(workdir, "compounds.csv")
+    pd.DataFrame({"cid": range(n_mols), "isosmiles": smis}).to_csv(table, index=False)
+    ts = time.perf_counter()
+    catalog = build_fingerprint_index(table, os.path.join(workdir, "index"))
+    print(f"\nfingerprinted {n_mols} molecules in {time.perf_counter() - ts:.1f} s")
+    catalog.shards = shards
+
+    print("{:<28}{:>12}{:>10}{:>16}{:>16}".format("query", "candidates", "matches", "screened (s)", "rdkit loop (s)"))
+    for query in SubstructureQueries:
+        ts = time.perf_counter()
+        n_candidates = len(catalog.screen(query))
+        matches = catalog.substructure(query)
+        screened = time.perf_counter() - ts
+        query_mol = MolFromSmiles(query)
+        ts = time.perf_counter()
+        # what a loop over the csv does: parse and match every row
+        mols = (MolFromSmiles(smi) for smi in smis)
+        brute = [i for i, mol in enumerate(mols) if mol is not None and mol.HasSubstructMatch(query_mol)]
+        brute_force = time.perf_counter() - ts
+        assert [m["cid"] for m in matches] == brute, f"screened matches differ for: {query}"
+        print("{:<28}{:>12}{:>10}{:>16.3f}{:>16.3f}".format(query, n_candidates, len(matches), screened, brute_force))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=1_000_000, help="random fingerprints for the kernels")
+    parser.add_argument("--n-mols", type=int, default=20_000, help="generated molecules for substructure search")
+    parser.add_argument("--shards", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"numpy {np.__version__}, bitwise_count: {search._bitwise_count is not None}, block rows: {search._BlockRows}")
+    with tempfile.TemporaryDirectory() as workdir:
+        bench_kernels(args.n, args.shards, args.repeat, workdir)
+        bench_substructure(args.n_mols, args.shards, workdir)
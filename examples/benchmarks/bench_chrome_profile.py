@@ -0,0 +1,107 @@
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import psutil
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.wait import WebDriverWait
+
+from ChemScraper.vscraper.se import get_chrome_driver
+
+"""
+compare the "full" and "lean" chrome profiles of `get_chrome_driver` on a local fixture product page:
+- page ready: `driver.get` until the price table is present, what the scrapers log as "page ready after"
+- rss: resident memory of chromedriver and all the chrome processes it started
+
+the fixture page is served by `http.server`, its images, fonts and video are random bytes written to a temporary
+folder and the "third-party" scripts under /analytics/ are answered after a delay to mimic a remote tracker
+"""
+
+_this_folder = os.path.dirname(os.path.abspath(__file__))
+
+_assets = {
+    "images/hero.jpg": 400_000,
+    **{f"images/gallery-{i}.jpg": 150_000 for i in range(8)},
+    "fonts/vendor-sans.woff2": 80_000,
+    "fonts/vendor-serif.woff2": 80_000,
+    "media/intro.mp4": 2_000_000,
+    "analytics/tag.js": 60_000,
+    "analytics/pixel.js": 20_000,
+}
+
+
+class _FixtureHandler(SimpleHTTPRequestHandler):
+    tracker_delay = 0.3
+
+    def do_GET(self):
+        if self.path.startswith("/analytics/"):
+            time.sleep(self.tracker_delay)
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def write_fixture_site(root: str):
+    shutil.copy(os.path.join(_this_folder, "fixtures", "product_page.html"), os.path.join(root, "index.html"))
+    for path, size in _assets.items():
+        fn = os.path.join(root, path)
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        with open(fn, "wb") as f:
+            if path.endswith(".js"):
+                f.write(b"// " + b"x" * (size - 4) + b"\n")
+            else:
+                f.write(os.urandom(size))
+
+
+def driver_rss(driver) -> int:
+    service = psutil.Process(driver.service.process.pid)
+    return sum(p.memory_info().rss for p in [service] + service.children(recursive=True))
+
+
+def measure_profile(profile: str, url: str, repeat: int) -> tuple[list[float], int]:
+    # the local trackers are not on a real tracker domain, block them the way the lean profile blocks those
+    blocked_urls = ["*/analytics/*"] if profile == "lean" else None
+    driver = get_chrome_driver(headless=True, profile=profile, blocked_urls=blocked_urls)
+    ready = []
+    try:
+        for _ in range(repeat):
+            driver.get("about:blank")
+            ts = time.perf_counter()
+            driver.get(url)
+            WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.XPATH, '//table[@id="pdp-sku-table"]')))
+            ready.append(time.perf_counter() - ts)
+        rss = driver_rss(driver)
+    finally:
+        driver.quit()
+    return ready, rss
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--tracker-delay", type=float, default=0.3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        write_fixture_site(root)
+        _FixtureHandler.tracker_delay = args.tracker_delay
+        server = ThreadingHTTPServer(("127.0.0.1", 0), partial(_FixtureHandler, directory=root))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/index.html"
+        try:
+            print("{:<8}{:>14}{:>14}{:>12}".format("profile", "median (ms)", "max (ms)", "rss (MB)"))
+            for profile in ("full", "lean"):
+                ready, rss = measure_profile(profile, url, args.repeat)
+                print("{:<8}{:>14.1f}{:>14.1f}{:>12.1f}".format(
+                    profile, statistics.median(ready) * 1e3, max(ready) * 1e3, rss / 2 ** 20
+                ))
+        finally:
+            server.shutdown()
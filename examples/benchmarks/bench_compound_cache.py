@@ -0,0 +1,81 @@
+import argparse
+import csv
+import json
+import os
+import tempfile
+import time
+
+from ChemScraper.pubchem import CompoundCache
+from ChemScraper.schema import Compound
+
+"""
+`CompoundCache` writes and lookups of `--n` synthetic compounds by cid
+
+run with `--check` to also check that warming the cache from a vendor csv or scraper output after a compound
+was identified keeps its cid, smiles, inchi and iupac, and only adds the warmed properties
+"""
+
+Aspirin = Compound(
+    2244, "CC(=O)OC1=CC=CC=C1C(=O)O", "InChI=1S/C9H8O4/c1-6(10)13-8-5-3-2-4-7(8)9(11)12/h2-5H,1H3,(H,11,12)",
+    "2-acetyloxybenzoic acid",
+)
+
+
+def bench(n: int, workdir: str):
+    cache = CompoundCache(os.path.join(workdir, "bench.sqlite"))
+    compounds = {cid: Compound(cid, "C" * (cid % 20 + 1), f"InChI=1S/{cid}", f"compound {cid}") for cid in range(n)}
+    ts = time.perf_counter()
+    cache.put_many(compounds, 'cid')
+    put = time.perf_counter() - ts
+    ts = time.perf_counter()
+    cache.put_many(compounds, 'cid')
+    merge = time.perf_counter() - ts
+    ts = time.perf_counter()
+    found = cache.get_many(list(compounds), 'cid')
+    get = time.perf_counter() - ts
+    assert len(found) == n, f"found {len(found)}/{n} compounds"
+    print("{:<28}{:>12}{:>14}".format("operation", "seconds", "records / s"))
+    for name, elapsed in [("put_many (new)", put), ("put_many (merge)", merge), ("get_many", get)]:
+        print("{:<28}{:>12.3f}{:>14.3g}".format(name, elapsed, n / elapsed))
+    cache.close()
+
+
+def check_warm_after_identify(workdir: str):
+    cache = CompoundCache(os.path.join(workdir, "check.sqlite"))
+    cache.put(Aspirin.smiles, 'smiles', Aspirin)
+    cache.put(Aspirin.cid, 'cid', Aspirin)
+
+    vendor_csv = os.path.join(workdir, "vendor.csv")
+    with open(vendor_csv, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["cid", "isosmiles", "mw"])
+        writer.writeheader()
+        writer.writerow({"cid": Aspirin.cid, "isosmiles": Aspirin.smiles, "mw": "180.16"})
+    cache.warm_from_vendor_csv(vendor_csv)
+    scraper_output = os.path.join(workdir, "scraper_output.json")
+    with open(scraper_output, "w") as f:
+        json.dump({Aspirin.smiles: {"mp": "134-136 °C (lit.)"}}, f)
+    cache.warm_from_scraper_output(scraper_output)
+
+    for identifier, input_type in [(Aspirin.smiles, 'smiles'), (Aspirin.cid, 'cid')]:
+        c = cache.get(identifier, input_type)
+        assert c is not None, f"identified compound became a miss after warming: {input_type}"
+        identity = (c.cid, c.smiles, c.inchi, c.iupac)
+        assert identity == (Aspirin.cid, Aspirin.smiles, Aspirin.inchi, Aspirin.iupac), \
+            f"warming changed the identity: {identity}"
+        assert c.properties.get("mw") == "180.16", f"vendor csv properties not merged: {c.properties}"
+    assert cache.get(Aspirin.smiles, 'smiles').properties.get("mp") == "134-136 °C (lit.)", \
+        "scraper properties not merged"
+    cache.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=100_000)
+    parser.add_argument("--check", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        bench(args.n, workdir)
+        if args.check:
+            check_warm_after_identify(workdir)
+            print("compound cache check passed")
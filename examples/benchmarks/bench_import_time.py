@@ -0,0 +1,68 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+"""
+import time of the package in fresh interpreters, and which heavy dependencies each import pulls in
+
+run with `--check` to guard against regressions: it fails if `import ChemScraper` loads one of `HeavyModules`
+or takes longer than `--max-seconds`
+"""
+
+HeavyModules = ('rdkit', 'selenium', 'pandas', 'numpy', 'fake_useragent', 'webdriver_manager', 'pyarrow', 'bs4')
+
+Scenarios = {
+    "import ChemScraper": "import ChemScraper",
+    "pubchem worker": "from ChemScraper import identify_compounds, parse_formula",
+    "scraper": "from ChemScraper import get_chrome_driver, get_sigma_aldrich_patables",
+}
+
+_probe = """
+import resource, sys, time, json
+ts = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - ts
+print(json.dumps({{
+    "seconds": elapsed,
+    "maxrss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "heavy": [m for m in {heavy!r} if m in sys.modules],
+}}))
+"""
+
+
+def measure(statement: str, repeat: int) -> dict:
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", _probe.format(statement=statement, heavy=HeavyModules)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+    return {
+        "seconds": statistics.median(r["seconds"] for r in runs),
+        "maxrss_mb": statistics.median(r["maxrss_mb"] for r in runs),
+        "heavy": runs[-1]["heavy"],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--max-seconds", type=float, default=1.0)
+    args = parser.parse_args()
+
+    results = dict()
+    print("{:<20}{:>12}{:>12}  {}".format("scenario", "median (s)", "rss (MB)", "heavy modules loaded"))
+    for name, statement in Scenarios.items():
+        results[name] = measure(statement, args.repeat)
+        r = results[name]
+        print("{:<20}{:>12.3f}{:>12.1f}  {}".format(name, r["seconds"], r["maxrss_mb"], ", ".join(r["heavy"]) or "-"))
+
+    if args.check:
+        bare = results["import ChemScraper"]
+        assert not bare["heavy"], f"`import ChemScraper` loads heavy modules: {bare['heavy']}"
+        assert bare["seconds"] <= args.max_seconds, f"`import ChemScraper` took {bare['seconds']:.3f} s"
+        print("import time check passed")
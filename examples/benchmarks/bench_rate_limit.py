@@ -0,0 +1,147 @@
+import argparse
+import bisect
+import itertools
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ChemScraper import settings
+
+"""
+requests seen by a local fake pug server, to check the NCBI rate limits without touching pubchem
+
+`settings.PubchemPugUrl` is pointed at the fake server, then
+- burst: `--burst` threads call `request_pug` at the same time
+- identify: `identify_compounds(concurrent=True)` on `--n` smiles in chunks of `--chunk-size`, every submit
+  and poll goes to the fake server, which finishes a job after `--job-seconds`
+
+run with `--check` to fail if any window of a limit in `--limits` saw more requests than allowed,
+`--limits 5/1 20/10` makes the per-minute style limit bind within a short run
+"""
+
+
+class FakePug:
+
+    def __init__(self, job_seconds: float):
+        self.job_seconds = job_seconds
+        self.arrivals = []
+        # reqid -> (submitted at, output type, identifiers)
+        self.jobs = dict()
+        self.reqids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.url = None
+
+    def handle_post(self, body: str) -> str:
+        with self.lock:
+            self.arrivals.append(time.monotonic())
+        reqid = re.search(r"<PCT-Request_reqid>(\d+)</PCT-Request_reqid>", body)
+        if reqid is None:
+            output_type = re.search(r'<PCT-QueryIDExchange_output-type value="(\w+)"/>', body).group(1)
+            identifiers = re.findall(r"<PCT-(?:QueryUids_\w+|ID-List_uids)_E>(.*?)</", body)
+            with self.lock:
+                reqid = str(next(self.reqids))
+                self.jobs[reqid] = (time.monotonic(), output_type, identifiers)
+            return f"<PCT-Data><PCT-Waiting_reqid>{reqid}</PCT-Waiting_reqid></PCT-Data>"
+        reqid = reqid.group(1)
+        job = self.jobs.get(reqid)
+        if job is None or time.monotonic() - job[0] < self.job_seconds:
+            return '<PCT-Data><PCT-Status value="running"/></PCT-Data>'
+        return f'<PCT-Data><PCT-Status value="success"/>' \
+               f'<PCT-Download-URL_url>{self.url}/results/{reqid}</PCT-Download-URL_url></PCT-Data>'
+
+    def handle_get(self, reqid: str) -> str:
+        _, output_type, identifiers = self.jobs[reqid]
+        lines = []
+        for i, identifier in enumerate(identifiers):
+            value = {"cid": str(1000 + i), "smiles": identifier}.get(output_type, f"{output_type}-{i}")
+            lines.append(f"{identifier}\t{value}\n")
+        return "".join(lines)
+
+    def serve(self) -> ThreadingHTTPServer:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def _reply(self, text: str):
+                data = text.encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                self._reply(fake.handle_post(self.rfile.read(int(self.headers["Content-Length"])).decode()))
+
+            def do_GET(self):
+                self._reply(fake.handle_get(self.path.rsplit("/", 1)[-1]))
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{server.server_port}"
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def max_in_window(arrivals: list[float], period: float) -> int:
+    """ the largest number of arrivals within any window of `period` seconds """
+    arrivals = sorted(arrivals)
+    return max([bisect.bisect_left(arrivals, t + period) - i for i, t in enumerate(arrivals)], default=0)
+
+
+def parse_limit(text: str) -> tuple[int, float]:
+    calls, period = text.split("/")
+    return int(calls), float(period)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--limits", nargs="+", type=parse_limit, default=list(settings.NcbiRateLimits),
+                        help="calls/seconds, defaults to `settings.NcbiRateLimits`")
+    parser.add_argument("--burst", type=int, default=20)
+    parser.add_argument("--n", type=int, default=200, help="smiles to identify")
+    parser.add_argument("--chunk-size", type=int, default=20)
+    parser.add_argument("--job-seconds", type=float, default=1.0)
+    parser.add_argument("--tolerance", type=float, default=0.02,
+                        help="seconds a request may arrive early because of network jitter")
+    parser.add_argument("--check", action="store_true")
+    args = parser.parse_args()
+
+    # the shared limiter is created from the settings when `ChemScraper.pubchem` is imported
+    settings.NcbiRateLimits = tuple(args.limits)
+    fake = FakePug(args.job_seconds)
+    server = fake.serve()
+    settings.PubchemPugUrl = fake.url
+    from ChemScraper.pubchem.gateway import request_pug, identify_compounds, _generate_pug_fetch_xml
+
+    results = dict()
+    ts = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.burst) as executor:
+        list(executor.map(request_pug, [_generate_pug_fetch_xml("0")] * args.burst))
+    results["burst"] = (fake.arrivals, time.perf_counter() - ts)
+
+    fake.arrivals = []
+    ts = time.perf_counter()
+    compounds = identify_compounds([f"C{'C' * i}O" for i in range(args.n)], concurrent=True,
+                                   chunk_size=args.chunk_size)
+    assert len(compounds) == args.n, f"identified {len(compounds)}/{args.n} compounds"
+    results["identify"] = (fake.arrivals, time.perf_counter() - ts)
+    server.shutdown()
+
+    print("{:<12}{:>10}{:>12}  {}".format("scenario", "requests", "seconds", "max requests in a window (limit)"))
+    exceeded = []
+    for name, (arrivals, elapsed) in results.items():
+        seen = []
+        for calls, period in args.limits:
+            n = max_in_window(arrivals, period - args.tolerance)
+            seen.append(f"{n} in {period:g} s ({calls})")
+            if n > calls:
+                exceeded.append(f"{name}: {n} requests in {period:g} s, limit: {calls}")
+        print("{:<12}{:>10}{:>12.2f}  {}".format(name, len(arrivals), elapsed, ", ".join(seen)))
+
+    if args.check:
+        assert not exceeded, f"rate limits exceeded: {exceeded}"
+        print("rate limit check passed")
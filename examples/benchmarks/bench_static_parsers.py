@@ -0,0 +1,121 @@
+import argparse
+import os
+import timeit
+
+from ChemScraper.vscraper.backend import ScraperBackend, StaticBackend, FallbackBackend
+from ChemScraper.vscraper.sigma_aldrich import parse_sigma_aldrich_patable_html, parse_sigma_aldrich_properties_html
+from ChemScraper.vscraper.thermo_fisher import parse_thermo_fisher_patable_html
+
+"""
+the static html parsers of `StaticBackend` on saved product pages in `fixtures`
+
+prints the time to parse each page, run with `--check` to also compare the parsed tables and properties
+with what the pages hold, and to check that `FallbackBackend` moves on to the next backend when a page
+cannot be parsed (e.g. its price table is rendered by javascript)
+"""
+
+_fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+SigmaUrl = "https://www.sigmaaldrich.com/US/en/product/sial/242381"
+
+ThermoUrl = "https://www.fishersci.com/shop/products/benzoic-acid-99-5-acs-reagent-thermo-scientific/AC130120050"
+
+# fixture -> (parser name, parser, url, expected result)
+Cases = {
+    "sigma_aldrich_product_page.html": [
+        ("sigma patable", parse_sigma_aldrich_patable_html, SigmaUrl, [
+            {"SKU": "242381-5G", "Pack Size": "5 G", "Availability": "Available to ship on 10/20/2026",
+             "Price": "$36.20", "Quantity": "0", "url": SigmaUrl},
+            {"SKU": "242381-25G", "Pack Size": "25 G", "Availability": "Available to ship", "Price": "$61.80",
+             "Quantity": "0", "url": SigmaUrl},
+            {"SKU": "242381-1KG", "Pack Size": "1 KG", "Availability": "Available to ship", "Price": "$1,047.70",
+             "Quantity": "0", "url": SigmaUrl},
+        ]),
+        ("sigma properties", lambda html, url: parse_sigma_aldrich_properties_html(html), SigmaUrl, {
+            "grade": "ACS reagent", "assay": "≥99.5%", "form": "powder\ncrystals", "mp": "121-125 °C (lit.)",
+        }),
+    ],
+    "thermo_fisher_product_page.html": [
+        ("thermo fisher patable", parse_thermo_fisher_patable_html, ThermoUrl, [
+            {"product_url": ThermoUrl, "sds_url": "https://www.fishersci.com/store/msds?partNumber=AC130120050",
+             "quantity": quantity, "price": price, "unit": unit}
+            for quantity, price, unit in [("5 g", "$41.65", "Each"), ("100 g", "$88.25", "Each"),
+                                          ("500 g", "$231.00", "Case of 4")]
+        ]),
+    ],
+}
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(_fixtures, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def as_records(result):
+    return result.to_dict(orient="records") if hasattr(result, "to_dict") else result
+
+
+class FixtureBackend(StaticBackend):
+
+    def __init__(self, pages: dict[str, str]):
+        """ a `StaticBackend` reading url -> fixture instead of sending requests """
+        super().__init__()
+        self.pages = pages
+
+    def fetch(self, url: str) -> str:
+        return read_fixture(self.pages[url])
+
+
+class RecordingBackend(ScraperBackend):
+
+    def __init__(self):
+        """ stands in for a browser, records the pages it is asked for """
+        self.scraped = []
+
+    def supports(self, vendor: str, page_type: str) -> bool:
+        return True
+
+    def scrape(self, vendor: str, page_type: str, url: str):
+        self.scraped.append((vendor, page_type, url))
+        return "rendered"
+
+
+def check_fallback():
+    rendered_url = SigmaUrl + "-rendered-by-js"
+    static = FixtureBackend({SigmaUrl: "sigma_aldrich_product_page.html",
+                             rendered_url: "sigma_aldrich_product_page_rendered_by_js.html"})
+    browser = RecordingBackend()
+    backend = FallbackBackend([static, browser])
+    assert as_records(backend.scrape("Sigma-Aldrich", "patable", SigmaUrl)) == Cases[
+        "sigma_aldrich_product_page.html"][0][3], "a parsable page must not fall back"
+    assert browser.scraped == [], "a parsable page must not fall back"
+    for page_type in ("patable", "properties"):
+        assert backend.scrape("Sigma-Aldrich", page_type, rendered_url) == "rendered"
+    assert len(browser.scraped) == 2, f"unparsable pages must fall back: {browser.scraped}"
+    try:
+        FallbackBackend([static]).scrape("Sigma-Aldrich", "search", SigmaUrl)
+    except LookupError:
+        pass
+    else:
+        raise AssertionError("an unsupported page type must raise LookupError")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=200)
+    parser.add_argument("--check", action="store_true")
+    args = parser.parse_args()
+
+    print("{:<36}{:<24}{:>12}".format("fixture", "parser", "us / page"))
+    for name, cases in Cases.items():
+        html = read_fixture(name)
+        for parser_name, parse, url, expected in cases:
+            t = timeit.timeit(lambda: parse(html, url), number=args.number) / args.number
+            print("{:<36}{:<24}{:>12.1f}".format(name, parser_name, t * 1e6))
+            if args.check:
+                parsed = as_records(parse(html, url))
+                assert parsed == expected, f"{parser_name} on {name}:\n{parsed}\n!=\n{expected}"
+
+    if args.check:
+        check_fallback()
+        print("static parser check passed")
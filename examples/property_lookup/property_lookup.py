@@ -1,27 +1,19 @@
-import glob
-import os.path
-import random
-import time
-
 from loguru import logger
 from rdkit.Chem import Descriptors
 from rdkit.Chem import MolFromSmiles
 from rdkit.Chem import rdMolDescriptors
-from tqdm import tqdm
 
 from ChemScraper import get_chrome_driver, json_load, identify_compound, get_sigma_aldrich_properties_from_cas, \
-    get_cas_number, get_sigma_aldrich_properties_from_mf, json_dump
+    get_cas_number, get_sigma_aldrich_properties_from_mf, json_dump, RateLimiter, Campaign
 
 browser_driver = get_chrome_driver(headless=True)
 unique_smis = json_load("scraper_input.json")
+# at most one compound every 10 s, only the remainder of a fast iteration is waited
+compound_limiter = RateLimiter(((1, 10),))
 
-for smi in tqdm(unique_smis):
-    logger.info(f"working on: {smi}")
-    outfile = f"prop/{smi}.json"
-    if os.path.isfile(outfile) and os.path.getsize(outfile) > 0:
-        logger.info(f"outfile already exists, skipping for: {smi}")
-        continue
 
+def lookup_properties(smi: str) -> dict:
+    logger.info(f"working on: {smi}")
     try:
         compound = identify_compound(identifier=smi, input_type="smiles")
         cas = get_cas_number(compound.cid)
@@ -33,20 +25,18 @@ for smi in tqdm(unique_smis):
         mf = rdMolDescriptors.CalcMolFormula(mol)
         logger.warning(f"search prop using molecular formula instead: \nmf = {mf} mw = {mw}")
         prop = get_sigma_aldrich_properties_from_mf(browser_driver, mf)
-    prop_data = {
-        "smiles": smi,
-        "property_dict": prop,
-    }
-    json_dump(prop_data, f"prop/{smi}.json")
     logger.info(f"properties saved for: {smi}")
-    wait_time = 10 + random.random() * 5
-    logger.info(f"waiting for: {wait_time}")
-    time.sleep(wait_time)
-    logger.info("\n")
+    return prop
+
+
+# tasks and results live in one sqlite file, rerun this script to resume an interrupted lookup
+campaign = Campaign("property_lookup.sqlite")
+campaign.add(unique_smis)
 
-scraper_output = {}
-for jsonfile in glob.glob("prop/*.json"):
-    data = json_load(jsonfile)
-    scraper_output[data['smiles']] = data['property_dict']
+# one browser, tasks run one at a time
+campaign.run(lookup_properties, max_workers=1, max_retries=2, backoff=30, limiter=compound_limiter)
+for smi, attempts, error in campaign.failures():
+    logger.critical(f"FAILED after {attempts} attempts: {smi}, {error}")
 
+scraper_output = dict(campaign.iter_results())
 json_dump(scraper_output, "scraper_output.json")
@@ -5,15 +5,17 @@ import glob
 from collections import defaultdict
 import re
 
+from ChemScraper.utils.columnar import read_table
+
 
 def pool(suggestion_csv: FilePath, folder: FilePath):
 
     label_to_vendor_record = defaultdict(dict)
-    for result_csv in glob.glob(f"{folder}/*.csv"):
-        result_csv_name = os.path.basename(result_csv)[:-4]
+    for result_csv in glob.glob(f"{folder}/*.csv") + glob.glob(f"{folder}/*.parquet"):
+        result_csv_name = os.path.splitext(os.path.basename(result_csv))[0]
         result_csv_name, vendor = result_csv_name.split('.')
         label, cas = result_csv_name.split('--')
-        df = pd.read_csv(result_csv)
+        df = read_table(result_csv)
         df = df[[c for c in df.columns if 'unnamed' not in c.lower()]]
 
         r = df.to_dict(orient='records')[0]